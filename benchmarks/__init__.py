@@ -0,0 +1 @@
+"""Offline benchmarks, run from the repository root with `python -m benchmarks.<name>`."""
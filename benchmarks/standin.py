@@ -0,0 +1,222 @@
+"""Local Common Crawl stand-in.
+
+Serves synthetic WARC files over HTTP with Range support so downloads can be tested offline.
+
+"""
+
+import base64
+import gzip
+import hashlib
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE_PATTERN = re.compile(r"(\d+)-(\d+)")
+BOUNDARY = 'STANDIN_BOUNDARY'
+CHUNK_SIZE = 64 * 1024 # bytes written at a time when bandwidth is limited
+WORDS = ['common', 'crawl', 'record', 'archive', 'page', 'content', 'example', 'network', 'thread', 'parser']
+
+def make_pages(count: int, size: int = 4096, seed: int = 0) -> list[tuple]:
+    """Builds `count` (url, html) pairs whose html is roughly `size` bytes of pseudo-random prose."""
+    rng = random.Random(seed)
+    pages = []
+    for i in range(count):
+        words = []
+        length = 0
+        while length < size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        pages.append((
+            f'https://www.example.com/page-{i}',
+            f'<html><body><article><p>Page {i}. ' + ' '.join(words) + '.</p></article></body></html>',
+        ))
+    return pages
+
+def make_warc_record(url: str, html: str) -> bytes:
+    """Builds a single gzip member holding a WARC response record, like Common Crawl stores them."""
+    body = html.encode('utf-8')
+    http_block = (
+        b"HTTP/1.1 200 OK\r\n"
+        b"Content-Type: text/html; charset=UTF-8\r\n"
+        + f"Content-Length: {len(body)}\r\n".encode()
+        + b"\r\n"
+        + body
+    )
+    warc_block = (
+        b"WARC/1.0\r\n"
+        b"WARC-Type: response\r\n"
+        + f"WARC-Target-URI: {url}\r\n".encode()
+        + b"Content-Type: application/http; msgtype=response\r\n"
+        + f"Content-Length: {len(http_block)}\r\n".encode()
+        + b"\r\n"
+        + http_block
+        + b"\r\n\r\n"
+    )
+    return gzip.compress(warc_block)
+
+def make_warc_file(filename: str, pages: list[tuple]) -> tuple:
+    """Builds a WARC file out of (url, html) pairs.
+
+    Returns:
+        The file content and the index results pointing into it.
+
+    """
+    content = b''
+    results = []
+    for i, (url, html) in enumerate(pages):
+        record = make_warc_record(url, html)
+        results.append({
+            'urlkey': f'com,example)/page-{i}',
+            'url': url,
+            'digest': base64.b32encode(hashlib.sha1(html.encode('utf-8')).digest()).decode(),
+            'filename': filename,
+            'offset': str(len(content)),
+            'length': str(len(record)),
+        })
+        content += record
+    return content, results
+
+class StandinServer:
+    """Threaded HTTP server serving in-memory files with Range support.
+
+    Attributes:
+        files: Mapping of path (e.g. 'crawl-data/...warc.gz') to content.
+        range_mode: 'multi' to answer multi-range requests with multipart/byteranges,
+            'single' to only answer the first range like S3, 'none' to ignore Range headers.
+        latency: Seconds to wait before answering each request.
+        bandwidth: Bytes per second each response is written at, unlimited if None.
+        error_rate: Fraction of requests answered with 503 SlowDown at random.
+        throttle_first: Number of requests answered with 503 SlowDown before serving normally.
+        requests: Number of requests served.
+        bytes_sent: Number of body bytes served.
+        latencies: Seconds from receiving each request to writing its last byte.
+        connections: Set of client addresses seen, one per TCP connection.
+
+    """
+
+    def __init__(self,
+        files: dict = None,
+        range_mode: str = 'multi',
+        latency: float = 0,
+        bandwidth: float = None,
+        error_rate: float = 0,
+        seed: int = 0,
+    ) -> None:
+        self.files = files or {}
+        self.range_mode = range_mode
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle_first = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.latencies = []
+        self.connections = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url_template(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/{{filename}}"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive
+
+            def log_message(self, *args):
+                pass
+
+            def send_body(self, status: int, body: bytes, headers: dict = None) -> None:
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if standin.bandwidth:
+                    for start in range(0, len(body), CHUNK_SIZE):
+                        chunk = body[start:start + CHUNK_SIZE]
+                        self.wfile.write(chunk)
+                        time.sleep(len(chunk) / standin.bandwidth)
+                else:
+                    self.wfile.write(body)
+                with standin._lock:
+                    standin.bytes_sent += len(body)
+
+            def do_GET(self):
+                start_time = time.monotonic()
+                try:
+                    self.answer()
+                finally:
+                    with standin._lock:
+                        standin.latencies.append(time.monotonic() - start_time)
+
+            def answer(self):
+                with standin._lock:
+                    standin.requests += 1
+                    standin.connections.add(self.client_address)
+                    throttle = standin.requests <= standin.throttle_first \
+                        or standin._random.random() < standin.error_rate
+
+                if standin.latency:
+                    time.sleep(standin.latency)
+
+                if throttle:
+                    self.send_body(503, b'SlowDown')
+                    return
+
+                content = standin.files.get(self.path.lstrip('/'))
+                if content is None:
+                    self.send_body(404, b'')
+                    return
+
+                ranges = [
+                    (int(start), min(int(end), len(content) - 1))
+                    for start, end in RANGE_PATTERN.findall(self.headers.get('Range', ''))
+                ]
+                if not ranges or standin.range_mode == 'none':
+                    self.send_body(200, content)
+                    return
+
+                if len(ranges) == 1 or standin.range_mode == 'single':
+                    start, end = ranges[0]
+                    self.send_body(206, content[start:end + 1], {
+                        'Content-Range': f'bytes {start}-{end}/{len(content)}',
+                    })
+                    return
+
+                body = b''
+                for start, end in ranges:
+                    body += (
+                        f'\r\n--{BOUNDARY}\r\n'
+                        f'Content-Type: application/octet-stream\r\n'
+                        f'Content-Range: bytes {start}-{end}/{len(content)}\r\n\r\n'
+                    ).encode() + content[start:end + 1]
+                body += f'\r\n--{BOUNDARY}--\r\n'.encode()
+                self.send_body(206, body, {
+                    'Content-Type': f'multipart/byteranges; boundary={BOUNDARY}',
+                })
+
+        return Handler
+
+    def start(self) -> 'StandinServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StandinServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
@@ -0,0 +1,224 @@
+"""End-to-end throughput benchmark.
+
+Downloads and extracts synthetic records from a local Common Crawl stand-in, so every performance
+change can be judged offline and without load on Common Crawl.
+
+    python -m benchmarks.throughput --records 2000 --threads 50 --latency 0.05
+    python -m benchmarks.throughput --records 2000 --threads 50 --coalesce --extract_workers 4
+
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from comcrawl.core import IndexClient
+from comcrawl.utils.custom_types import ResultList
+from comcrawl.utils.download import get_multiple_extracts
+from comcrawl.utils.download_async import get_multiple_extracts_async
+from comcrawl.utils.metrics import METRICS
+from comcrawl.utils.transport import Transport
+from benchmarks.standin import StandinServer, make_pages, make_warc_file
+
+FILENAME_TEMPLATE = 'crawl-data/CC-MAIN-2024-26/segments/1/warc/CC-MAIN-20240614075213-20240614105213-{:05d}.warc.gz'
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile, `q` in [0, 100]."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+def peak_rss_mb() -> float:
+    """Lifetime peak resident set size of this process plus that of its largest child (e.g. an extract worker), in MB.
+
+    Includes whatever ran before, see `RssSampler` for the peak of one run.
+
+    """
+    scale = 1 if sys.platform == 'darwin' else 1024 # bytes on macOS, kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak * scale / 1024 ** 2
+
+def rss_mb(pid: str = 'self') -> float:
+    """Current resident set size of a process in MB, 0 where /proc is not available."""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+def child_pids() -> list:
+    """Pids of the live children of this process, e.g. extract workers."""
+    pids = []
+    for fp in glob.glob('/proc/self/task/*/children'):
+        try:
+            with open(fp) as f:
+                pids.extend(f.read().split())
+        except OSError:
+            pass
+    return pids
+
+class RssSampler:
+    """Peak resident set size of this process plus its largest child while in use, sampled every `interval` seconds.
+
+    Falls back to the lifetime peak of `peak_rss_mb` where /proc is not available. The sampling thread holds
+    no lock shared with the download, so process pools forked while it runs are safe.
+
+    """
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='RssSampler', daemon=True)
+
+    def sample(self) -> None:
+        children = [rss_mb(pid) for pid in child_pids()]
+        self.peak_mb = max(self.peak_mb, rss_mb() + max(children, default=0.0))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> 'RssSampler':
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        self.peak_mb = self.peak_mb or peak_rss_mb()
+
+def make_files(records: int, files: int, page_size: int) -> tuple:
+    """Spreads `records` synthetic pages over `files` WARC files.
+
+    Returns:
+        Mapping of path to content, and the index results pointing into the files.
+
+    """
+    pages = make_pages(records, page_size)
+    contents, results = {}, []
+    for i in range(files):
+        filename = FILENAME_TEMPLATE.format(i)
+        contents[filename], file_results = make_warc_file(filename, pages[i::files])
+        results.extend(file_results)
+    return contents, results
+
+def run_benchmark(
+    records: int = 1000,
+    files: int = 10,
+    page_size: int = 4096,
+    latency: float = 0,
+    bandwidth: float = None,
+    error_rate: float = 0,
+    range_mode: str = 'multi',
+    threads: int = None,
+    engine: str = 'thread',
+    client: bool = False,
+    outdir: str = None,
+    **kwargs,
+) -> dict:
+    """Runs one download of synthetic records against a local stand-in.
+
+    Args:
+        records: number of records to download
+        files: number of WARC files the records are spread over
+        page_size: approximate size of each html page in bytes
+        latency: seconds the stand-in waits before answering each request
+        bandwidth: bytes per second the stand-in writes each response at
+        error_rate: fraction of requests the stand-in answers with 503 SlowDown
+        range_mode: 'multi', 'single' or 'none', see `StandinServer`
+        threads: number of threads, or records in flight with the async engine
+        engine: 'thread' or 'async'
+        client: whether to go through `IndexClient.populate_results` instead of the download helpers
+        outdir: where to cache extracts, a temporary directory if not set
+        **kwargs: passed on to the download, e.g. coalesce, max_gap, max_ranges, extract_workers
+
+    Returns:
+        Report with records/s, MB/s, p50/p99 request latency, peak RSS and metrics, all of this run alone.
+
+    """
+    contents, results = make_files(records, files, page_size)
+    with tempfile.TemporaryDirectory() as tmpdir, \
+            StandinServer(contents, range_mode, latency, bandwidth, error_rate) as standin:
+        outdir = outdir or tmpdir
+        transport = Transport(data_url_template=standin.url_template)
+
+        before = METRICS.snapshot()
+        with RssSampler() as rss:
+            start_time = time.monotonic()
+            if client:
+                ic = IndexClient(outdir=outdir, transport=transport)
+                ic.results = results
+                ic.populate_results(threads=threads, engine=engine, **kwargs)
+                out: ResultList = ic.results
+            elif engine == 'async':
+                out: ResultList = get_multiple_extracts_async(
+                    results, outdir, concurrency=threads, transport=transport, **kwargs,
+                )
+            else:
+                out: ResultList = get_multiple_extracts(
+                    results, outdir, threads=threads, transport=transport, **kwargs,
+                )
+            elapsed = time.monotonic() - start_time
+
+        return {
+            'records': len(out),
+            'seconds': round(elapsed, 3),
+            'records_per_s': round(len(out) / elapsed, 1),
+            'mb_per_s': round(standin.bytes_sent / elapsed / 1024 ** 2, 2),
+            'requests': standin.requests,
+            'latency_p50_ms': round(percentile(standin.latencies, 50) * 1000, 1),
+            'latency_p99_ms': round(percentile(standin.latencies, 99) * 1000, 1),
+            'peak_rss_mb': round(rss.peak_mb, 1),
+            'metrics': METRICS.since(before),
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='end-to-end download throughput against a local Common Crawl stand-in')
+    parser.add_argument('--records', help='number of records', type=int, default=1000)
+    parser.add_argument('--files', help='number of warc files', type=int, default=10)
+    parser.add_argument('--page_size', help='approximate html size per record in bytes', type=int, default=4096)
+    parser.add_argument('--latency', help='seconds before the stand-in answers', type=float, default=0)
+    parser.add_argument('--bandwidth', help='bytes/s per response', type=float, default=None)
+    parser.add_argument('--error_rate', help='fraction of requests answered with 503', type=float, default=0)
+    parser.add_argument('--range_mode', help='multi-range support of the stand-in', type=str,
+        choices=['multi','single','none'], default='multi')
+    parser.add_argument('--threads', help='number of threads (records in flight with --engine async)',
+        type=int, default=None)
+    parser.add_argument('--engine', help='download engine', type=str, choices=['thread','async'], default='thread')
+    parser.add_argument('--client', help='go through IndexClient.populate_results', action='store_true')
+    parser.add_argument('--coalesce', help='merge nearby records of a warc file into single range reads',
+        action='store_true')
+    parser.add_argument('--max_ranges', help='max ranges per multi-range request', type=int, default=None)
+    parser.add_argument('--max_bytes_in_flight', help='cap on bytes of records downloading at once',
+        type=int, default=None)
+    parser.add_argument('--extract_workers', help='number of processes extracting content', type=int, default=None)
+    parser.add_argument('--parse_workers', help='number of threads decoding records for the extract workers',
+        type=int, default=None)
+    args = parser.parse_args()
+
+    kwargs = {}
+    if args.coalesce: kwargs['coalesce'] = True
+    if args.max_ranges: kwargs['max_ranges'] = args.max_ranges
+    if args.max_bytes_in_flight: kwargs['max_bytes_in_flight'] = args.max_bytes_in_flight
+    if args.extract_workers: kwargs[
+        'extract_workers' if args.engine == 'thread' or args.client else 'extract_threads'
+    ] = args.extract_workers
+    if args.parse_workers: kwargs['parse_workers'] = args.parse_workers
+
+    report = run_benchmark(
+        args.records, args.files, args.page_size, args.latency, args.bandwidth, args.error_rate, args.range_mode,
+        args.threads, args.engine, args.client, **kwargs,
+    )
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
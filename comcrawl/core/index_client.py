@@ -5,18 +5,34 @@ This module contains the core object of the package.
 """
 
 import logging
+import os
 from pathlib import Path
-from ..utils.custom_types import Index, IndexList, ResultList
+from typing import Iterator
+from ..utils.custom_types import Index, IndexList, Result, ResultList
 from ..utils import (
     download_available_indexes,
     get_single_index,get_multiple_indexes,
     get_single_record,
-    get_single_extract,get_multiple_extracts,
+    get_single_extract,get_multiple_extracts,iter_multiple_extracts,
+    get_multiple_extracts_async,
     read_json,write_json,
-    strip_cache,redump_cache,
+    strip_cache,redump_cache,flush_cache,
+    Transport,
+    MAX_GAP,
+    Shard,select_shard,register_shard,merge_shards,
+    filter_done,flush_manifests,
+    load_digest_index,filter_duplicates,write_references,DEDUP_MODES,
+    query_cache,migrate_cache,
+    index_cache_path,manifest_for,
+    LIFECYCLE,SHUTDOWN_DEADLINE,
+    METRICS,MetricsExporter,
+    Autotuner,ConcurrencyGate,concurrency_knob,gate_knob,
+    make_process_pool,
 )
 import pandas as pd
 
+ENGINES = ('thread', 'async')
+
 # with HK in domain filter
 EXECUTION_IDS = {
     # batch 4
@@ -206,12 +222,28 @@ class IndexClient:
         should_save_records: bool = False,
         should_save_extracts: bool = False,
         verbose: bool = False,
+        transport: Transport = None,
+        shard: Shard = None,
+        shard_key: str = 'digest',
+        shutdown_deadline: float = SHUTDOWN_DEADLINE,
+        metrics_dir: str = None,
+        metrics_interval: float = 15.0,
     ) -> None:
         """Initializes the class instance.
 
         Args:
             indexes: Index to focus on.
             verbose: Whether to print debug level logs to the console while making HTTP requests.
+            transport: Pooled HTTP transport used for all searches and downloads, e.g. with rate limits,
+                or pointed to a local mock server for tests.
+            shard: Only download this share of the results, e.g. '3/8' (numbered from 0) or a `Shard`,
+                writing extracts to e.g. `extracts/{index}/shard-3-of-8/`, see `merge_shards`.
+            shard_key: Search result field hashed to pick the shard of a result, 'digest' or 'filename'.
+            shutdown_deadline: Seconds downloads in flight get to finish after a SIGTERM/SIGINT,
+                before the process exits without them, see `populate_results`.
+            metrics_dir: Where `populate_results` keeps a Prometheus textfile of its metrics up to date,
+                e.g. node_exporter's textfile collector directory, and writes a json summary once done.
+            metrics_interval: Seconds between two writes of the Prometheus textfile.
 
         """
         if verbose:
@@ -223,17 +255,25 @@ class IndexClient:
         self.should_save_records = should_save_records
         self.should_save_extracts = should_save_extracts
         self.results: ResultList = []
+        self.transport = transport or Transport()
+        self.shard = Shard.parse(shard, shard_key) if isinstance(shard, str) else shard
+        register_shard(self.outdir, self.shard)
+        self.shutdown_deadline = shutdown_deadline
+        self.metrics_dir = Path(metrics_dir) if metrics_dir else None
+        self.metrics_interval = metrics_interval
 
         # index
-        self._get_single_index = lambda url, index: get_single_index(url, index, self.outdir, self.should_save_indexes)
-        self._get_multiple_indexes = lambda url, indexes, threads: get_multiple_indexes(url, indexes, self.outdir, self.should_save_indexes, threads)
+        self._get_single_index = lambda url, index: get_single_index(url, index, self.outdir, self.should_save_indexes, self.transport)
+        self._get_multiple_indexes = lambda url, indexes, threads: get_multiple_indexes(url, indexes, self.outdir, self.should_save_indexes, threads, self.transport)
 
         # records
-        self._get_single_record = lambda result: get_single_record(result, self.outdir, self.should_save_records)
+        self._get_single_record = lambda result: get_single_record(result, self.outdir, self.should_save_records, self.transport)
 
         # extracts
-        self._get_single_extract = lambda result: get_single_extract(result, self.outdir, self.should_save_extracts)
-        self._get_multiple_extracts = lambda results, threads: get_multiple_extracts(results, self.outdir, self.should_save_extracts, threads)
+        self._get_single_extract = lambda result: get_single_extract(result, self.outdir, self.should_save_extracts, self.transport)
+        self._get_multiple_extracts = lambda results, threads, **kwargs: get_multiple_extracts(results, self.outdir, self.should_save_extracts, threads, self.transport, **kwargs)
+        self._iter_multiple_extracts = lambda results, threads, **kwargs: iter_multiple_extracts(results, self.outdir, self.should_save_extracts, threads, self.transport, **kwargs)
+        self._get_multiple_extracts_async = lambda results, concurrency, **kwargs: get_multiple_extracts_async(results, self.outdir, self.should_save_extracts, concurrency, self.transport, **kwargs)
 
     def strip_cache(self, indexdir: str) -> None: strip_cache(indexdir)
     def redump_cache(self, indexdir: str) -> None: redump_cache(indexdir)
@@ -343,13 +383,210 @@ class IndexClient:
         """
         self.results = self._get_multiple_indexes(url, self.indexes, threads)
 
-    def populate_results(self, threads: int = None) -> None:
+    def populate_results(self,
+        threads: int = None,
+        engine: str = 'thread',
+        coalesce: bool = False,
+        max_gap: int = MAX_GAP,
+        max_ranges: int = None,
+        extract_workers: int = None,
+        max_bytes_in_flight: int = None,
+        resume: bool = True,
+        parse_workers: int = None,
+        autotune: bool = False,
+        max_threads: int = None,
+        max_rss_mb: float = None,
+        dedup: str = None,
+    ) -> None:
         """Download.
 
         Downloads warc extracts for every search result in the `results` attribute.
 
         Args:
             threads: Number of threads to use. Enables multi-threading only if set.
+                With the async engine, the number of records in flight instead.
+            engine: 'thread' to download with a thread pool, 'async' to download on an asyncio event loop.
+            coalesce: Whether to merge nearby records of the same WARC file into single range reads (thread engine).
+            max_gap: Maximum number of unused bytes between two coalesced records.
+            max_ranges: Fetch sparse records of one WARC file up to `max_ranges` at a time with multi-range requests (thread engine).
+            extract_workers: Number of processes extracting content, fed by the download and parse threads through bounded queues (thread engine).
+                With the async engine, the number of threads extracting content.
+            max_bytes_in_flight: Cap on the bytes of records downloading at once, large and small records are interleaved (thread engine).
+            resume: Whether to skip results the resume manifest of their index lists as completed,
+                they are kept in the `results` attribute without downloading them again.
+            parse_workers: With `extract_workers`, number of threads gunzipping and decoding records (thread engine).
+            autotune: Whether to hill climb the download concurrency (starting from `threads`) and the number of
+                extract workers in use (starting from `extract_workers`) towards the most records/s while running,
+                the best values are logged to `{outdir}/autotune.jsonl` (thread engine).
+            max_threads: With `autotune`, upper bound of the download concurrency, defaults to 4 times `threads`.
+            max_rss_mb: With `autotune`, memory limit in MB above which the download concurrency is stepped down.
+            dedup: Whether to skip results whose content digest was already extracted from another crawl under `outdir`,
+                see `DigestIndex`: 'skip' keeps them in the `results` attribute (with the crawl under 'duplicate_of')
+                without downloading them, 'ref' also records a reference row in `extracts/{index}/{index}.refs.jsonl`
+                and marks them completed in the resume manifest.
+
+        On SIGTERM/SIGINT no new results are started, the ones in flight get `shutdown_deadline` seconds
+        to finish and cached extracts and manifests are flushed. This then returns with the results done
+        so far and `stopped` set, a rerun picks up the rest. A second signal or a passed deadline exits right away.
+
+        """
+        if engine not in ENGINES:
+            raise ValueError(f'unknown engine {engine}, expected one of {ENGINES}')
+        if dedup not in (None,) + DEDUP_MODES:
+            raise ValueError(f'unknown dedup {dedup}, expected one of {DEDUP_MODES}')
+
+        tuner, extract_gate = None, None
+        if autotune:
+            if engine != 'thread' or not threads:
+                raise ValueError('autotune needs the thread engine and a starting number of threads')
+            tuner, extract_gate, threads = self._make_autotuner(threads, max_threads, extract_workers, max_rss_mb)
+
+        done, pending = self._pending_results(resume, dedup)
+        extract_pool = None
+        if engine == 'thread' and extract_workers: # forked before the exporter and autotuner threads start
+            extract_pool = make_process_pool(extract_gate.max_limit if extract_gate else extract_workers)
+        exporter = MetricsExporter(self._metrics_path('.prom'), self.metrics_interval).start() if self.metrics_dir else None
+        if tuner:
+            tuner.start()
+        with LIFECYCLE.handle_signals(self.shutdown_deadline):
+            try:
+                if engine == 'async':
+                    self.results = done + self._get_multiple_extracts_async(pending, threads, extract_threads=extract_workers)
+                else:
+                    self.results = done + self._get_multiple_extracts(pending, threads, coalesce=coalesce, max_gap=max_gap, max_ranges=max_ranges, extract_workers=extract_workers, max_bytes_in_flight=max_bytes_in_flight, parse_workers=parse_workers, extract_gate=extract_gate, extract_pool=extract_pool)
+            finally:
+                if extract_pool:
+                    extract_pool.shutdown()
+                flush_cache()
+                flush_manifests()
+                if tuner:
+                    tuner.stop()
+                    self.transport.limiter.set_cap(None)
+                if exporter:
+                    exporter.stop()
+                    METRICS.write_summary(self._metrics_path('.json'))
+        if self.stopped:
+            print(f'[IndexClient] stopped by a signal, {len(self.results)} results done')
+
+    def iter_extracts(self,
+        threads: int = None,
+        ordered: bool = False,
+        buffer_size: int = None,
+        coalesce: bool = False,
+        max_gap: int = MAX_GAP,
+        max_ranges: int = None,
+        extract_workers: int = None,
+        max_bytes_in_flight: int = None,
+        resume: bool = True,
+        parse_workers: int = None,
+        dedup: str = None,
+    ) -> Iterator[Result]:
+        """Download, streaming.
+
+        Like `populate_results`, but yields every processed search result as soon as it is done
+        instead of collecting them into the `results` attribute, so they can be consumed and
+        dropped in constant memory. SIGTERM/SIGINT end the stream as in `populate_results`.
+
+        Args:
+            threads: Number of threads to use. Enables multi-threading only if set.
+            ordered: Whether to yield results in the order of the `results` attribute,
+                not supported together with coalesce, max_ranges, extract_workers or max_bytes_in_flight.
+            buffer_size: With `ordered`, maximum number of results in flight or waiting for an earlier one.
+            coalesce: Whether to merge nearby records of the same WARC file into single range reads.
+            max_gap: Maximum number of unused bytes between two coalesced records.
+            max_ranges: Fetch sparse records of one WARC file up to `max_ranges` at a time with multi-range requests.
+            extract_workers: Number of processes extracting content, fed by the download and parse threads through bounded queues.
+            max_bytes_in_flight: Cap on the bytes of records downloading at once, large and small records are interleaved.
+            resume: Whether to skip results the resume manifest of their index lists as completed.
+            parse_workers: With `extract_workers`, number of threads gunzipping and decoding records.
+            dedup: Whether to skip results whose content another crawl already extracted, 'skip' or 'ref', see `populate_results`.
+
+        Yields:
+            Processed search results, completed ones skipped by `resume` and duplicates skipped by `dedup` are not yielded.
+
+        """
+        if dedup not in (None,) + DEDUP_MODES:
+            raise ValueError(f'unknown dedup {dedup}, expected one of {DEDUP_MODES}')
+        _, pending = self._pending_results(resume, dedup)
+        with LIFECYCLE.handle_signals(self.shutdown_deadline):
+            try:
+                yield from self._iter_multiple_extracts(
+                    pending, threads,
+                    coalesce=coalesce, max_gap=max_gap, max_ranges=max_ranges, extract_workers=extract_workers,
+                    ordered=ordered, buffer_size=buffer_size, max_bytes_in_flight=max_bytes_in_flight, parse_workers=parse_workers,
+                )
+            finally:
+                flush_cache()
+                flush_manifests()
+
+    def _make_autotuner(self, threads: int, max_threads: int, extract_workers: int, max_rss_mb: float) -> tuple:
+        """Autotuner starting from `threads` and `extract_workers`.
+
+        Returns:
+            The autotuner, the gate in front of the extract workers (None without them)
+            and the number of download threads to start, all but the tuned number of them idle.
+
+        """
+        max_threads = max(max_threads or 4 * threads, threads)
+        self.transport.limiter.set_cap(threads)
+        knobs = [concurrency_knob(self.transport.limiter, 1, max_threads)]
+        extract_gate = None
+        if extract_workers:
+            extract_gate = ConcurrencyGate(extract_workers, max(extract_workers, os.cpu_count()))
+            knobs.append(gate_knob('extract_workers', extract_gate))
+        tuner = Autotuner(knobs, max_rss_mb=max_rss_mb, log_path=self.outdir / 'autotune.jsonl')
+        return tuner, extract_gate, max_threads
+
+    def _metrics_path(self, suffix: str) -> Path:
+        """Metrics file of this client, one per shard so that jobs can share a directory."""
+        name = f'comcrawl-{self.shard.dirname}' if self.shard else 'comcrawl'
+        return self.metrics_dir / f'{name}{suffix}'
+
+    @property
+    def stopped(self) -> bool:
+        """Whether the last download was cut short by SIGTERM/SIGINT."""
+        return LIFECYCLE.stopping
+
+    def _pending_results(self, resume: bool = True, dedup: str = None) -> tuple:
+        """Splits the results of this client's shard into completed (or duplicate) and pending ones."""
+        results = self.results
+        if self.shard:
+            results = select_shard(results, self.shard)
+            print(f'[IndexClient] shard {self.shard.dirname}: {len(results)} / {len(self.results)} results')
+        done, pending = [], results
+        if resume:
+            done, pending = filter_done(results, lambda result: manifest_for(result, self.outdir))
+        if dedup:
+            duplicates, pending = filter_duplicates(pending, load_digest_index(self.outdir))
+            if dedup == 'ref':
+                write_references(duplicates, self.outdir)
+            done = done + duplicates
+        return done, pending
+
+    def query_extracts(self, indexes: IndexList = None, **filters) -> Iterator:
+        """Streams cached extracts of `indexes` (defaults to the indexes of this client) matching `filters`, see `query_cache`.
+
+        Example:
+            client.query_extracts(['2024-22', '2024-26'], domain='com,hk01', min_length=500, as_dicts=True)
+
+        """
+        return query_cache(self.outdir, indexes or self.indexes, **filters)
+
+    def merge_shards(self, index: Index) -> int:
+        """Merges the extracts every shard wrote for `index` into the index cache, see `merge_shards`.
+
+        Returns:
+            Number of records merged.
+
+        """
+        return merge_shards(index_cache_path(index, self.outdir))
+
+    def migrate_cache(self, indexes: IndexList = None, workers: int = None) -> int:
+        """Converts the caches of `indexes` (defaults to the indexes of this client) to the typed schema, see `migrate_cache`.
+
+        Returns:
+            Number of records converted.
 
         """
-        self.results = self._get_multiple_extracts(self.results, threads)
+        indexes = [indexes] if isinstance(indexes, str) else indexes or self.indexes
+        return migrate_cache([index_cache_path(index, self.outdir) for index in indexes], workers)
@@ -3,10 +3,58 @@
 from .initialization import (
 	download_available_indexes
 )
+from .multithreading import (
+	make_multithreaded,imap,imap_unordered,
+)
+from .metrics import (
+	METRICS,MetricsRegistry,MetricsExporter,
+)
+from .throttle import (
+	AdaptiveLimiter,
+)
+from .ratelimit import (
+	RateLimiter,HostLimit,TokenBucket,SharedTokenBucket,DATA_HOST,INDEX_HOST,
+)
+from .transport import (
+	Transport,
+)
+from .planner import (
+	plan_spans,group_spans,MAX_GAP,MAX_SPAN_BYTES,MAX_RANGES,
+)
+from .scheduler import (
+	interleave_by_length,MAX_BYTES_IN_FLIGHT,INTERLEAVE_WINDOW,
+)
+from .autotune import (
+	Autotuner,ConcurrencyGate,Knob,concurrency_knob,gate_knob,
+)
+from .lifecycle import (
+	LIFECYCLE,Lifecycle,until_stopped,SHUTDOWN_DEADLINE,
+)
+from .sharding import (
+	Shard,shard_of,select_shard,register_shard,merge_shards,
+)
+from .manifest import (
+	Manifest,get_manifest,flush_manifests,filter_done,rebuild_manifest,
+)
 from .download import (
     get_single_record,
-    get_single_extract,get_multiple_extracts,
-	extract_cache_path,jsonl_cache_path,index_cache_path,
+    get_single_extract,get_multiple_extracts,iter_multiple_extracts,
+	extract_cache_path,jsonl_cache_path,index_cache_path,extract_cache_dir,manifest_for,
+)
+from .digests import (
+	DigestIndex,load_digest_index,filter_duplicates,write_references,DEDUP_MODES,
+)
+from .query import (
+	CacheQuery,query_cache,
+)
+from .migrate import (
+	migrate_cache,migrate_parquet,
+)
+from .pipeline import (
+    get_multiple_extracts_pipelined,iter_extracts_pipelined,make_process_pool,
+)
+from .download_async import (
+    get_multiple_extracts_async,
 )
 from .search import (
 	get_single_index,get_multiple_indexes
@@ -14,8 +62,9 @@ from .search import (
 from .cache import (
 	read_json,write_json,
 	read_file,write_file,
-	read_gzip,write_gzip,
-	read_cache,write_cache,
+	read_gzip,read_gzip_bytes,write_gzip,
+	read_cache,iter_cache,write_cache,flush_cache,
+	CACHE_SCHEMA,cache_record,
 	pd_read_jsonl,pd_read_parquet,
 	strip_cache,redump_cache,
 )
\ No newline at end of file
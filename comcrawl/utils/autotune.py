@@ -0,0 +1,248 @@
+"""Autotuning Helpers.
+
+This module contains a hill-climbing autotuner, which measures records/s over consecutive windows
+while a download runs and moves the download concurrency and the number of extract workers
+towards the highest throughput, backing off when memory or the error rate exceed their limits.
+
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+from .metrics import METRICS
+from .throttle import AdaptiveLimiter
+
+try:
+    import resource # posix only
+except ImportError:
+    resource = None
+
+
+WINDOW = 10.0 # seconds of throughput per measurement
+STEP = 0.25 # relative change of a knob per move
+TOLERANCE = 0.05 # relative gain a move needs to be kept
+MAX_ERROR_RATE = 0.05 # throttles and failed records per range request
+
+class ConcurrencyGate:
+    """Limit on concurrent work that can be changed while work is running, used as a context manager.
+
+    Attributes:
+        limit: Current number of concurrent tasks allowed.
+        max_limit: Upper bound of the limit, e.g. the size of the pool the gate is in front of.
+
+    """
+
+    def __init__(self, limit: int, max_limit: int = None) -> None:
+        self.max_limit = max_limit or limit
+        self.limit = min(limit, self.max_limit)
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def resize(self, limit: int) -> None:
+        with self._cond:
+            self.limit = max(1, min(limit, self.max_limit))
+            self._cond.notify_all()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def __enter__(self) -> 'ConcurrencyGate':
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+@dataclass
+class Knob:
+    """A setting the autotuner moves between `low` and `high`."""
+    name: str
+    get: Callable
+    set: Callable
+    low: int
+    high: int
+
+    def move(self, direction: int, step: float = STEP) -> int:
+        """Moves by `step` of the current value (at least 1) in `direction`, returns the new value."""
+        value = self.get()
+        value = max(self.low, min(self.high, value + direction * max(1, round(value * step))))
+        self.set(value)
+        return value
+
+def concurrency_knob(limiter: AdaptiveLimiter, low: int, high: int) -> Knob:
+    """Download concurrency, as a cap on the adaptive limiter so that throttling still shrinks it further."""
+    return Knob('threads', lambda: limiter.cap or limiter.max_limit, limiter.set_cap, low, high)
+
+def gate_knob(name: str, gate: ConcurrencyGate) -> Knob:
+    return Knob(name, lambda: gate.limit, gate.resize, 1, gate.max_limit)
+
+def rss_mb() -> float:
+    """Resident memory of this process in MB, its peak where the current value is unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        if resource is None:
+            return 0.0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB on linux
+
+class Autotuner:
+    """Hill climbs `knobs` towards the most records/s, one knob at a time.
+
+    Every window a move of the current knob is judged against the window before it: moves gaining
+    more than `tolerance` are kept and repeated, others are undone and the opposite direction is
+    tried, then the next knob. While memory or the error rate are over their limits the first knob
+    (the download concurrency) is stepped down instead.
+
+    Attributes:
+        knobs: Settings to tune, the first one is backed off on memory or errors.
+        window: Seconds of throughput per measurement.
+        max_rss_mb: Memory limit in MB, None for none.
+        max_error_rate: Limit on throttles and failed records per range request.
+        tolerance: Relative gain a move needs to be kept.
+        log_path: If set, the best settings found are appended to this jsonl file when stopping.
+        best: Best settings seen so far, with their records/s.
+
+    """
+
+    def __init__(self,
+        knobs: list,
+        window: float = WINDOW,
+        max_rss_mb: float = None,
+        max_error_rate: float = MAX_ERROR_RATE,
+        tolerance: float = TOLERANCE,
+        log_path: str = None,
+    ) -> None:
+        self.knobs = knobs
+        self.window = window
+        self.max_rss_mb = max_rss_mb
+        self.max_error_rate = max_error_rate
+        self.tolerance = tolerance
+        self.log_path = log_path
+        self.best: dict = {}
+        self._index = 0 # knob being tuned
+        self._direction = 1
+        self._failed = 0 # directions of the current knob that did not pay off
+        self._trial: tuple = None # (knob, value before the move, records/s before the move)
+        self._counters = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def settings(self) -> dict:
+        return {knob.name: knob.get() for knob in self.knobs}
+
+    def _sample(self) -> tuple:
+        """Counters the measurements are computed from."""
+        return (
+            time.monotonic(),
+            METRICS.counter('comcrawl_records_total').value,
+            METRICS.histogram('comcrawl_fetch_seconds').count,
+            METRICS.counter('comcrawl_throttle_events_total').value + METRICS.counter('comcrawl_record_failures_total').value,
+        )
+
+    def measure(self) -> tuple:
+        """Records/s and error rate since the last call."""
+        counters = self._sample()
+        previous, self._counters = self._counters, counters
+        if previous is None:
+            return 0.0, 0.0
+        seconds, records, requests, errors = (now - before for now, before in zip(counters, previous))
+        return records / max(seconds, 1e-9), errors / max(requests, 1)
+
+    def step(self, records_per_s: float, error_rate: float = 0.0, memory_mb: float = 0.0) -> None:
+        """Takes one tuning decision out of the throughput of the last window."""
+        # limits first
+        over_memory = self.max_rss_mb and memory_mb > self.max_rss_mb
+        if over_memory or error_rate > self.max_error_rate:
+            knob = self.knobs[0]
+            value = knob.move(-1)
+            self._trial = None
+            print(f'[Autotuner] {"memory" if over_memory else "error rate"} over limit, {knob.name} = {value}')
+            return
+        if self._trial is None and records_per_s > self.best.get('records_per_s', -1):
+            self.best = {**self.settings(), 'records_per_s': round(records_per_s, 2)}
+
+        # judge the last move
+        if self._trial is not None:
+            knob, before, rate_before = self._trial
+            self._trial = None
+            if records_per_s > rate_before * (1 + self.tolerance):
+                self.best = {**self.settings(), 'records_per_s': round(records_per_s, 2)}
+                self._failed = 0
+            else:
+                tried = knob.get()
+                knob.set(before) # undo
+                self._direction = -self._direction
+                self._failed += 1
+                if self._failed >= 2: # neither direction pays off, next knob
+                    self._index = (self._index + 1) % len(self.knobs)
+                    self._direction, self._failed = 1, 0
+                print(f'[Autotuner] {knob.name} = {tried} gave {records_per_s:.1f} records/s, back to {before}')
+                return # measure the restored settings first
+
+        # try a move
+        knob = self.knobs[self._index]
+        before = knob.get()
+        value = knob.move(self._direction)
+        if value == before: # at a bound
+            self._direction = -self._direction
+            self._failed += 1
+            if self._failed >= 2:
+                self._index = (self._index + 1) % len(self.knobs)
+                self._direction, self._failed = 1, 0
+            return
+        self._trial = (knob, before, records_per_s)
+        print(f'[Autotuner] trying {knob.name} = {value}, {records_per_s:.1f} records/s at {before}')
+
+    def _run(self) -> None:
+        self.measure()
+        while not self._stop.wait(self.window):
+            records_per_s, error_rate = self.measure()
+            self.step(records_per_s, error_rate, rss_mb())
+
+    def start(self) -> 'Autotuner':
+        self._stop.clear()
+        self._counters = None
+        self._thread = threading.Thread(target=self._run, name='Autotuner', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> dict:
+        """Stops tuning and logs the best settings found.
+
+        Returns:
+            The best settings, with their records/s.
+
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        best = self.best or self.settings()
+        print(f'[Autotuner] best {best}')
+        if self.log_path:
+            try:
+                Path(self.log_path).parent.mkdir(parents=True, exist_ok=True)
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), **best}) + '\n')
+            except Exception as e:
+                print(f'[Autotuner] exception {e}')
+        return best
+
+    def __enter__(self) -> 'Autotuner':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,91 @@
+"""Byte Range Helpers.
+
+This module contains helpers to build multi-range requests and parse `multipart/byteranges` responses.
+
+"""
+
+import re
+from typing import Iterator
+
+
+CONTENT_RANGE_PATTERN = re.compile(rb"bytes (\d+)-(\d+)/(\d+|\*)", re.IGNORECASE)
+BOUNDARY_PATTERN = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+RANGE_PATTERN = re.compile(r"(\d+)-(\d+)")
+
+def format_ranges(ranges: list) -> str:
+    """Builds a Range header out of (offset, length) pairs, e.g. 'bytes=0-99,200-299'."""
+    return 'bytes=' + ','.join(f'{offset}-{offset + length - 1}' for offset, length in ranges)
+
+def range_bytes(range_header: str) -> int:
+    """Number of bytes asked for by a Range header, 0 if it is empty."""
+    return sum(int(end) - int(start) + 1 for start, end in RANGE_PATTERN.findall(range_header))
+
+def parse_content_range(content_range: str) -> tuple:
+    """Parses a Content-Range header into its (start, end) bytes, both inclusive."""
+    if isinstance(content_range, str):
+        content_range = content_range.encode('latin-1')
+    match = CONTENT_RANGE_PATTERN.search(content_range)
+    if match is None:
+        raise ValueError(f'invalid content range {content_range}')
+    return int(match.group(1)), int(match.group(2))
+
+def iter_byteranges(body: bytes, content_type: str) -> Iterator[tuple]:
+    """Walks through a multipart/byteranges body part by part.
+
+    Part bodies are located through their Content-Range rather than by searching for the next
+    boundary, so binary payloads that happen to contain the boundary are fine.
+
+    Args:
+        body: the full response body.
+        content_type: the response Content-Type, holding the boundary.
+
+    Yields:
+        (start, end, memoryview) per part, the view points into `body` without copying it.
+
+    """
+    match = BOUNDARY_PATTERN.search(content_type)
+    if match is None:
+        raise ValueError(f'no boundary in content type {content_type}')
+    delimiter = b'--' + match.group(1).encode('latin-1')
+
+    view = memoryview(body)
+    position = body.find(delimiter)
+    while position != -1:
+        position += len(delimiter)
+        if body[position:position + 2] == b'--': # closing delimiter
+            return
+
+        # part headers
+        headers_end = body.find(b'\r\n\r\n', position)
+        if headers_end == -1:
+            raise ValueError('truncated multipart/byteranges part headers')
+        headers = body[position:headers_end]
+        start, end = parse_content_range(headers)
+
+        # part body
+        part_start = headers_end + 4
+        part_end = part_start + end - start + 1
+        if part_end > len(body):
+            raise ValueError('truncated multipart/byteranges part body')
+        yield start, end, view[part_start:part_end]
+
+        position = body.find(delimiter, part_end)
+
+def slice_parts(parts: list, ranges: list) -> list:
+    """Cuts the requested (offset, length) ranges out of received (start, end, view) parts.
+
+    Servers may merge or reorder ranges, so every requested range is looked up in whichever part covers it.
+
+    Returns:
+        One memoryview per requested range, or None where no part covers it.
+
+    """
+    out = []
+    for offset, length in ranges:
+        sliced = None
+        for start, end, view in parts:
+            if start <= offset and offset + length - 1 <= end:
+                sliced = view[offset - start:offset - start + length]
+                break
+        out.append(sliced)
+    return out
@@ -1,16 +1,41 @@
 #%%
+import atexit
+import base64
+import binascii
+import hashlib
 import os
 import json
 import gzip
+import zlib
 from pathlib import Path
 import threading
 import cchardet as chardet # pip install faust-cchardet
 #import chardet
 import pandas as pd
 import glob
+import queue
 import time
+from datetime import datetime
+from typing import Iterator
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from .metrics import METRICS
 
-lock = threading.Lock()
+################################################################################
+# locks
+################################################################################
+# one lock per file written, so writes to unrelated files never wait on each other
+LOCKS: dict = {}
+LOCKS_LOCK = threading.Lock()
+
+def path_lock(fp: str) -> threading.Lock:
+    key = os.path.abspath(fp)
+    with LOCKS_LOCK:
+        file_lock = LOCKS.get(key)
+        if file_lock is None:
+            file_lock = LOCKS[key] = threading.Lock()
+        return file_lock
 
 ################################################################################
 # json
@@ -25,7 +50,7 @@ def write_json(obj:object, json_fp: str) -> None:
             indexdir.mkdir(parents=True, exist_ok=True) # create subdir
             indexdir.chmod(0o777) # make accessible
 
-        with lock:
+        with path_lock(json_fp):
             # write new file
             with open(json_fp, 'w', encoding='utf-8') as f:
                 f.write(json.dumps(obj))
@@ -52,7 +77,7 @@ def read_json(json_fp: str) -> list:
 ################################################################################
 # jsonl
 ################################################################################
-# truncate jsonl (use within a lock)
+# truncate jsonl (use within a lock, or from its cache writer)
 def truncate_jsonl(jsonl_fp: str) -> None:
     with open(jsonl_fp, 'w', encoding='utf-8') as f: 
         f.truncate(0)
@@ -67,7 +92,7 @@ def write_jsonl(listdict:list[object], jsonl_fp: str, truncate: bool = False) ->
             indexdir.mkdir(parents=True, exist_ok=True) # create subdir
             indexdir.chmod(0o777) # make accessible
 
-        with lock:
+        with path_lock(jsonl_fp):
             # should truncate first or not?
             if truncate:
                 truncate_jsonl(jsonl_fp)
@@ -129,116 +154,473 @@ def list_parquet_files(indexdir: Path) -> list[str]:
     # return list of all parquets
     return parquet_files
 
+def trim_partial_line(jsonl_fp: Path, chunk_size: int = 64 * 1024) -> None:
+    # drop a last line cut short by a killed process, so appends start on a fresh line (use within a lock, or from its cache writer)
+    with open(jsonl_fp, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b'\n':
+            return
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        f.truncate(position)
+        print(f'[trim_partial_line] {jsonl_fp} dropped {end - position} bytes')
+
 def safe_div(a,b):
     return 0 if b == 0 else a/b
 
 ################################################################################
 # jsonl cache (= combo of jsonl and parquets)
 ################################################################################
+FLUSH_SECONDS = METRICS.histogram('comcrawl_cache_flush_seconds', 'Seconds per batch of records appended by a cache writer.')
+WRITER_QUEUE_DEPTH = METRICS.gauge('comcrawl_cache_writer_queue_depth', 'Batches of records queued for the cache writers.')
+
+def count_lines(fp: Path, chunk_size: int = 1024 * 1024) -> int:
+    lines = 0
+    with open(fp, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            lines += chunk.count(b'\n')
+    return lines
+
+ROW_GROUP_ROWS = 1000 # records per parquet row group
+PARQUET_TARGET_BYTES = 128 * 1024 ** 2 # parquet files are closed once this large, or at max_json_lines records
+DIGEST_SIZE = 20 # sha1
+CACHE_SCHEMA = pa.schema([
+    ('index', pa.dictionary(pa.int16(), pa.string())), # e.g. '2024-26'
+    ('domain', pa.dictionary(pa.int32(), pa.string())), # SURT host, e.g. 'com,hk01'
+    ('digest', pa.binary(DIGEST_SIZE)), # content digest, see `digest_key`
+    ('url', pa.string()),
+    ('length', pa.int32()), # characters of content
+    ('timestamp', pa.timestamp('ms')), # fetch time
+    ('content', pa.string()),
+])
+LEGACY_COLUMNS = ['filepath', 'content'] # schema of caches written before the typed one, see `migrate_cache`
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%S' # as in the index, e.g. '20240614075213'
+
+def digest_key(digest) -> bytes:
+    """20 byte key of a digest, e.g. 'SUCE2T6S4QQ2APMQ7EBM5ITYOWPV2UH3', 'sha1:SUCE...' or the key itself."""
+    if isinstance(digest, bytes) and len(digest) == DIGEST_SIZE:
+        return digest
+    digest = str(digest).split(':')[-1]
+    if len(digest) == 32:
+        try:
+            return base64.b32decode(digest)
+        except binascii.Error:
+            pass
+    return hashlib.sha1(digest.encode('utf-8')).digest() # not base32 sha1, still a stable key
+
+def digest_name(key: bytes) -> str:
+    # base32 digest of a key, as in the index
+    return base64.b32encode(key).decode('ascii')
+
+def parse_timestamp(timestamp) -> datetime:
+    if timestamp is None or isinstance(timestamp, datetime):
+        return timestamp
+    try:
+        return datetime.strptime(str(timestamp), TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+def record_from_filepath(filepath: str) -> dict:
+    # index, domain and digest out of a legacy {basepath}/extracts/{index}/[{shard}/]{domain}/{digest}.txt
+    parts = Path(filepath).parts
+    index = parts[parts.index('extracts') + 1] if 'extracts' in parts[:-2] else None
+    return {'index': index, 'domain': parts[-2] if len(parts) > 1 else None, 'digest': Path(filepath).stem}
+
+def cache_record(row: dict) -> dict:
+    """
+    Typed cache record of a row, e.g. {'index', 'domain', 'digest', 'url', 'timestamp', 'content'}
+    as written by `cache_extract`, or a legacy {'filepath', 'content'}.
+    """
+    if 'filepath' in row:
+        row = {**record_from_filepath(row['filepath']), **{k: v for k, v in row.items() if k != 'filepath'}}
+    content = row.get('content') or ''
+    return {
+        'index': row.get('index'),
+        'domain': row.get('domain'),
+        'digest': digest_key(row['digest']) if row.get('digest') is not None else None,
+        'url': row.get('url'),
+        'length': len(content),
+        'timestamp': parse_timestamp(row.get('timestamp')),
+        'content': content,
+    }
+
+def journal_line(record: dict) -> bytes:
+    # cache record as a jsonl line, read back by `cache_record`
+    return (json.dumps({
+        **record,
+        'digest': digest_name(record['digest']) if record['digest'] is not None else None,
+        'timestamp': record['timestamp'].strftime(TIMESTAMP_FORMAT) if record['timestamp'] else None,
+    }, ensure_ascii=False) + '\n').encode('utf-8')
+
+def is_legacy(schema: pa.Schema) -> bool:
+    return 'filepath' in schema.names and 'digest' not in schema.names
+
+def upgrade_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    # legacy {'filepath', 'content'} batch in the typed schema
+    return pa.RecordBatch.from_pylist([cache_record(row) for row in batch.to_pylist()], schema=CACHE_SCHEMA)
+
+def parquet_digests(parquet_fp: str) -> set:
+    # digest keys of a parquet file
+    pf = pq.ParquetFile(parquet_fp)
+    if is_legacy(pf.schema_arrow):
+        return {digest_key(record_from_filepath(fp)['digest']) for fp in pf.read(columns=['filepath']).column(0).to_pylist()}
+    return set(pf.read(columns=['digest']).column(0).to_pylist())
+
+def parquet_tmp_filepath(parquet_fp: Path) -> Path:
+    # parquet file still being written, its records are in the jsonl journal until it is renamed
+    return parquet_fp.with_name(f'{parquet_fp.name}.tmp')
+
+class CacheWriter:
+    """Background writer of the cache of one index directory.
+
+    Records are handed over through a queue and appended by the writer's own thread, which batches
+    whatever is queued and owns the file handles, so download workers never wait on disk or on each other.
+
+    Records go straight into an open parquet file ({index}_{n}.parquet.tmp) as row groups of
+    `row_group_rows`, and the file is renamed to {index}_{n}.parquet once it holds `max_json_lines`
+    records or `max_parquet_bytes`, or when the writer is closed. The jsonl is the journal of the open
+    file: it holds exactly the records not in a renamed parquet yet, so readers see every record once,
+    and a writer started after a crash discards the unfinished .tmp file and writes its records again
+    from the journal.
+
+    Attributes:
+        indexdir: Index cache directory, e.g. basepath/extracts/2024-26.
+        max_json_lines: Records per parquet file.
+        max_parquet_bytes: Target size of a parquet file.
+        row_group_rows: Records per row group.
+        lines: Records in the journal, i.e. in the open parquet file.
+
+    """
+
+    def __init__(self,
+        indexdir: str,
+        max_json_lines: int = 10000,
+        max_parquet_bytes: int = PARQUET_TARGET_BYTES,
+        row_group_rows: int = ROW_GROUP_ROWS,
+    ) -> None:
+        self.indexdir = Path(indexdir)
+        self.max_json_lines = max_json_lines
+        self.max_parquet_bytes = max_parquet_bytes
+        self.row_group_rows = row_group_rows
+        self.lines = 0
+        self._written = 0 # bytes of the journal, to notice it changed under the writer
+        self._rows: list[dict] = [] # journaled records not in a row group yet
+        self._jsonl = None
+        self._empties = None
+        self._parquet: pq.ParquetWriter = None
+        self._parquet_fp: Path = None
+        self._queue = queue.Queue() # unbounded, handing over never blocks
+        self._thread = threading.Thread(target=self._run, name=f'CacheWriter-{self.indexdir.name}', daemon=True)
+        self._thread.start()
+
+    def write(self, listdict: list[dict]) -> None:
+        """Queues records to be appended."""
+        WRITER_QUEUE_DEPTH.inc()
+        self._queue.put(listdict)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until the records queued so far are written, returns False on timeout."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = None) -> bool:
+        """Writes the records queued so far, closes the open parquet file and stops the writer, returns False on timeout."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _open(self) -> None:
+        # ensure directory exists
+        if not self.indexdir.exists():
+            self.indexdir.mkdir(parents=True, exist_ok=True) # create subdir
+            self.indexdir.chmod(0o777) # make accessible
+
+        # ensure jsonl and txt for empty links exist
+        jsonl_fp = indexdir_to_jsonl(self.indexdir, self.indexdir.name)
+        empties_fp = indexdir_to_empties(self.indexdir, self.indexdir.name)
+        for fp in (jsonl_fp, empties_fp):
+            if not fp.exists():
+                fp.touch()
+                os.chmod(fp, 0o777)
+
+        # recover from the journal once
+        self._recover()
+        self._jsonl = open(jsonl_fp, 'ab')
+        self._empties = open(empties_fp, 'ab')
+
+    def _recover(self) -> None:
+        jsonl_fp = indexdir_to_jsonl(self.indexdir, self.indexdir.name)
+        trim_partial_line(jsonl_fp)
+
+        # parquet left unfinished by a killed process, its records are in the journal
+        for tmp_fp in self.indexdir.glob(f'{self.indexdir.name}_*.parquet.tmp'):
+            print(f'[CacheWriter] discarding unfinished {tmp_fp}')
+            tmp_fp.unlink()
+
+        # records renamed into a parquet by a process killed before it truncated the journal
+        rows = [cache_record(row) for row in read_jsonl(jsonl_fp)]
+        parquet_files = list_parquet_files(self.indexdir)
+        if rows and parquet_files:
+            done = parquet_digests(parquet_files[-1])
+            kept = [row for row in rows if row['digest'] not in done]
+            if len(kept) < len(rows):
+                print(f'[CacheWriter] dropping {len(rows) - len(kept)} journaled records already in {parquet_files[-1]}')
+                with open(jsonl_fp, 'wb') as f:
+                    f.write(b''.join(journal_line(row) for row in kept))
+                rows = kept
+
+        self._rows = rows
+        self.lines = len(rows)
+        self._written = jsonl_fp.stat().st_size
+
+    def _run(self) -> None:
+        try:
+            self._open()
+        except Exception as e:
+            print(f'[CacheWriter] exception {e}')
+        stopping = False
+        while not stopping:
+            # batch whatever is queued
+            batch, flushed = [], []
+            item = self._queue.get()
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    flushed.append(item)
+                else:
+                    WRITER_QUEUE_DEPTH.dec()
+                    batch.extend(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    with FLUSH_SECONDS.time():
+                        self._append(batch)
+                if stopping and self.lines and self.indexdir.exists(): # not removed under the writer
+                    self._roll_over()
+            except Exception as e:
+                print(f'[CacheWriter] exception {e}')
+            for done in flushed:
+                done.set()
+        for f in (self._jsonl, self._empties):
+            if f:
+                f.close()
+
+    def _append(self, listdict: list[dict]) -> None:
+        # filter for empties
+        rows, lines, empties = [], [], []
+        for d in listdict:
+            record = cache_record(d)
+            if record['length'] == 0:
+                empties.append((self._empty_filepath(d, record) + '\n').encode('utf-8'))
+            else:
+                rows.append(record)
+                lines.append(journal_line(record))
+
+        # journal
+        if lines:
+            if os.fstat(self._jsonl.fileno()).st_size != self._written: # changed by someone else, e.g. a torn write
+                trim_partial_line(self._jsonl.name)
+                self.lines = count_lines(self._jsonl.name)
+                self._written = os.path.getsize(self._jsonl.name)
+            data = b''.join(lines)
+            self._jsonl.write(data)
+            self._jsonl.flush()
+            self._written += len(data)
+            self.lines += len(lines)
+            self._rows.extend(rows)
+        if empties:
+            self._empties.write(b''.join(empties))
+            self._empties.flush()
+
+        # full row groups
+        if len(self._rows) >= self.row_group_rows:
+            self._write_row_groups(len(self._rows) - len(self._rows) % self.row_group_rows)
+
+        # close the parquet file once it holds enough records or bytes
+        if self.lines >= self.max_json_lines or self._parquet_fp and self._parquet_fp.stat().st_size >= self.max_parquet_bytes:
+            self._roll_over()
+
+    def _empty_filepath(self, row: dict, record: dict) -> str:
+        # line of the empties file, where the extract would have been
+        if 'filepath' in row:
+            return row['filepath']
+        digest = row['digest'] if isinstance(row.get('digest'), str) else digest_name(record['digest'])
+        return str(self.indexdir / str(record['domain']) / f'{digest}.txt')
+
+    def _write_row_groups(self, count: int) -> None:
+        # write the first `count` pending records into the open parquet file
+        if self._parquet is None:
+            self._parquet_fp = parquet_tmp_filepath(next_parquet_filepath(self.indexdir, self.indexdir.name))
+            self._parquet = pq.ParquetWriter(self._parquet_fp, CACHE_SCHEMA, compression='snappy')
+        table = pa.Table.from_pylist(self._rows[:count], schema=CACHE_SCHEMA)
+        self._parquet.write_table(table, row_group_size=self.row_group_rows)
+        del self._rows[:count]
+
+    def _roll_over(self) -> None:
+        # write the remaining records, rename the parquet file and start an empty journal
+        if self._rows:
+            self._write_row_groups(len(self._rows))
+        if self._parquet is None:
+            return
+        self._parquet.close()
+        parquet_fp = self._parquet_fp.with_suffix('') # drop .tmp
+        os.replace(self._parquet_fp, parquet_fp)
+        os.chmod(parquet_fp, 0o777) # make accessible
+        self._parquet, self._parquet_fp = None, None
+
+        # truncate jsonl, the handle appends at the new end
+        truncate_jsonl(self._jsonl.name)
+        self.lines, self._written = 0, 0
+
+# writer per index directory
+WRITERS: dict = {}
+WRITERS_LOCK = threading.Lock()
+
+def get_writer(indexdir: str, max_json_lines: int = 10000) -> CacheWriter:
+    """Returns the writer of an index directory, starting it on first use."""
+    key = os.path.abspath(indexdir)
+    with WRITERS_LOCK:
+        writer = WRITERS.get(key)
+        if writer is None:
+            writer = WRITERS[key] = CacheWriter(key, max_json_lines)
+        writer.max_json_lines = max_json_lines
+        return writer
+
+def flush_cache(indexdir: str = None, forget: bool = False, timeout: float = None) -> bool:
+    """
+    Wait until the records queued for one index directory, or for all of them, are written.
+    With `forget`, the writers are stopped too, e.g. before their files are rewritten, and restarted on the next write.
+    Returns False if the writes did not finish within `timeout` seconds.
+    """
+    with WRITERS_LOCK:
+        keys = [os.path.abspath(indexdir)] if indexdir else list(WRITERS)
+        writers = [WRITERS.pop(key, None) if forget else WRITERS.get(key) for key in keys]
+    writers = [writer for writer in writers if writer is not None]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    done = True
+    for writer in writers:
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        done = (writer.close(remaining) if forget else writer.flush(remaining)) and done
+    if not done:
+        print(f'[flush_cache] writes still in progress after {timeout}s')
+    return done
+
+atexit.register(flush_cache, forget=True)
+
 def write_cache(listdict: list[dict], indexdir: str, max_json_lines: int = 10000) -> None:
     """
-    Write a list of dictionaries to a JSONL file, and when the file size exceeds the specified maximum number of lines,
+    Append a list of dictionaries to a JSONL file, and when the file size exceeds the specified maximum number of lines,
     write the data to a Parquet file and clear the JSONL file.
+    Records are written in the background by the writer of `indexdir`, see `CacheWriter` and `flush_cache`.
     """
     try:
-		# check if directory exists, if not create it
-        with lock:
-            # ensure directory exists
-            indexdir = Path(indexdir)
-            if not indexdir.exists():
-                indexdir.mkdir(parents=True, exist_ok=True) # create subdir
-                indexdir.chmod(0o777) # make accessible
-
-            # ensure jsonl exist
-            jsonl_fp = indexdir_to_jsonl(indexdir, indexdir.name)
-            if not jsonl_fp.exists():
-                jsonl_fp.touch()
-                os.chmod(jsonl_fp, 0o777)
-
-            # ensure txt for empty links exist
-            empties_fp = indexdir_to_empties(indexdir, indexdir.name)
-            if not empties_fp.exists():
-                empties_fp.touch()
-                os.chmod(empties_fp, 0o777)
-
-            # count lines
-            line_count = 0
-            with open(jsonl_fp, 'r', encoding='utf-8') as f:
-                line_count = sum(1 for _ in f)
-
-            # write entries and filter for empties
-            empty_entries = []
-            with open(jsonl_fp, 'a', encoding='utf-8') as f:
-                for d in listdict:
-                    if len(d['content']) == 0:
-                        empty_entries.append(d['filepath'])
-                    else:
-                        line = json.dumps(d, ensure_ascii=False).encode('utf-8').decode('utf-8')
-                        f.write(line + '\n')
-                        line_count += 1
-
-            # write empty entries to empties_fp
-            if empty_entries:
-                with open(empties_fp, 'a', encoding='utf-8') as f:
-                    for fp in empty_entries:
-                        f.write(fp + '\n')
-
-            # if JSONL line count exceeds the maximum, write the data to a Parquet file and clear the JSONL file
-            if line_count >= max_json_lines:
-                # get contents
-                df = pd_read_jsonl(jsonl_fp)
-
-                # write compressed parquet
-                parquet_filepath = next_parquet_filepath(indexdir,indexdir.name)
-                pd_save_parquet(parquet_filepath,df)
-
-                # truncate jsonl
-                truncate_jsonl(jsonl_fp)
+        get_writer(indexdir, max_json_lines).write(listdict)
 
     except Exception as e:
         print(f'[write_cache] exception {e}')
 
+READ_BATCH_ROWS = 1000 # records per batch read from the cache
+
+def count_empties(batch: pa.RecordBatch) -> int:
+    if 'length' in batch.schema.names:
+        return pc.sum(pc.equal(batch.column('length'), 0)).as_py() or 0
+    if 'content' in batch.schema.names:
+        return pc.sum(pc.equal(pc.utf8_length(batch.column('content')), 0)).as_py() or 0
+    return 0
+
+def iter_jsonl_batches(jsonl_fp: Path, columns: list = None, batch_size: int = READ_BATCH_ROWS) -> Iterator[pa.RecordBatch]:
+    # stream a jsonl as typed record batches, skipping lines that do not parse, e.g. torn by a killed process
+    def to_batch(rows: list) -> pa.RecordBatch:
+        batch = pa.RecordBatch.from_pylist(rows, schema=CACHE_SCHEMA)
+        return batch.select(columns) if columns else batch
+
+    rows = []
+    with open(jsonl_fp, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                rows.append(cache_record(json.loads(line)))
+            except json.JSONDecodeError:
+                print(f'[iter_jsonl_batches] skipping unreadable line in {jsonl_fp}')
+                continue
+            if len(rows) >= batch_size:
+                yield to_batch(rows)
+                rows = []
+    if rows:
+        yield to_batch(rows)
+
+def iter_parquet_batches(parquet_fp: str, columns: list = None, batch_size: int = READ_BATCH_ROWS) -> Iterator[pa.RecordBatch]:
+    # stream a parquet file as typed record batches, converting legacy files on the fly
+    pf = pq.ParquetFile(parquet_fp)
+    if not is_legacy(pf.schema_arrow):
+        yield from pf.iter_batches(batch_size=batch_size, columns=columns)
+        return
+    for batch in pf.iter_batches(batch_size=batch_size, columns=LEGACY_COLUMNS):
+        batch = upgrade_batch(batch)
+        yield batch.select(columns) if columns else batch
+
+def iter_cache(indexdir: str, columns: list = None, batch_size: int = READ_BATCH_ROWS, as_dicts: bool = False) -> Iterator:
+    """
+    Stream the records of an index cache, parquet files first (row group by row group) then the jsonl, in constant memory.
+    Records come in the typed schema `CACHE_SCHEMA`, legacy files are converted while reading, see `migrate_cache`.
+    Only `columns` are read if given, e.g. ['digest'].
+    Yields pyarrow record batches of up to `batch_size` records, or lists of dictionaries with `as_dicts`.
+    Records queued for the cache writer are written first, records written while iterating may or may not be included.
+    """
+    indexdir = Path(indexdir)
+    flush_cache(indexdir) # queued records
+
+    # parquets, then jsonl
+    sources = [(fp, 'parquet') for fp in list_parquet_files(indexdir)]
+    jsonl_fp = indexdir_to_jsonl(indexdir, indexdir.name)
+    if os.path.exists(jsonl_fp):
+        sources.append((jsonl_fp, 'jsonl'))
+
+    for fp, kind in sources:
+        start_time = time.time()
+        records, emptys = 0, 0
+        try:
+            if kind == 'parquet':
+                batches = iter_parquet_batches(fp, columns, batch_size)
+            else:
+                batches = iter_jsonl_batches(jsonl_fp, columns, batch_size)
+            for batch in batches:
+                records += batch.num_rows
+                emptys += count_empties(batch)
+                yield batch.to_pylist() if as_dicts else batch
+
+        except Exception as e:
+            print(f'[iter_cache] exception {e}')
+
+        # summarize file
+        print(f"[iter_cache][read {kind}] {fp} {time.time() - start_time:.2f}s, records = {records}, emptys = {emptys}, empty_ratio = {safe_div(emptys,records):.4f}")
+
 def read_cache(indexdir: str, column_name: str = None) -> list[dict]:
     """
     Read data from Parquet + JSONL files in the specified filepath.
-    If column_name is provided, only that column will be read from the Parquet files.
+    If column_name is provided, only that column will be read, as a list of its values.
+    Holds the whole cache in memory, see `iter_cache` to stream it instead.
     """
     result = []
     total_emptys = 0
     try:
-        indexdir = Path(indexdir)
-        # read parquets
-        parquet_files = list_parquet_files(indexdir)
-        for parquet_file in parquet_files:
-            start_time = time.time()
-            if column_name:
-                df = pd_read_parquet(parquet_file,[column_name])
-                result.extend([x[column_name] for x in df.to_dict(orient='records')])
-            else:
-                df = pd_read_parquet(parquet_file)
-                result.extend(df.to_dict(orient='records'))
-            parquet_read_time = time.time() - start_time
-
-            # summarize parquet
-            emptys = sum(df['content'].str.len() == 0)
-            total_emptys += emptys
-            print(f"[read_cache][read parquet] {parquet_file} {parquet_read_time:.2f}s, records = {len(df)}, emptys = {emptys}, empty_ratio = {safe_div(emptys,len(df)):.4f}")
-
-        # read jsonl
-        jsonl_fp = indexdir_to_jsonl(indexdir, indexdir.name)
-        if os.path.exists(jsonl_fp):
-            start_time = time.time()
-            df = pd_read_jsonl(jsonl_fp)
-            if column_name:
-                result.extend([x[column_name] for x in df.to_dict(orient='records')])
-            else:
-                result.extend(df.to_dict(orient='records'))
-            jsonl_read_time = time.time() - start_time
-
-            # summarize jsonl
-            emptys = sum(df['content'].str.len() == 0)
-            total_emptys += emptys
-            print(f"[read_cache][read jsonl] {jsonl_fp} {jsonl_read_time:.2f}s, records = {len(df)}, emptys = {emptys}, empty_ratio = {safe_div(emptys,len(df)):.4f}")
+        for batch in iter_cache(indexdir, [column_name] if column_name else None):
+            result.extend(batch.column(0).to_pylist() if column_name else batch.to_pylist())
+            total_emptys += count_empties(batch)
 
     except Exception as e:
         print(f'[read_cache] exception {e}')
@@ -289,7 +671,7 @@ def write_file(obj:object, fp: str) -> None:
             indexdir.mkdir(parents=True, exist_ok=True) # create subdir
             indexdir.chmod(0o777) # make accessible
 
-        with lock:
+        with path_lock(fp):
             with open(fp, 'w', encoding='utf-8') as f:
                 if obj is None:
                     f.write('')
@@ -338,40 +720,78 @@ def write_gzip(content:object, gzip_fp: str) -> None:
     except Exception as e:
 	    print(f'[write_gzip] exception {e}')
         
+# unzip (possibly multi-member) gzip, takes bytes or a memoryview slice without copying it
+def gunzip(zipped_content: bytes) -> bytes:
+    chunks = []
+    data = zipped_content
+    while len(data):
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16) # gzip header
+        chunks.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise EOFError('compressed file ended before the end-of-stream marker was reached')
+        data = decompressor.unused_data
+    return b''.join(chunks)
+
+# decode gzip
+def decode_gzip(zipped_content: bytes, debug: bool = False) -> str:
+    #print(f'[decode_gzip] {len(zipped_content)}')
+    raw_content: str = ''
+    try:
+        # unzip contents
+        content = gunzip(zipped_content)
+
+        # for manual debugging
+        if debug:
+            print(content)
+
+        # try common encodings first
+        for encoding in ['UTF-8	','GB18030']: #  'gbk', 'big5',
+            try:
+                raw_content = content.decode(encoding, errors='ignore')
+                break
+            except UnicodeDecodeError:
+                continue
+
+        # if common encodings fail, using cchardet to detect encoding
+        if not raw_content:
+            # Detect the encoding
+            encoding = chardet.detect(content)
+            if isinstance(encoding,dict): 
+                encoding = encoding.get('encoding')
+                print(f'[decode_gzip][encoding] detected = {encoding}')
+
+            if encoding:
+                raw_content = content.decode(encoding) # decode
+            else:
+                raw_content = '' # If chardet couldn't detect the encoding, return nothing
+
+    except Exception as e:
+        print(f'[decode_gzip] exception {e}')
+
+    return raw_content
+
+# read gzip without unzipping it
+def read_gzip_bytes(gzip_fp: str) -> bytes:
+    #print(f'[read_gzip_bytes] {gzip_fp}')
+    zipped_content: bytes = b''
+    try:
+        if os.path.exists(gzip_fp):
+            with open(gzip_fp, 'rb') as f:
+                zipped_content = f.read()
+
+    except Exception as e:
+        print(f'[read_gzip_bytes] exception {e}')
+
+    return zipped_content
+
 # read gzip
 def read_gzip(gzip_fp: str, debug: bool = False) -> str:
     #print(f'[read_gzip] {gzip_fp}')
     raw_content: str = ''
     try:
         if os.path.exists(gzip_fp):
-            # read contents
-            with gzip.open(gzip_fp, 'rb') as f:
-                content = f.read()
-
-            # for manual debugging
-            if debug:
-                print(content)
-
-            # try common encodings first
-            for encoding in ['UTF-8	','GB18030']: #  'gbk', 'big5',
-                try:
-                    raw_content = content.decode(encoding, errors='ignore')
-                    break
-                except UnicodeDecodeError:
-                    continue
-
-            # if common encodings fail, using cchardet to detect encoding
-            if not raw_content:
-                # Detect the encoding
-                encoding = chardet.detect(content)
-                if isinstance(encoding,dict): 
-                    encoding = encoding.get('encoding')
-                    print(f'[read_gzip][encoding] detected = {encoding}')
-
-                if encoding:
-                    raw_content = content.decode(encoding) # decode
-                else:
-                    raw_content = '' # If chardet couldn't detect the encoding, return nothing
+            # read contents, then unzip and decode
+            raw_content = decode_gzip(read_gzip_bytes(gzip_fp), debug)
 
     except Exception as e:
         print(f'[read_gzip] exception {e}')
@@ -450,6 +870,7 @@ def strip_cache(indexdir: str) -> None:
     try:
         # strip parquet files
         indexdir = Path(indexdir)
+        flush_cache(indexdir, forget=True) # rewritten below
         parquet_files = list_parquet_files(indexdir)
         for parquet_file in parquet_files:
             strip_parquet(parquet_file)
@@ -526,8 +947,7 @@ def redump_cache(indexdir: str, max_json_lines: int = 10000) -> None:
                 jsonl_fp = indexdir_to_jsonl(indexdir_redumped, indexdir_redumped.name)
                 with open(jsonl_fp, 'w', encoding='utf-8') as f:
                     for d in listdict[current_line:]:
-                        line = json.dumps(d, ensure_ascii=False).encode('utf-8').decode('utf-8')
-                        f.write(line + '\n')
+                        f.write(journal_line(d).decode('utf-8'))
                         current_line += 1
                 print(f'[redump_cache] current_line = {current_line},  fp = {jsonl_fp}')
                 os.chmod(jsonl_fp, 0o777) # make accessible
@@ -549,7 +969,7 @@ for index in ALL_INDEXES:
 ################################################################################
 # read jsonl
 def pd_read_jsonl(jsonl_fp: str) -> pd.DataFrame:
-    return pd.read_json(jsonl_fp, lines=True)
+    return pd.read_json(jsonl_fp, lines=True, dtype=False, convert_dates=False) # journaled values stay as written
 '''
 pd.read_json('/home/alfred/nfs/cc_zho/extracts/2023-40/abc.jsonl', lines=True)
 '''
@@ -557,7 +977,8 @@ pd.read_json('/home/alfred/nfs/cc_zho/extracts/2023-40/abc.jsonl', lines=True)
 # save parquet
 def pd_save_parquet(parquet_fp: str, df: pd.DataFrame) -> None:
     try:
-        df.to_parquet(parquet_fp,compression='snappy') # snappy
+        schema = CACHE_SCHEMA if list(df.columns) == CACHE_SCHEMA.names else None # keep typed caches typed
+        df.to_parquet(parquet_fp,compression='snappy',schema=schema,index=False if schema else None) # snappy
         #df.to_parquet(parquet_fp,compression='gzip')  # gzip
         #df.to_parquet(parquet_fp,compression='lz4')   # lz4
         #df.to_parquet(parquet_fp,compression='zstd')  # zstd
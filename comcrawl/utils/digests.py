@@ -0,0 +1,177 @@
+"""Digest Index Helpers.
+
+This module contains the cross-crawl digest index, the content digests already extracted in any
+crawl cached under a basepath, so pages that did not change between crawls are downloaded once.
+
+"""
+
+import json
+import os
+from pathlib import Path
+import numpy as np
+from .custom_types import ResultList
+from .cache import write_jsonl
+from .manifest import DIGEST_SIZE,MANIFEST_SUFFIX,digest_key
+from .download import index_from_result,extract_cache_path,extract_cache_dir,manifest_for
+
+
+DIGEST_INDEX = 'digests.npz' # under basepath/extracts
+DEDUP_MODES = ('skip', 'ref')
+REFS_SUFFIX = '.refs.jsonl'
+KEY_DTYPE = f'S{DIGEST_SIZE}'
+
+class DigestIndex:
+    """Content digests extracted in any crawl cached under `extractsdir`, with the crawl that extracted them.
+
+    Built out of the resume manifests of every index cache (shards included) and kept on disk as
+    sorted fixed-size keys, 22 bytes per digest in memory. `update` only reads what the manifests
+    gained since the previous update. A digest extracted by several crawls keeps the first one indexed.
+
+    Attributes:
+        extractsdir: Directory of the index caches, e.g. basepath/extracts.
+        path: File the index is saved to.
+        crawls: Crawl names, e.g. '2024-26', by crawl id.
+
+    """
+
+    def __init__(self, extractsdir: str) -> None:
+        self.extractsdir = Path(extractsdir)
+        self.path = self.extractsdir / DIGEST_INDEX
+        self.crawls: list[str] = []
+        self._keys = np.empty(0, dtype=KEY_DTYPE) # sorted
+        self._crawl_ids = np.empty(0, dtype=np.uint16) # crawl of every key
+        self._sources: dict = {} # bytes of every manifest file already indexed
+
+    @classmethod
+    def load(cls, extractsdir: str) -> 'DigestIndex':
+        """Loads the index saved under `extractsdir`, an empty one if there is none."""
+        index = cls(extractsdir)
+        if index.path.exists():
+            try:
+                with np.load(index.path) as data:
+                    index._keys = data['keys']
+                    index._crawl_ids = data['crawl_ids']
+                    meta = json.loads(str(data['meta']))
+                index.crawls = meta['crawls']
+                index._sources = meta['sources']
+            except Exception as e:
+                print(f'[DigestIndex] exception {e}, rebuilding')
+                index = cls(extractsdir)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, digest: str) -> bool:
+        return self.lookup([digest])[0] is not None
+
+    def update(self) -> int:
+        """Adds the digests the manifests gained since the last update.
+
+        Returns:
+            Number of digests new to the index.
+
+        """
+        keys, crawl_ids = [], []
+        for fp in sorted(self.extractsdir.glob(f'*/**/*{MANIFEST_SUFFIX}')):
+            size = fp.stat().st_size
+            size -= size % DIGEST_SIZE # torn last key
+            start = self._sources.get(str(fp), 0)
+            if size < start: # rewritten
+                start = 0
+            if size == start:
+                continue
+            with open(fp, 'rb') as f:
+                f.seek(start)
+                data = f.read(size - start)
+            crawl = fp.relative_to(self.extractsdir).parts[0] # e.g. extracts/2024-26/shard-0-of-2/shard-0-of-2.done
+            if crawl not in self.crawls:
+                self.crawls.append(crawl)
+            keys.append(np.frombuffer(data, dtype=KEY_DTYPE))
+            crawl_ids.append(np.full(len(keys[-1]), self.crawls.index(crawl), dtype=np.uint16))
+            self._sources[str(fp)] = size
+        if not keys:
+            return 0
+
+        # merge, earlier entries first so they win
+        before = len(self._keys)
+        all_keys = np.concatenate([self._keys] + keys)
+        all_crawl_ids = np.concatenate([self._crawl_ids] + crawl_ids)
+        self._keys, first = np.unique(all_keys, return_index=True)
+        self._crawl_ids = all_crawl_ids[first]
+        print(f'[DigestIndex] {self.extractsdir} digests = {len(self._keys)}, new = {len(self._keys) - before}')
+        return len(self._keys) - before
+
+    def save(self) -> None:
+        """Writes the index to `path`, replacing the previous one at once."""
+        try:
+            meta = json.dumps({'crawls': self.crawls, 'sources': self._sources})
+            tmp_fp = self.path.with_name(f'{self.path.name}.tmp')
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_fp, 'wb') as f:
+                np.savez(f, keys=self._keys, crawl_ids=self._crawl_ids, meta=np.array(meta))
+            os.replace(tmp_fp, self.path)
+        except Exception as e:
+            print(f'[DigestIndex] exception {e}')
+
+    def lookup(self, digests: list) -> list:
+        """Crawl that extracted every digest, None for digests not in the index."""
+        if not len(self._keys) or not digests:
+            return [None] * len(digests)
+        keys = np.array([digest_key(digest) for digest in digests], dtype=KEY_DTYPE)
+        positions = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        found = self._keys[positions] == keys
+        return [self.crawls[crawl_id] if hit else None for hit, crawl_id in zip(found, self._crawl_ids[positions])]
+
+def load_digest_index(basepath: str) -> DigestIndex:
+    """Loads the digest index of the caches under `basepath`, brought up to date with their manifests and saved."""
+    index = DigestIndex.load(Path(basepath) / 'extracts')
+    if index.update():
+        index.save()
+    return index
+
+def filter_duplicates(results: ResultList, index: DigestIndex) -> tuple:
+    """Splits search results into ones whose content another crawl already extracted and fresh ones.
+
+    A digest counts as extracted if it is in `index` for another crawl, or if an earlier result of
+    another crawl in `results` has it. Digests extracted by a result's own crawl are left to the resume manifest.
+
+    Args:
+        results: search results
+        index: digest index
+
+    Returns:
+        Duplicates, copies of their results with the crawl that has the content under 'duplicate_of', and fresh results.
+
+    """
+    duplicates, fresh = [], []
+    first_crawls = {} # digest -> crawl of its first result
+    for result, crawl in zip(results, index.lookup([result['digest'] for result in results])):
+        own = index_from_result(result)
+        crawl = crawl or first_crawls.setdefault(result['digest'], own)
+        if crawl != own:
+            duplicates.append({**result, 'duplicate_of': crawl})
+        else:
+            fresh.append(result)
+    print(f'[filter_duplicates] duplicates = {len(duplicates)}, fresh = {len(fresh)}')
+    return duplicates, fresh
+
+def write_references(duplicates: ResultList, basepath: str) -> None:
+    """Records duplicates as reference rows next to the extracts of their crawl, and as completed in its manifest.
+
+    Reference rows go to e.g. basepath/extracts/2024-26/2024-26.refs.jsonl, with the filepath the extract
+    would have had, its digest and the crawl whose cache holds the content.
+
+    """
+    rows: dict = {} # reference file -> rows
+    for result in duplicates:
+        cache_dir = extract_cache_dir(index_from_result(result), basepath)
+        rows.setdefault(cache_dir / f'{cache_dir.name}{REFS_SUFFIX}', []).append({
+            'filepath': str(extract_cache_path(result, basepath)),
+            'digest': result['digest'],
+            'duplicate_of': result['duplicate_of'],
+        })
+    for refs_fp, listdict in rows.items():
+        write_jsonl(listdict, refs_fp)
+    for result in duplicates:
+        manifest_for(result, basepath).add(result['digest'])
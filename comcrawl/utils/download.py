@@ -6,16 +6,41 @@ This module contains helper functions for downloading records from Common Crawl
 
 #import io
 #import gzip
+import time
+import zlib
+from concurrent import futures
+from typing import Iterator
 from pathlib import Path
-import requests
 from requests.exceptions import ReadTimeout,RequestException
 from urllib.parse import urlparse
 from .custom_types import Index,ResultList,Result
-from .cache import write_file,read_gzip,write_gzip,write_cache
-from .multithreading import make_multithreaded
+from .cache import write_file,read_gzip_bytes,write_gzip,decode_gzip,write_cache
+from .multithreading import imap,imap_unordered
+from .transport import Transport,DEFAULT_TRANSPORT,DATA_URL_TEMPLATE
+from .planner import Span,plan_spans,group_spans,summarize_spans,MAX_GAP,MAX_SPAN_BYTES
+from .scheduler import item_bytes,interleave_by_length
+from .sharding import shard_for
+from .manifest import Manifest,get_manifest,MANIFEST_SUFFIX
+from .lifecycle import until_stopped
+from .autotune import ConcurrencyGate
+from .byteranges import format_ranges,parse_content_range,iter_byteranges,slice_parts
+from .metrics import METRICS
+from .warc import parse_warc_record,WarcFormatError
 from trafilatura import extract # strip content from html files
 #from warcio.archiveiterator import ArchiveIterator
 
+RECORDS = METRICS.counter('comcrawl_records_total', 'Records processed, whether their extract was cached before or not.')
+RECORD_BYTES = METRICS.counter('comcrawl_record_bytes_total', 'Bytes of gzipped records downloaded.')
+RECORD_CACHE_HITS = METRICS.counter('comcrawl_record_cache_hits_total', 'Gzipped records read from the cache instead of downloaded.')
+CACHE_HITS = METRICS.counter('comcrawl_cache_hits_total', 'Records whose extract was already cached.')
+CACHE_MISSES = METRICS.counter('comcrawl_cache_misses_total', 'Records whose extract was written to the cache.')
+EMPTIES = METRICS.counter('comcrawl_empty_records_total', 'Records downloaded without any text to extract.')
+RECORD_FAILURES = METRICS.counter('comcrawl_record_failures_total', 'Records whose download failed.')
+FETCH_SECONDS = METRICS.histogram('comcrawl_fetch_seconds', 'Seconds per range request, retries included.')
+DECODE_SECONDS = METRICS.histogram('comcrawl_decode_seconds', 'Seconds to gunzip, parse and decode one record.')
+EXTRACT_SECONDS = METRICS.histogram('comcrawl_extract_seconds', 'Seconds to extract the text of one record.')
+WRITE_SECONDS = METRICS.histogram('comcrawl_cache_write_seconds', 'Seconds to hand one extract over to the cache writer.')
+
 # https://www.alchemysoftware.com/livedocs/ezscript/Topics/Catalyst/Language.htm
 '''
 from fastlangid.langid import LID
@@ -33,12 +58,14 @@ Chinese (Traditional, Macao S.A.R.)					zh-MO
 Chinese (Traditional, Taiwan)						zh-TW
 '''
 
-from fake_useragent import UserAgent
-ua = UserAgent()
 
+URL_TEMPLATE = DATA_URL_TEMPLATE
+IGNORED_RANGE_FACTOR = 2 # a body sent instead of a range is only read if at most this many times the bytes wanted
 
-TIMEOUT_DURATION = 5
-URL_TEMPLATE = "https://data.commoncrawl.org/{filename}"
+def ignored_range_size(response, wanted: int) -> int:
+    # size of a whole file sent by a server that ignored the Range header, -1 if it is too large (or unknown) to read
+    size = int(response.headers.get('Content-Length', -1))
+    return size if 0 <= size <= IGNORED_RANGE_FACTOR * wanted else -1
 
 '''
 {
@@ -115,45 +142,52 @@ def jsonl_cache_path(index: Index, basepath: str) -> Path:
 def index_cache_path(index: Index, basepath: str) -> Path:
     return Path(basepath) / f"extracts/{index}/" # e.g. basepath/2024-27/
 
-# given search result, request record
-def request_single_record(result: Result) -> str:
-    """Downloads content for single search result.
+# storage location new extracts are written to, the shard of the index when sharded
+def extract_cache_dir(index: Index, basepath: str) -> Path:
+    shard = shard_for(basepath)
+    if shard is None:
+        return index_cache_path(index, basepath)
+    return index_cache_path(index, basepath) / shard.dirname # e.g. basepath/2024-27/shard-3-of-8/
+
+# resume manifest of completed digests, written next to the extracts
+def manifest_for(result: Result, basepath: str) -> Manifest:
+    index = index_from_result(result) # get index
+    cache_dir = extract_cache_dir(index, basepath)
+    return get_manifest(index_cache_path(index, basepath), cache_dir / f'{cache_dir.name}{MANIFEST_SUFFIX}') # e.g. basepath/2024-27/2024-27.done
+
+# given warc file and byte range, request bytes
+def request_range(filename: str, offset: int, length: int, transport: Transport = None) -> bytes:
+    """Downloads a byte range of a WARC file.
 
     Args:
-        result: Common Crawl Index search result from the search function.
-            result["url"]
-            result["urlkey"]
-            result["digest"]
-            result["filename"]
-            result["offset"]
-            result["length"]
+        filename: WARC file path relative to the bucket root.
+        offset: first byte to download.
+        length: number of bytes to download.
+        transport: pooled transport to download with, defaults to the shared transport.
     Returns:
-        The provided result, extended by the corresponding record content string.
+        The downloaded bytes, or an empty string if the request failed.
     """
-    '''
-    result = ic.results[101]
-    basepath = ic.outdir
-    '''
     # do request
+    transport = transport or DEFAULT_TRANSPORT
     raw_content: str = "" # default = no content
+    start_time = time.perf_counter()
     try:
         # build
-        request_url = URL_TEMPLATE.format(filename=result["filename"])
-        offset, length = int(result["offset"]), int(result["length"])
+        request_url = transport.data_url(filename)
         offset_end = offset + length - 1
 
         # do
-        #print(f'[request_single_record] request_url = {request_url}')
-        response = requests.get(
+        #print(f'[request_range] request_url = {request_url}')
+        response = transport.get(
             request_url,
-            timeout=TIMEOUT_DURATION,
             headers={
                 "Range": f"bytes={offset}-{offset_end}",
-                "User-Agent": ua.random, # user_agent
                 #"Accept-Encoding": "*",
-                #"Connection": "keep-alive"
-            }
+            },
+            stream=True, # the body is only read once it is known to be the range
         )
+        if response.status_code >= 400:
+            response.close() # nothing to read
         response.raise_for_status()
         # ('Connection aborted.', ConnectionResetError(10054, 'An existing connection was forcibly closed by the remote host', None, 10054, None))
 
@@ -172,94 +206,397 @@ def request_single_record(result: Result) -> str:
         '''
 
         # parse
-        if response.status_code == 200:
+        if response.status_code == 206: # range reads answer with 206 partial content
             raw_content = response.content
+            RECORD_BYTES.inc(len(response.content))
+            transport.charge(request_url, response, length)
+        elif response.status_code == 200 and ignored_range_size(response, length) >= 0: # server ignored the range and sent a small file
+            raw_content = response.content[offset:offset_end + 1]
+            RECORD_BYTES.inc(len(response.content))
+            transport.charge(request_url, response, length)
+        elif response.status_code == 200:
+            response.close() # do not download a whole warc file
+            print(f'[request_range] {request_url} ignored the range, not downloading the whole file')
+        else:
+            response.close()
+            print(f'[request_range] {request_url} unexpected status {response.status_code}')
 
     except ReadTimeout as e:
-        print(f'[request_single_record] request timed out: {e}')
+        print(f'[request_range] request timed out: {e}')
     except RequestException as e:
-        print(f'[request_single_record] an error occurred: {e}')
+        print(f'[request_range] an error occurred: {e}')
+    finally:
+        FETCH_SECONDS.observe(time.perf_counter() - start_time)
     #except UnicodeDecodeError:
-    #    print(f"[request_single_record] could not extract data from {request_url}")
+    #    print(f"[request_range] could not extract data from {request_url}")
 
     # return
     return raw_content
 
-def get_single_record(result: Result, basepath: str, should_save: bool = False) -> str:
+# given search result, request record
+def request_single_record(result: Result, transport: Transport = None) -> bytes:
+    """Downloads content for single search result.
+
+    Args:
+        result: Common Crawl Index search result from the search function.
+            result["url"]
+            result["urlkey"]
+            result["digest"]
+            result["filename"]
+            result["offset"]
+            result["length"]
+        transport: pooled transport to download with, defaults to the shared transport.
+    Returns:
+        The gzipped record, or an empty string if the request failed.
+    """
+    '''
+    result = ic.results[101]
+    basepath = ic.outdir
+    '''
+    return request_range(result["filename"], int(result["offset"]), int(result["length"]), transport)
+
+# given span of nearby records, request all of them at once
+def request_span(span: Span, transport: Transport = None) -> bytes:
+    return request_range(span.filename, span.start, span.length, transport)
+
+# given warc file and several byte ranges, request all of them at once
+def request_ranges(filename: str, ranges: list, transport: Transport = None) -> list:
+    """Downloads several byte ranges of a WARC file with a single multi-range request.
+
+    Falls back to one request per range for whatever the server did not answer, e.g. when it only
+    returns the first range. A server ignoring the Range header with a file too large to read gets
+    empty records, not a request per range. Hosts that do not answer multi-range requests are
+    remembered by the transport and get single range requests straight away.
+
+    Args:
+        filename: WARC file path relative to the bucket root.
+        ranges: list of (offset, length) pairs.
+        transport: pooled transport to download with, defaults to the shared transport.
+    Returns:
+        The downloaded bytes per range, or an empty string where a request failed.
+    """
+    transport = transport or DEFAULT_TRANSPORT
+    request_url = transport.data_url(filename)
+    if len(ranges) == 1 or not transport.supports_multirange(request_url):
+        return [request_range(filename, offset, length, transport) for offset, length in ranges]
+
+    # do request
+    out: list = [None] * len(ranges) # default = not answered
+    start_time = time.perf_counter()
+    try:
+        response = transport.get(request_url, headers={"Range": format_ranges(ranges)}, stream=True)
+        response.raise_for_status()
+
+        # parse
+        parts: list = []
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code == 206 and content_type.startswith('multipart/byteranges'):
+            parts = list(iter_byteranges(response.content, content_type))
+        elif response.status_code == 206: # server only answered a single range
+            start, end = parse_content_range(response.headers.get('Content-Range', ''))
+            parts = [(start, end, memoryview(response.content))]
+            transport.disable_multirange(request_url)
+        elif response.status_code == 200: # server ignored the ranges, only read the body if it is small
+            size = ignored_range_size(response, sum(length for _, length in ranges))
+            transport.disable_multirange(request_url)
+            if size < 0: # no range is answered, nor downloaded again one by one
+                response.close() # do not download a whole warc file
+                print(f'[request_ranges] {request_url} ignored the ranges, not downloading the whole file')
+                return ["" for _ in ranges]
+            parts = [(0, size - 1, memoryview(response.content))]
+        RECORD_BYTES.inc(sum(len(part[2]) for part in parts))
+        if parts:
+            transport.charge(request_url, response, sum(length for _, length in ranges))
+        out = slice_parts(parts, ranges)
+
+    except ReadTimeout as e:
+        print(f'[request_ranges] request timed out: {e}')
+        return ["" for _ in ranges]
+    except (RequestException, ValueError) as e:
+        print(f'[request_ranges] an error occurred: {e}')
+        return ["" for _ in ranges]
+    finally:
+        FETCH_SECONDS.observe(time.perf_counter() - start_time)
+
+    # fallback for unanswered ranges
+    for i, (offset, length) in enumerate(ranges):
+        if out[i] is None:
+            out[i] = request_range(filename, offset, length, transport)
+
+    # return
+    return out
+
+# given spans of one warc file, request all of them at once
+def request_spans(spans: list, transport: Transport = None) -> list:
+    return request_ranges(spans[0].filename, [(span.start, span.length) for span in spans], transport)
+
+# given search result, get gzipped record from cache or download
+def load_single_record(result: Result, basepath: str, should_save: bool = False, transport: Transport = None, zipped_content: bytes = None) -> bytes:
     cache_path = gzip_cache_path(result, basepath)
     if cache_path.exists():
         print(f'[get_single_extract][cache] {cache_path}')
-        raw_content:str = read_gzip(cache_path)
+        RECORD_CACHE_HITS.inc()
+        zipped_content:bytes = read_gzip_bytes(cache_path)
     else:
-        raw_content:str = request_single_record(result)
+        if zipped_content is None: # not already downloaded as part of a span
+            zipped_content:bytes = request_single_record(result, transport)
         if should_save:
-            write_gzip(raw_content, cache_path)
+            write_gzip(zipped_content, cache_path)
             #write_file(raw_content, record_cache_path(result, basepath)) # contents of warc including header
 
+    # return
+    return zipped_content
+
+# given search result, get decoded record including headers
+def get_single_record(result: Result, basepath: str, should_save: bool = False, transport: Transport = None, zipped_content: bytes = None) -> str:
+    zipped_content:bytes = load_single_record(result, basepath, should_save, transport, zipped_content)
+    raw_content:str = decode_gzip(zipped_content) if zipped_content else ''
+
     # return 
     return raw_content
 
-# given search result, get record
-def get_single_extract(result: Result, basepath: str, should_save: bool = False) -> Result:
-    raw_content:str = get_single_record(result, basepath, should_save)
-
-    # extract content from raw_content
-    extracted_content: str = '' # default
-    if len(raw_content) == 0:
+# given gzipped record, decode the html of its payload (gunzip, warc parsing and charset detection)
+def parse_content(zipped_content: bytes, crawl: str = None) -> str:
+    html: str = '' # default
+    if len(zipped_content) == 0:
         print(f'[get_single_extract] no content')
-        print(raw_content)
     else:
-        stripped_content = raw_content.strip().split("\r\n\r\n", 2) # strip content
-        if len(stripped_content) != 3:
-            print(f'[get_single_extract] unexpected length = {len(stripped_content)}')
-            print(len(stripped_content))
-        else:
-            stripped_content = stripped_content[2] # overwrite default with parsed result
-            extracted_content = extract(stripped_content) # overwrite default with parsed result
+        try:
+            record = parse_warc_record(zipped_content, crawl)
+            if len(record.payload) == 0:
+                print(f'[get_single_extract] no payload, warc type = {record.warc_type}, http status = {record.http_status}')
+            else:
+                html = record.text()
+        except (WarcFormatError, zlib.error, EOFError) as e:
+            print(f'[get_single_extract] unexpected format: {e}')
 
-    # cache
-    if extracted_content is None: extracted_content = ''
+    # return
+    return html
+
+# given html, extract its main text (cpu bound, picklable so it can run in a worker process)
+def extract_text(html: str) -> str:
+    if len(html) == 0:
+        return ''
+    extracted_content = extract(html)
+    return extracted_content if extracted_content is not None else ''
+
+# given gzipped record, extract its content
+def extract_content(zipped_content: bytes, crawl: str = None) -> str:
+    with DECODE_SECONDS.time():
+        html = parse_content(zipped_content, crawl)
+    with EXTRACT_SECONDS.time():
+        return extract_text(html)
+
+# given search result and its extracted content, cache it
+def cache_extract(result: Result, extracted_content: str, basepath: str, completed: bool = True) -> Result:
     fp = extract_cache_path(result, basepath)
-    if fp.exists():
-        print('.')
+    manifest = manifest_for(result, basepath)
+    RECORDS.inc()
+    if result['digest'] in manifest:
+        CACHE_HITS.inc()
     else:
-        print('x')
-        if False: 
-            write_file(extracted_content, fp) # write content extract into separate file
-        else: 
-            write_cache(
-                [{'filepath':str(fp),'content':extracted_content}],
-                index_cache_path(index_from_result(result),basepath)
-            ) # write content extract to jsonl
+        CACHE_MISSES.inc()
+        with WRITE_SECONDS.time():
+            if False: 
+                write_file(extracted_content, fp) # write content extract into separate file
+            else: 
+                write_cache(
+                    [{
+                        'index': index_from_result(result),
+                        'domain': domain_from_result(result),
+                        'digest': result['digest'],
+                        'url': result.get('url'),
+                        'timestamp': result.get('timestamp'),
+                        'content': extracted_content,
+                    }],
+                    extract_cache_dir(index_from_result(result),basepath)
+                ) # write content extract to the cache, see CACHE_SCHEMA
+        if completed:
+            manifest.add(result['digest']) # failed downloads are retried on the next run
+            if len(extracted_content) == 0:
+                EMPTIES.inc()
+        else:
+            RECORD_FAILURES.inc()
 
     # return
     return result
 
-def get_multiple_extracts(results: ResultList, basepath: str, should_save: bool = False, threads: int = None) -> ResultList:
-    """Downloads search results.
+# given search result and its gzipped record, extract and cache content
+def extract_single_record(result: Result, zipped_content: bytes, basepath: str) -> Result:
+    extracted_content:str = extract_content(zipped_content, index_from_result(result))
+    return cache_extract(result, extracted_content, basepath, len(zipped_content) > 0)
 
-    The corresponding record for each Common Crawl results list is downloaded.
+# given search result, get record
+def get_single_extract(result: Result, basepath: str, should_save: bool = False, transport: Transport = None) -> Result:
+    zipped_content:bytes = load_single_record(result, basepath, should_save, transport)
+    return extract_single_record(result, zipped_content, basepath)
+
+# given search result, get (result, gzipped record) pairs
+def load_single_records(result: Result, basepath: str, should_save: bool = False, transport: Transport = None) -> list:
+    return [(result, load_single_record(result, basepath, should_save, transport))]
+
+# given span of nearby records, get (result, gzipped record) pairs with one request
+def load_span_records(span: Span, basepath: str, should_save: bool = False, transport: Transport = None, buffer: bytes = None) -> list:
+    if buffer is None:
+        buffer:bytes = request_span(span, transport)
+    if len(buffer) != span.length:
+        print(f'[load_span_records] unexpected length = {len(buffer)}, expected = {span.length}')
+        buffer = b'' # every record of the span ends up without content
+
+    out: list = []
+    for result, zipped_content in span.slices(buffer):
+        if len(zipped_content):
+            zipped_content = load_single_record(result, basepath, should_save, transport, zipped_content)
+        out.append((result, zipped_content))
+
+    # return
+    return out
+
+# given spans of one warc file, get (result, gzipped record) pairs with one multi-range request
+def load_spans_records(spans: list, basepath: str, should_save: bool = False, transport: Transport = None) -> list:
+    out: list = []
+    buffers:list = request_spans(spans, transport)
+    for span, buffer in zip(spans, buffers):
+        out.extend(load_span_records(span, basepath, should_save, transport, buffer))
+
+    # return
+    return out
+
+# given span of nearby records, get all records with one request
+def get_span_extracts(span: Span, basepath: str, should_save: bool = False, transport: Transport = None) -> ResultList:
+    records:list = load_span_records(span, basepath, should_save, transport)
+    return [extract_single_record(result, zipped_content, basepath) for result, zipped_content in records]
+
+# given spans of one warc file, get all records with one multi-range request
+def get_spans_extracts(spans: list, basepath: str, should_save: bool = False, transport: Transport = None) -> ResultList:
+    records:list = load_spans_records(spans, basepath, should_save, transport)
+    return [extract_single_record(result, zipped_content, basepath) for result, zipped_content in records]
+
+def iter_multiple_extracts(
+    results: ResultList,
+    basepath: str,
+    should_save: bool = False,
+    threads: int = None,
+    transport: Transport = None,
+    coalesce: bool = False,
+    max_gap: int = MAX_GAP,
+    max_span_bytes: int = MAX_SPAN_BYTES,
+    max_ranges: int = None,
+    extract_workers: int = None,
+    queue_size: int = None,
+    ordered: bool = False,
+    buffer_size: int = None,
+    max_bytes_in_flight: int = None,
+    parse_workers: int = None,
+    extract_gate: ConcurrencyGate = None,
+    extract_pool: futures.ProcessPoolExecutor = None,
+) -> Iterator[Result]:
+    """Downloads search results, yielding each as soon as it is processed.
+
+    Nothing is accumulated, so results can be consumed and dropped in constant memory.
 
     Args:
-        results: list of Common Crawl search results
-        threads: number of threads to use
+        results: Common Crawl search results, any iterable unless coalescing, which needs them all up front
         basepath: where to cache results
-
-    Returns:
-        List of all results with corresponding contents in 'contents' key and languages in 'languages' key if requested
+        should_save: whether to cache the raw gzipped records
+        threads: number of threads to use
+        transport: pooled transport to download with, its pool is sized to `threads`
+        coalesce: whether to merge nearby records of the same WARC file into single range reads
+        max_gap: maximum number of unused bytes between two coalesced records
+        max_span_bytes: maximum size of one coalesced range read
+        max_ranges: if set above 1, spans of one WARC file too far apart to coalesce are fetched up to
+            `max_ranges` at a time with multi-range requests
+        extract_workers: if set, records go through a pipeline instead of being processed on the download threads:
+            parse threads decode them and this many worker processes extract their text, fed through bounded queues
+        queue_size: maximum number of downloaded records being parsed or waiting for a parse thread
+        ordered: whether to yield results in input order, only for single records without extract workers
+        buffer_size: with `ordered`, maximum number of results in flight or waiting for an earlier one
+        max_bytes_in_flight: if set, downloads are held back while the records in flight add up to more than
+            this many bytes (by their known length), and large and small records are interleaved to keep the link busy
+        parse_workers: with `extract_workers`, number of threads gunzipping and decoding records
+        extract_gate: with `extract_workers`, a `ConcurrencyGate` changing the number of extract workers in use while running
+        extract_pool: with `extract_workers`, a process pool created before any other thread was started, see `make_process_pool`
+
+    Yields:
+        Processed results, in completion order unless `ordered`.
 
     """
-    # populate results
-    out: ResultList = [] # default = no results
-    if threads:
+    transport = transport or DEFAULT_TRANSPORT
+    multirange = (max_ranges or 1) > 1
+    if ordered and (coalesce or multirange or extract_workers or max_bytes_in_flight):
+        raise ValueError('ordered results are only supported without coalescing, multi-range requests, extract workers or a cap on bytes in flight')
+
+    # unit of work is either a single result or a span of nearby results
+    func, load, items = get_single_extract, load_single_records, results
+    if coalesce or multirange:
+        results = list(results)
+        cached = [result for result in results if gzip_cache_path(result, basepath).exists()] # no need to download these
+        cached_ids = set(map(id, cached))
+        spans = plan_spans(
+            [result for result in results if id(result) not in cached_ids],
+            max_gap if coalesce else 0, # without coalescing only merge directly adjacent records
+            max_span_bytes,
+        )
+        print(f'[get_multiple_extracts] coalesced {summarize_spans(spans)}, cached = {len(cached)}')
+        func, load, items = get_span_extracts, load_span_records, spans
+        if multirange:
+            func, load, items = get_spans_extracts, load_spans_records, group_spans(spans, max_ranges, max_span_bytes)
+            print(f'[get_multiple_extracts] multi-range requests = {len(items)}')
+        yield from iter_multiple_extracts(cached, basepath, should_save, threads, transport, extract_workers=extract_workers, queue_size=queue_size, parse_workers=parse_workers, extract_gate=extract_gate, extract_pool=extract_pool)
+
+    if max_bytes_in_flight and threads:
+        items = interleave_by_length(items) # largest, smallest, next largest, ...
+    items = until_stopped(items) # on SIGTERM/SIGINT only the work in flight is finished
+
+    if extract_workers:
+        # download threads, parse threads, extraction processes and a writer, joined by bounded queues
+        from .pipeline import iter_extracts_pipelined # pipeline builds on this module
+        yield from iter_extracts_pipelined(items, load, basepath, should_save, threads, transport, extract_workers, queue_size, max_bytes_in_flight, parse_workers, extract_gate, extract_pool)
+    elif threads:
         # multi-thread
-        multithreaded_download = make_multithreaded(get_single_extract, threads)
-        out = multithreaded_download(results, basepath, should_save)
+        transport.resize(threads) # one keep-alive session per thread
+        if ordered:
+            yield from imap(func, items, threads, (basepath, should_save, transport), buffer_size)
+        else:
+            yield from imap_unordered(func, items, threads, (basepath, should_save, transport), item_bytes, max_bytes_in_flight)
     else:
         # single-thread
-        for result in results:
-            res:Result = get_single_extract(result, basepath, should_save)
-            out.append(res) # append single result
+        for item in items:
+            res = func(item, basepath, should_save, transport)
+            if isinstance(res, list):
+                yield from res # span results
+            else:
+                yield res # single result
+    print(f'[get_multiple_extracts] metrics {METRICS.snapshot()}')
+
+def get_multiple_extracts(
+    results: ResultList,
+    basepath: str,
+    should_save: bool = False,
+    threads: int = None,
+    transport: Transport = None,
+    coalesce: bool = False,
+    max_gap: int = MAX_GAP,
+    max_span_bytes: int = MAX_SPAN_BYTES,
+    max_ranges: int = None,
+    extract_workers: int = None,
+    queue_size: int = None,
+    max_bytes_in_flight: int = None,
+    parse_workers: int = None,
+    extract_gate: ConcurrencyGate = None,
+    extract_pool: futures.ProcessPoolExecutor = None,
+) -> ResultList:
+    """Downloads search results.
 
-    # return
-    return out
\ No newline at end of file
+    The corresponding record for each Common Crawl results list is downloaded.
+    See `iter_multiple_extracts` for the arguments.
+
+    Returns:
+        List of all results with corresponding contents in 'contents' key and languages in 'languages' key if requested
+
+    """
+    return list(iter_multiple_extracts(
+        results, basepath, should_save, threads, transport,
+        coalesce, max_gap, max_span_bytes, max_ranges, extract_workers, queue_size,
+        max_bytes_in_flight=max_bytes_in_flight, parse_workers=parse_workers, extract_gate=extract_gate, extract_pool=extract_pool,
+    ))
@@ -0,0 +1,222 @@
+"""Async Download Helpers.
+
+This module contains an asyncio engine for downloading records from Common Crawl S3 Buckets,
+as an alternative to running one OS thread per in-flight request.
+
+"""
+
+import asyncio
+import os
+import time
+from concurrent import futures
+import aiohttp
+from .custom_types import ResultList,Result
+from .cache import read_gzip_bytes,write_gzip
+from .download import gzip_cache_path,extract_single_record,ignored_range_size,FETCH_SECONDS,RECORD_BYTES
+from .transport import Transport,DEFAULT_TRANSPORT,ua
+from .metrics import METRICS
+from .throttle import AsyncAdaptiveLimiter,backoff_delay,THROTTLE_STATUSES,RETRY_STATUSES,RETRY_COUNT,FAILURE_COUNT
+from .lifecycle import LIFECYCLE,until_stopped
+
+
+CONCURRENCY = 1000
+
+# given search result, request record
+async def request_single_record_async(
+    session: aiohttp.ClientSession,
+    result: Result,
+    transport: Transport = None,
+    limiter: AsyncAdaptiveLimiter = None,
+) -> bytes:
+    """Downloads content for single search result without blocking the event loop.
+
+    Retries throttled, failed and timed out requests with the backoff settings of the transport.
+
+    Args:
+        session: aiohttp session holding the connection pool.
+        result: Common Crawl Index search result from the search function.
+        transport: transport providing the data url, timeout and retry settings, defaults to the shared transport.
+        limiter: adaptive limit on in-flight requests.
+
+    Returns:
+        The gzipped record, or an empty string if the request failed.
+
+    """
+    transport = transport or DEFAULT_TRANSPORT
+    limiter = limiter or AsyncAdaptiveLimiter(1)
+    raw_content = "" # default = no content
+
+    # build
+    request_url = transport.data_url(result["filename"])
+    offset, length = int(result["offset"]), int(result["length"])
+    offset_end = offset + length - 1
+
+    for attempt in range(transport.retries + 1):
+        status, error = None, None
+        if transport.rate_limiter:
+            wait = transport.rate_limiter.reserve(request_url, length)
+            if wait > 0:
+                await asyncio.sleep(wait) # wait for the budget before taking an in-flight slot
+        try:
+            # do
+            async with limiter:
+                start_time = time.monotonic()
+                async with session.get(
+                    request_url,
+                    headers={
+                        "Range": f"bytes={offset}-{offset_end}",
+                        "User-Agent": ua.random, # user_agent
+                    }
+                ) as response:
+                    status = response.status
+                    if status not in RETRY_STATUSES:
+                        response.raise_for_status()
+
+                        # parse
+                        if status == 206: # range reads answer with 206 partial content
+                            raw_content = await response.read()
+                        elif status == 200 and ignored_range_size(response, length) >= 0: # range ignored, small file
+                            raw_content = (await response.read())[offset:offset_end + 1]
+                        elif status == 200:
+                            response.close() # do not download a whole warc file
+                            print(f'[request_single_record_async] {request_url} ignored the range, not downloading')
+                        else:
+                            response.close()
+                            print(f'[request_single_record_async] {request_url} unexpected status {status}')
+                        limiter.on_success(time.monotonic() - start_time)
+                        return raw_content
+
+        except asyncio.TimeoutError as e:
+            error = e
+            print(f'[request_single_record_async] request timed out: {e}')
+        except aiohttp.ClientResponseError as e:
+            print(f'[request_single_record_async] an error occurred: {e}')
+            return raw_content # not worth retrying, e.g. 404
+        except aiohttp.ClientError as e:
+            error = e
+            print(f'[request_single_record_async] an error occurred: {e}')
+
+        # throttled or failed
+        if error is not None or status in THROTTLE_STATUSES:
+            limiter.on_throttle()
+        if attempt == transport.retries or LIFECYCLE.stopping: # no retries while shutting down
+            FAILURE_COUNT.inc()
+            print(f'[request_single_record_async] giving up after {attempt + 1} attempts, status = {status}')
+            return raw_content
+        RETRY_COUNT.inc()
+        await asyncio.sleep(backoff_delay(attempt, transport.backoff_base, transport.backoff_cap))
+
+    # return
+    return raw_content
+
+# given search result, get record
+async def get_single_extract_async(
+    session: aiohttp.ClientSession,
+    executor: futures.Executor,
+    result: Result,
+    basepath: str,
+    should_save: bool = False,
+    transport: Transport = None,
+    limiter: AsyncAdaptiveLimiter = None,
+) -> Result:
+    loop = asyncio.get_running_loop()
+
+    # get record, disk access happens off the event loop
+    cache_path = gzip_cache_path(result, basepath)
+    if cache_path.exists():
+        print(f'[get_single_extract_async][cache] {cache_path}')
+        zipped_content:bytes = await loop.run_in_executor(executor, read_gzip_bytes, cache_path)
+    else:
+        with FETCH_SECONDS.time():
+            zipped_content:bytes = await request_single_record_async(session, result, transport, limiter)
+        RECORD_BYTES.inc(len(zipped_content))
+        if should_save:
+            await loop.run_in_executor(executor, write_gzip, zipped_content, cache_path)
+
+    # extract and cache, cpu and disk bound so also off the event loop
+    return await loop.run_in_executor(executor, extract_single_record, result, zipped_content, basepath)
+
+async def aget_multiple_extracts(
+    results: ResultList,
+    basepath: str,
+    should_save: bool = False,
+    concurrency: int = CONCURRENCY,
+    transport: Transport = None,
+    extract_threads: int = None,
+) -> ResultList:
+    """Downloads search results on the running event loop.
+
+    Keeps up to `concurrency` records in flight, bounded by a semaphore. Tasks are only created
+    once a slot frees up, so memory stays flat for arbitrarily long result lists.
+
+    Args:
+        results: list of Common Crawl search results
+        basepath: where to cache results
+        should_save: whether to cache the raw gzipped records
+        concurrency: maximum number of records in flight
+        transport: transport providing the data url and timeout
+        extract_threads: number of threads running extraction and cache writes, defaults to the cpu count
+
+    Returns:
+        List of all processed results, input order might not be preserved.
+
+    """
+    transport = transport or DEFAULT_TRANSPORT
+    concurrency = concurrency or CONCURRENCY
+    out: ResultList = [] # default = no results
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = AsyncAdaptiveLimiter(concurrency) # shrinks below the semaphore while throttled
+
+    async def worker(result: Result) -> None:
+        try:
+            res = await get_single_extract_async(session, executor, result, basepath, should_save, transport, limiter)
+            if res is not None:
+                out.append(res)
+        except Exception as e:
+            print(f"Error processing {result}: {e}")
+        finally:
+            semaphore.release()
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+    timeout = aiohttp.ClientTimeout(total=transport.timeout)
+    with futures.ThreadPoolExecutor(max_workers=extract_threads or os.cpu_count()) as executor:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = set()
+            for result in until_stopped(results): # on SIGTERM/SIGINT only the records in flight are finished
+                await semaphore.acquire() # wait for a free slot before creating the next task
+                task = asyncio.create_task(worker(result))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+    print(f'[aget_multiple_extracts] metrics {METRICS.snapshot()}')
+
+    # return
+    return out
+
+def get_multiple_extracts_async(
+    results: ResultList,
+    basepath: str,
+    should_save: bool = False,
+    concurrency: int = CONCURRENCY,
+    transport: Transport = None,
+    extract_threads: int = None,
+) -> ResultList:
+    """Downloads search results with the asyncio engine.
+
+    Same result contract as `get_multiple_extracts`, but network waits happen on one event loop
+    instead of one OS thread per request.
+
+    Args:
+        results: list of Common Crawl search results
+        basepath: where to cache results
+        should_save: whether to cache the raw gzipped records
+        concurrency: maximum number of records in flight
+        transport: transport providing the data url and timeout
+        extract_threads: number of threads running extraction and cache writes, defaults to the cpu count
+
+    Returns:
+        List of all processed results, input order might not be preserved.
+
+    """
+    return asyncio.run(aget_multiple_extracts(results, basepath, should_save, concurrency, transport, extract_threads))
@@ -0,0 +1,136 @@
+"""Lifecycle Helpers.
+
+This module contains signal-aware shutdown: on SIGTERM/SIGINT downloads stop taking new work,
+let the work in flight finish within a deadline and flush cache writes and resume manifests,
+so preempting a job only costs the records that were in flight.
+
+"""
+
+import os
+import signal
+import threading
+from contextlib import contextmanager
+from typing import Callable,Iterable,Iterator
+from .cache import flush_cache
+
+
+SHUTDOWN_DEADLINE = 30.0 # seconds the work in flight gets to finish once a shutdown was requested
+FLUSH_TIMEOUT = 5.0 # most seconds a forced exit waits for queued cache writes, past the deadline
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+EXIT_CODE = 128 # plus the signal number, like a shell reports a process killed by a signal
+
+class Lifecycle:
+    """Shutdown state shared by every download loop of the process.
+
+    The first signal sets the stop flag: loops stop taking new work and drain what is in flight.
+    If they are not done within the deadline, or a second signal arrives, the process exits right
+    away after waiting for the cache write in progress and running the shutdown callbacks.
+
+    Attributes:
+        signum: Signal that requested the shutdown, None if none did.
+        deadline: Seconds the work in flight was given, None for no deadline.
+
+    """
+
+    def __init__(self) -> None:
+        self.signum: int = None
+        self.deadline: float = None
+        self._stop = threading.Event()
+        self._callbacks: list = []
+        self._timer: threading.Timer = None
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop.is_set()
+
+    @property
+    def exit_code(self) -> int:
+        """Exit code of a process stopped by a signal, 0 if none stopped it."""
+        return EXIT_CODE + self.signum if self.signum else 0
+
+    def on_shutdown(self, callback: Callable) -> None:
+        """Registers a function run before a forced exit, e.g. to flush buffered writes."""
+        self._callbacks.append(callback)
+
+    def stop(self, signum: int = None, deadline: float = None) -> None:
+        """Stops taking new work, forcing an exit if the work in flight is not done within `deadline` seconds."""
+        if self.stopping:
+            return
+        self.signum = signum
+        self.deadline = deadline
+        self._stop.set()
+        if deadline is not None:
+            self._timer = threading.Timer(deadline, self.force_exit)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def reset(self) -> None:
+        """Clears the stop flag and cancels the deadline."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._stop.clear()
+        self.signum = None
+        self.deadline = None
+
+    def force_exit(self) -> None:
+        """Exits right away, without leaving a cache write half done or queued writes behind."""
+        print('[Lifecycle] deadline passed, exiting')
+        # stop the cache writers once their queues are written, before the callbacks,
+        # so manifests never list extracts that are not on disk
+        # the deadline is spent already, queued writes only get a short grace on top of it
+        timeout = FLUSH_TIMEOUT if self.deadline is None else min(FLUSH_TIMEOUT, self.deadline)
+        if not flush_cache(forget=True, timeout=timeout):
+            print('[Lifecycle] cache writes still in progress, exiting anyway')
+            os._exit(self.exit_code or EXIT_CODE)
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f'[Lifecycle] exception {e}')
+        os._exit(self.exit_code or EXIT_CODE)
+
+    def until_stopped(self, items: Iterable) -> Iterator:
+        """Yields items until a shutdown is requested."""
+        for item in items:
+            if self.stopping:
+                print('[Lifecycle] shutdown requested, not taking new work')
+                return
+            yield item
+
+    @contextmanager
+    def handle_signals(
+        self, deadline: float = SHUTDOWN_DEADLINE, signals: tuple = SHUTDOWN_SIGNALS,
+    ) -> Iterator['Lifecycle']:
+        """Turns `signals` into graceful shutdowns while the block runs, restoring the previous handlers after.
+
+        Handlers can only be installed from the main thread, elsewhere the block runs without them.
+
+        """
+        def handler(signum, frame) -> None:
+            if self.stopping:
+                print(f'[Lifecycle] {signal.Signals(signum).name} again, exiting')
+                self.force_exit()
+            print(f'[Lifecycle] {signal.Signals(signum).name}, draining work in flight for up to {deadline}s')
+            self.stop(signum, deadline)
+
+        self.reset()
+        previous = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in signals:
+                previous[signum] = signal.signal(signum, handler)
+        try:
+            yield self
+        finally:
+            for signum, previous_handler in previous.items():
+                signal.signal(signum, previous_handler)
+            if self._timer:
+                self._timer.cancel() # drained in time
+                self._timer = None
+
+# shared by every download loop of the process
+LIFECYCLE = Lifecycle()
+
+def until_stopped(items: Iterable) -> Iterator:
+    """Yields items until a shutdown is requested, see `Lifecycle.until_stopped`."""
+    return LIFECYCLE.until_stopped(items)
@@ -0,0 +1,149 @@
+"""Manifest Helpers.
+
+This module contains the resume manifest, a compact on-disk set of digests whose extracts are cached,
+so reruns skip finished records with one file read per index instead of a file check per record.
+
+"""
+
+import atexit
+import os
+import threading
+from pathlib import Path
+from .custom_types import ResultList
+from .cache import iter_cache,flush_cache,digest_key,DIGEST_SIZE
+from .lifecycle import LIFECYCLE
+
+
+BATCH_SIZE = 1000 # digests buffered before they are appended to disk
+MANIFEST_SUFFIX = '.done'
+
+class Manifest:
+    """Set of completed digests of one index, appended to disk in batches.
+
+    Every writer appends fixed-size keys to its own file (the index, or its shard when sharded),
+    loading reads every manifest file under the index, so shards and merged shards count too.
+    A write torn by a crash only loses its partial last key.
+
+    Attributes:
+        indexdir: Index cache directory the manifest belongs to, e.g. basepath/extracts/2024-26.
+        path: File new digests are appended to.
+        batch_size: Number of digests buffered before they are appended.
+
+    """
+
+    def __init__(self, indexdir: str, path: str = None, batch_size: int = BATCH_SIZE) -> None:
+        self.indexdir = Path(indexdir)
+        self.path = Path(path) if path else self.indexdir / f'{self.indexdir.name}{MANIFEST_SUFFIX}'
+        self.batch_size = batch_size
+        self._done: set = None # loaded on first use
+        self._pending: list = []
+        self._lock = threading.Lock() # guards the digests in memory
+        self._write_lock = threading.Lock() # orders appends to disk
+
+    def _load(self) -> set:
+        if self._done is None:
+            done = set()
+            for fp in self.indexdir.rglob(f'*{MANIFEST_SUFFIX}'):
+                data = fp.read_bytes()
+                done.update(data[i:i + DIGEST_SIZE] for i in range(0, len(data) - len(data) % DIGEST_SIZE, DIGEST_SIZE))
+            self._done = done
+        return self._done
+
+    def __contains__(self, digest: str) -> bool:
+        with self._lock:
+            return digest_key(digest) in self._load()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+    def add(self, digest: str) -> None:
+        """Marks a digest as completed, it is written once `batch_size` digests are pending."""
+        key = digest_key(digest)
+        with self._lock:
+            done = self._load()
+            if key not in done:
+                done.add(key)
+                self._pending.append(key)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush() # outside the lock, so lookups and adds don't wait for the disk
+
+    def flush(self) -> None:
+        """Appends pending digests to disk."""
+        with self._write_lock: # batches taken earlier are on disk once this returns
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending and not self._write(pending):
+                with self._lock:
+                    self._pending[:0] = pending # retried on the next flush
+
+    def _write(self, pending: list) -> bool:
+        try:
+            flush_cache() # extracts reach disk before the digests marking them done
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(pending))
+                f.flush()
+                os.fsync(f.fileno())
+            return True
+        except Exception as e:
+            print(f'[Manifest] exception {e}')
+            return False
+
+# manifest per (index cache directory, file written to)
+MANIFESTS: dict = {}
+MANIFESTS_LOCK = threading.Lock()
+
+def get_manifest(indexdir: str, path: str = None) -> Manifest:
+    """Returns the shared manifest of an index cache, creating it on first use."""
+    key = (str(indexdir), str(path))
+    with MANIFESTS_LOCK:
+        manifest = MANIFESTS.get(key)
+        if manifest is None:
+            manifest = MANIFESTS[key] = Manifest(indexdir, path)
+        return manifest
+
+def flush_manifests() -> None:
+    """Appends pending digests of every manifest to disk."""
+    with MANIFESTS_LOCK:
+        manifests = list(MANIFESTS.values())
+    for manifest in manifests:
+        manifest.flush()
+
+atexit.register(flush_manifests)
+LIFECYCLE.on_shutdown(flush_manifests) # atexit is skipped when the shutdown deadline forces an exit
+
+def filter_done(results: ResultList, manifest_of) -> tuple:
+    """Splits search results into completed and pending ones.
+
+    Args:
+        results: search results
+        manifest_of: function giving the manifest of a search result
+
+    Returns:
+        Completed results and pending results.
+
+    """
+    done, pending = [], []
+    for result in results:
+        (done if result['digest'] in manifest_of(result) else pending).append(result)
+    print(f'[filter_done] completed = {len(done)}, pending = {len(pending)}')
+    return done, pending
+
+def rebuild_manifest(indexdir: str) -> int:
+    """Builds the manifest of an index cache written before manifests existed, out of its cached extracts.
+
+    Records cached without content are left out, they might have been failed downloads.
+
+    Returns:
+        Number of digests in the manifest.
+
+    """
+    manifest = get_manifest(indexdir)
+    for batch in iter_cache(indexdir, ['digest']):
+        for key in batch.column(0).to_pylist():
+            if key is not None:
+                manifest.add(key)
+    manifest.flush()
+    return len(manifest)
@@ -0,0 +1,266 @@
+"""Metrics Helpers.
+
+This module contains thread-safe counters, gauges and histograms shared by the download helpers,
+and their export to a Prometheus textfile (for node_exporter's textfile collector) and to json.
+
+"""
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+class Counter:
+    """Monotonically increasing value, e.g. number of retries."""
+
+    def __init__(self, name: str, documentation: str = '') -> None:
+        self.name = name
+        self.documentation = documentation
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+class Gauge:
+    """Value that goes up and down, e.g. current concurrency."""
+
+    def __init__(self, name: str, documentation: str = '') -> None:
+        self.name = name
+        self.documentation = documentation
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+# seconds, from a fast cache hit to a slow download
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    """Distribution of observed values over fixed buckets, e.g. latencies of a stage."""
+
+    def __init__(self, name: str, documentation: str = '', buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1) # last one is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observes the seconds the block took."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    @property
+    def value(self) -> int:
+        return self.count
+
+    def cumulative(self) -> list:
+        """(upper bound, number of values up to it) pairs, ending with +Inf."""
+        with self._lock:
+            counts = list(self._counts)
+        pairs, total = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating inside its bucket, like Prometheus' histogram_quantile."""
+        pairs = self.cumulative()
+        total = pairs[-1][1]
+        if total == 0:
+            return 0.0
+        rank = q * total
+        lower, below = 0.0, 0
+        for bound, count in pairs:
+            if count >= rank:
+                if math.isinf(bound):
+                    return lower # beyond the last bucket, its bound is the best guess
+                return lower + (bound - lower) * (rank - below) / max(count - below, 1)
+            lower, below = bound, count
+        return lower
+
+    def summary(self) -> dict:
+        count = self.count
+        return {
+            'count': count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / count, 6) if count else 0.0,
+            'p50': round(self.quantile(0.5), 6),
+            'p99': round(self.quantile(0.99), 6),
+        }
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """Named collection of metrics, asking twice for the same name returns the same metric."""
+
+    def __init__(self) -> None:
+        self._metrics: dict = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls: type, name: str, documentation: str):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation)
+            elif not isinstance(metric, cls):
+                raise TypeError(f'metric {name} is a {type(metric).__name__}, not a {cls.__name__}')
+            return metric
+
+    def counter(self, name: str, documentation: str = '') -> Counter:
+        return self._get(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str = '') -> Gauge:
+        return self._get(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str = '') -> Histogram:
+        return self._get(Histogram, name, documentation)
+
+    def _all(self) -> list:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self) -> dict:
+        """Current value of every metric, keyed by name, histograms by their number of observations."""
+        return {metric.name: metric.value for metric in self._all()}
+
+    def since(self, snapshot: dict) -> dict:
+        """Like `snapshot`, with counters and histogram counts relative to an earlier `snapshot`, e.g. per run."""
+        return {
+            metric.name: metric.value if isinstance(metric, Gauge) else metric.value - snapshot.get(metric.name, 0)
+            for metric in self._all()
+        }
+
+    def summary(self) -> dict:
+        """Like `snapshot`, with count, sum, mean, p50 and p99 of every histogram."""
+        return {
+            metric.name: metric.summary() if isinstance(metric, Histogram) else metric.value
+            for metric in self._all()
+        }
+
+    def to_prometheus(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in sorted(self._all(), key=lambda metric: metric.name):
+            kind = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}[type(metric)]
+            if metric.documentation:
+                lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {kind}')
+            if isinstance(metric, Histogram):
+                pairs = metric.cumulative()
+                for bound, count in pairs:
+                    lines.append(f'{metric.name}_bucket{{le="{_format_value(bound)}"}} {count}')
+                lines.append(f'{metric.name}_sum {_format_value(metric.sum)}')
+                lines.append(f'{metric.name}_count {pairs[-1][1]}')
+            else:
+                lines.append(f'{metric.name} {_format_value(metric.value)}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str) -> None:
+        """Writes `to_prometheus` to `path` atomically, so a scrape never sees half a file."""
+        write_atomic(self.to_prometheus(), path)
+
+    def write_summary(self, path: str) -> None:
+        """Writes `summary` to `path` as json."""
+        write_atomic(json.dumps(self.summary(), indent=2), path)
+
+def write_atomic(text: str, path: str) -> None:
+    path = Path(path)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(text, encoding='utf-8')
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f'[write_atomic] exception {e}')
+
+class MetricsExporter:
+    """Writes a registry to a Prometheus textfile every `interval` seconds from a background thread.
+
+    Attributes:
+        path: Textfile written to, e.g. /var/lib/node_exporter/textfile/comcrawl.prom.
+        interval: Seconds between two writes.
+        registry: Metrics written.
+
+    """
+
+    def __init__(self, path: str, interval: float = 15.0, registry: 'MetricsRegistry' = None) -> None:
+        self.path = path
+        self.interval = interval
+        self.registry = registry or METRICS
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.registry.write_textfile(self.path)
+
+    def start(self) -> 'MetricsExporter':
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops the background thread, writing the final values."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.registry.write_textfile(self.path)
+
+    def __enter__(self) -> 'MetricsExporter':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+# default registry
+METRICS = MetricsRegistry()
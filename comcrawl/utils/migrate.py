@@ -0,0 +1,81 @@
+"""Migration Helpers.
+
+This module contains the migration of caches written before the typed cache schema, with rows of
+{'filepath', 'content'}, to `CACHE_SCHEMA`, converting parquet files in parallel over a process pool.
+
+"""
+
+import os
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .cache import (
+    CACHE_SCHEMA,LEGACY_COLUMNS,ROW_GROUP_ROWS,
+    is_legacy,upgrade_batch,list_parquet_files,indexdir_to_jsonl,count_lines,
+    get_writer,flush_cache,
+)
+from .pipeline import make_process_pool
+from .sharding import shard_dirs
+
+
+MIGRATE_SUFFIX = '.migrate' # parquet file being converted, replaces the original once complete
+
+def migrate_parquet(parquet_fp: str, row_group_rows: int = ROW_GROUP_ROWS) -> int:
+    """Rewrites a legacy parquet file in the typed schema, row group by row group.
+
+    Returns:
+        Number of records converted, 0 if the file was typed already.
+
+    """
+    pf = pq.ParquetFile(parquet_fp)
+    if not is_legacy(pf.schema_arrow):
+        return 0
+    tmp_fp = Path(f'{parquet_fp}{MIGRATE_SUFFIX}')
+    records = 0
+    with pq.ParquetWriter(tmp_fp, CACHE_SCHEMA, compression='snappy') as writer:
+        for batch in pf.iter_batches(batch_size=row_group_rows, columns=LEGACY_COLUMNS):
+            writer.write_table(pa.Table.from_batches([upgrade_batch(batch)]), row_group_size=row_group_rows)
+            records += batch.num_rows
+    os.replace(tmp_fp, parquet_fp)
+    os.chmod(parquet_fp, 0o777) # make accessible
+    return records
+
+def migrate_cache(indexdirs: list, workers: int = None) -> int:
+    """Migrates index caches, their shards included, to the typed schema.
+
+    Parquet files are converted in parallel over `workers` processes (defaults to the number of cpus),
+    each replacing the original once complete, so an interrupted migration can be run again.
+    The records of the jsonl journal are then rolled over into a typed parquet file by the cache writer.
+
+    Args:
+        indexdirs: index caches, e.g. [basepath/extracts/2024-22, basepath/extracts/2024-26], or a single one
+
+    Returns:
+        Number of records converted.
+
+    """
+    indexdirs = [indexdirs] if isinstance(indexdirs, (str, Path)) else indexdirs
+    dirs = [path for indexdir in map(Path, indexdirs) for path in [indexdir] + shard_dirs(indexdir)]
+    for path in dirs:
+        flush_cache(path, forget=True) # no rollover while converting
+
+    # parquet files
+    migrated = 0
+    files = [fp for path in dirs for fp in list_parquet_files(path)]
+    with make_process_pool(workers or os.cpu_count()) as pool:
+        for fp, records in zip(files, pool.map(migrate_parquet, files)):
+            print(f'[migrate_cache] {fp} records = {records}')
+            migrated += records
+
+    # jsonl, journaled records are converted when the writer starts and written when it closes
+    for path in dirs:
+        jsonl_fp = indexdir_to_jsonl(path, path.name)
+        if jsonl_fp.exists() and jsonl_fp.stat().st_size:
+            records = count_lines(jsonl_fp)
+            get_writer(path)
+            flush_cache(path, forget=True)
+            print(f'[migrate_cache] {jsonl_fp} records = {records}')
+            migrated += records
+
+    # return
+    return migrated
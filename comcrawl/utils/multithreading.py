@@ -5,10 +5,115 @@ to manage multi-threading.
 
 """
 
-from typing import Callable
+from typing import Callable, Iterable, Iterator
 from concurrent import futures
-import time
-import threading
+import collections
+import queue
+
+def _make_worker(func: Callable, args: tuple) -> Callable:
+    def worker(input_item):
+        """Wrap the function call in a try-except to handle exceptions."""
+        try:
+            return func(input_item, *args)  # Pass *args to the function
+        except Exception as e:
+            print(f"Error processing {input_item}: {e}")  # Print the exception
+            return None  # Return None or handle as needed
+
+    return worker
+
+def _flatten(result) -> list:
+    """Results of a task, lists are flattened and failures dropped."""
+    if result is None:
+        return []
+    if isinstance(result, list):
+        return result
+    return [result]
+
+def imap_unordered(
+    func: Callable,
+    input_list: Iterable,
+    threads: int,
+    args: tuple = (),
+    weight: Callable = None,
+    max_weight: float = None,
+) -> Iterator:
+    """Executes function on input objects using multiple threads, yielding results as they complete.
+
+    At most `threads` tasks are in flight, a slot is refilled as soon as any task finishes,
+    so memory stays flat however long the input is. If `max_weight` is set, a task is also held
+    back while the weights of the tasks in flight would add up to more than that. A task heavier
+    than `max_weight` on its own still runs, once nothing else is in flight.
+
+    Args:
+        func: Function that is meant to be executed on
+            every input object.
+        input_list: The objects a function should be executed on,
+            any iterable, consumed as slots free up.
+        threads: The number of threads to use.
+        args: Additional parameters needed for the function to be executed.
+        weight: Function giving the weight of an input object, e.g. its size in bytes.
+        max_weight: Maximum total weight of the tasks in flight.
+
+    Yields:
+        Results in completion order, list results are flattened
+        and failed tasks are left out.
+
+    """
+    worker = _make_worker(func, args)
+    with futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        completed = queue.SimpleQueue()
+        in_flight = {}  # Future -> weight
+        in_flight_weight = 0
+        for input_item in input_list:
+            item_weight = weight(input_item) if max_weight else 0
+            while in_flight and (len(in_flight) == threads or max_weight and in_flight_weight + item_weight > max_weight):
+                future = completed.get()  # Wait for a free slot
+                in_flight_weight -= in_flight.pop(future)
+                yield from _flatten(future.result())
+            future = executor.submit(worker, input_item)
+            in_flight[future] = item_weight
+            in_flight_weight += item_weight
+            future.add_done_callback(completed.put)
+
+        # Drain the last tasks
+        while in_flight:
+            future = completed.get()
+            in_flight.pop(future)
+            yield from _flatten(future.result())
+
+def imap(func: Callable, input_list: Iterable, threads: int, args: tuple = (), buffer_size: int = None) -> Iterator:
+    """Executes function on input objects using multiple threads, yielding results in input order.
+
+    Tasks finishing ahead of an earlier, slower one wait in a reorder buffer. No task is started
+    more than `buffer_size` inputs ahead of the oldest unfinished one, which bounds the buffer.
+
+    Args:
+        func: Function that is meant to be executed on
+            every input object.
+        input_list: The objects a function should be executed on,
+            any iterable, consumed as the buffer frees up.
+        threads: The number of threads to use.
+        args: Additional parameters needed for the function to be executed.
+        buffer_size: Maximum number of tasks in flight or waiting to be yielded,
+            defaults to twice the number of threads.
+
+    Yields:
+        Results in input order, list results are flattened
+        and failed tasks are left out.
+
+    """
+    worker = _make_worker(func, args)
+    buffer_size = max(buffer_size or 2 * threads, 1)
+    with futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()  # Futures in input order
+        for input_item in input_list:
+            if len(pending) == buffer_size:
+                yield from _flatten(pending.popleft().result())  # Wait for the oldest task
+            pending.append(executor.submit(worker, input_item))
+
+        # Drain the last tasks
+        while pending:
+            yield from _flatten(pending.popleft().result())
 
 def make_multithreaded(func: Callable, threads: int) -> Callable:
     """Creates a multithreaded version of a function.
@@ -28,8 +133,8 @@ def make_multithreaded(func: Callable, threads: int) -> Callable:
         """Executes function on input list using multiple threads.
 
         Args:
-            input_list: The list of objects a function should be
-                executed on.
+            input_list: The objects a function should be executed on,
+                any iterable, consumed as slots free up.
             *args: Variable length argument list of additional
                 parameters needed for the function to be executed.
 
@@ -39,39 +144,6 @@ def make_multithreaded(func: Callable, threads: int) -> Callable:
             output list.
 
         """
-        results = []
-        input_queue = input_list[:]  # Copy of the input list
-
-        def worker(input_item):
-            """Wrap the function call in a try-except to handle exceptions."""
-            try:
-                return func(input_item, *args)  # Pass *args to the function
-            except Exception as e:
-                print(f"Error processing {input_item}: {e}")  # Print the exception
-                return None  # Return None or handle as needed
-
-        with futures.ThreadPoolExecutor(max_workers=threads) as executor:
-            while input_queue:
-                # Submit tasks to the executor
-                future_to_input_item = {
-                    executor.submit(worker, input_item): input_item for input_item in input_queue[:threads]
-                }
-                input_queue = input_queue[threads:]  # Remove submitted items from the queue
-
-                # Print the number of currently running threads
-                print(f"Number of running threads: {threading.active_count()}")
-
-                for future in futures.as_completed(future_to_input_item):
-                    result = future.result()
-                    if result is not None:
-                        if isinstance(result, list):
-                            results.extend(result)
-                        else:
-                            results.append(result)
-
-                # Sleep briefly to allow any new threads to be created
-                time.sleep(0.1)
-
-        return results
+        return list(imap_unordered(func, input_list, threads, args))
 
     return multithreaded_function
@@ -0,0 +1,298 @@
+"""Pipeline Helpers.
+
+This module contains a download pipeline split into stages, each with its own pool of workers:
+download threads fetch raw records (network), parse threads gunzip and decode them, a process pool
+extracts their text on every core (cpu) and a single writer thread caches the extracts (disk).
+Bounded queues between the stages hold back whichever stage runs ahead, so memory stays flat
+while each resource is kept busy on its own.
+
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent import futures
+from contextlib import nullcontext
+from typing import Callable,Iterable,Iterator
+from .custom_types import ResultList,Result
+from .multithreading import imap_unordered
+from .scheduler import item_bytes
+from .lifecycle import until_stopped
+from .transport import Transport,DEFAULT_TRANSPORT
+from .cache import flush_cache
+from .download import parse_content,extract_text,cache_extract,index_from_result,DECODE_SECONDS,EXTRACT_SECONDS
+from .metrics import METRICS,Gauge
+from .autotune import ConcurrencyGate
+
+
+QUEUE_FACTOR = 4 # records in a stage or waiting for the next one, per worker of the next stage
+PARSE_WORKERS = 2 # gunzip releases the GIL, a couple of threads keep up with many download threads
+DONE = None # end of stream marker
+
+PARSE_QUEUE_DEPTH = METRICS.gauge(
+    'comcrawl_parse_queue_depth', 'Downloaded records being parsed or waiting for a parse thread.',
+)
+EXTRACT_QUEUE_DEPTH = METRICS.gauge(
+    'comcrawl_extract_queue_depth', 'Parsed records being extracted or waiting for an extract worker.',
+)
+WRITE_QUEUE_DEPTH = METRICS.gauge('comcrawl_write_queue_depth', 'Extracts waiting for the cache writer.')
+
+def make_process_pool(workers: int) -> futures.ProcessPoolExecutor:
+    """Creates a process pool and starts its workers right away.
+
+    Workers are forked when available, so scripts without a `__main__` guard (like run.py) are not
+    re-executed in every worker. Forking a process while other threads hold locks is unsafe, so
+    callers create the pool before starting any thread of their own, e.g. `IndexClient.populate_results`
+    creates it before its metrics exporter and autotuner and passes it down as `extract_pool`.
+    Cache writer threads left from earlier writes are stopped first, they restart on the next write.
+
+    """
+    flush_cache(forget=True)
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    pool = futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+    pool.submit(int).result() # forks every worker at once
+    return pool
+
+class StageQueue:
+    """Queue between two stages holding at most `size` records, counting the ones still being worked on.
+
+    The producing stage reserves a slot before it starts on a record, the consuming stage frees it
+    when it takes the record, so a slow stage blocks the stages feeding it instead of piling up records.
+
+    """
+
+    def __init__(self, size: int, depth: Gauge = None) -> None:
+        self.size = max(size, 1)
+        self.depth = depth
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._items = queue.SimpleQueue()
+
+    def reserve(self) -> None:
+        self._slots.acquire()
+        if self.depth:
+            self.depth.inc()
+
+    def put(self, item: tuple) -> None:
+        """Queues an item for a slot reserved before."""
+        self._items.put(item)
+
+    def get(self) -> tuple:
+        item = self._items.get()
+        if item is not DONE:
+            if self.depth:
+                self.depth.dec()
+            self._slots.release()
+        return item
+
+    def close(self) -> None:
+        """Queues the end of stream marker, once every reserved slot was filled and taken."""
+        for _ in range(self.size):
+            self._slots.acquire()
+        self._items.put(DONE)
+
+def _resolve(item: tuple) -> tuple:
+    """Unwraps a (result, payload or finished future, completed) item, failed work gives an empty payload."""
+    result, payload, completed = item
+    if isinstance(payload, futures.Future):
+        try:
+            payload = payload.result()
+        except Exception as e: # e.g. BrokenProcessPool once a worker died
+            print(f"Error processing {result}: {e}")
+            return result, '', False # passed on as failed, not completed
+    return result, payload, completed
+
+def run_stage(
+    func: Callable,
+    executor: futures.Executor,
+    in_queue: StageQueue,
+    out_queue: StageQueue,
+    gate: ConcurrencyGate = None,
+) -> None:
+    """Feeds (result, payload, completed) items to `func(result, payload)` on `executor` until the end of stream.
+
+    Empty payloads (failed downloads, records without html) skip the work and are passed on as they are.
+    If `gate` is set, at most its limit of items are worked on at once, however large the executor.
+
+    """
+    def done(result: Result, future: futures.Future, completed: bool) -> None:
+        out_queue.put((result, future, completed))
+        if gate:
+            gate.release()
+
+    finished = False
+    try:
+        while True:
+            item = in_queue.get()
+            if item is DONE:
+                finished = True
+                break
+            result, payload, completed = _resolve(item)
+            out_queue.reserve()
+            if len(payload) == 0:
+                out_queue.put((result, payload, completed))
+                continue
+            acquired = False
+            try:
+                if gate:
+                    gate.acquire()
+                    acquired = True
+                future = executor.submit(func, result, payload)
+            except Exception as e: # e.g. BrokenProcessPool once a worker died
+                print(f"Error processing {result}: {e}")
+                if acquired:
+                    gate.release()
+                out_queue.put((result, '', False)) # failed, not completed
+                continue
+            future.add_done_callback(lambda future, result=result, completed=completed: done(result, future, completed))
+    finally:
+        while not finished: # never leave the stage before stuck on a full queue
+            finished = in_queue.get() is DONE
+        out_queue.close() # the end of stream always reaches the next stage
+
+# stage functions, module level so the process pool can pickle them
+def parse_stage(result: Result, zipped_content: bytes) -> str:
+    with DECODE_SECONDS.time():
+        return parse_content(zipped_content, index_from_result(result))
+
+def extract_stage(result: Result, html: str) -> tuple:
+    """Extracted text and the seconds it took, metrics of worker processes do not reach the parent."""
+    start_time = time.perf_counter()
+    return extract_text(html), time.perf_counter() - start_time
+
+def iter_extracts_pipelined(
+    items: Iterable,
+    load: Callable,
+    basepath: str,
+    should_save: bool = False,
+    threads: int = None,
+    transport: Transport = None,
+    extract_workers: int = None,
+    queue_size: int = None,
+    max_bytes_in_flight: int = None,
+    parse_workers: int = None,
+    extract_gate: ConcurrencyGate = None,
+    extract_pool: futures.ProcessPoolExecutor = None,
+) -> Iterator[Result]:
+    """Downloads, parses, extracts and caches records in separate stages, yielding results as they are cached.
+
+    Args:
+        items: units of work for `load`, i.e. search results, spans or groups of spans
+        load: function turning an item into a list of (result, gzipped record) pairs, e.g. `load_single_records`
+        basepath: where to cache results
+        should_save: whether to cache the raw gzipped records
+        threads: number of download threads
+        transport: pooled transport to download with, its pool is sized to `threads`
+        extract_workers: number of extraction processes, defaults to the cpu count
+        queue_size: maximum number of raw records being parsed or waiting for it, downloads block once it is full
+        max_bytes_in_flight: maximum number of bytes being downloaded at once, by the known length of the items
+        parse_workers: number of threads gunzipping and decoding raw records
+        extract_gate: if set, the process pool gets `extract_gate.max_limit` workers,
+            of which only `extract_gate.limit` are used at a time, e.g. to let the autotuner change it
+        extract_pool: process pool to extract with, see `make_process_pool`, created (and shut down) here if None
+
+    Yields:
+        Processed results, input order might not be preserved.
+
+    """
+    transport = transport or DEFAULT_TRANSPORT
+    extract_workers = extract_gate.max_limit if extract_gate else extract_workers or os.cpu_count()
+    parse_workers = parse_workers or PARSE_WORKERS
+    raw_queue = StageQueue(queue_size or parse_workers * QUEUE_FACTOR, PARSE_QUEUE_DEPTH) # raw records
+    html_queue = StageQueue(extract_workers * QUEUE_FACTOR, EXTRACT_QUEUE_DEPTH) # decoded html
+    text_queue = StageQueue(extract_workers * QUEUE_FACTOR, WRITE_QUEUE_DEPTH) # extracted text
+    out_queue = queue.Queue(maxsize=extract_workers * QUEUE_FACTOR) # cached results waiting to be consumed
+
+    # stage 1: download, blocks while the raw queue is full
+    def fetch(item, *args) -> None:
+        for result, zipped_content in load(item, *args):
+            raw_queue.reserve()
+            # failed downloads are '', not completed
+            raw_queue.put((result, bytes(zipped_content), True) if len(zipped_content) else (result, b'', False))
+
+    def download() -> None:
+        items_left = until_stopped(items) # on SIGTERM/SIGINT stop downloading, the stages behind drain
+        try:
+            if threads:
+                # multi-thread
+                transport.resize(threads) # one keep-alive session per thread
+                args = (basepath, should_save, transport)
+                for _ in imap_unordered(fetch, items_left, threads, args, item_bytes, max_bytes_in_flight):
+                    pass
+            else:
+                # single-thread
+                for item in items_left:
+                    fetch(item, basepath, should_save, transport)
+        except Exception as e:
+            print(f"Error downloading: {e}")
+        finally:
+            raw_queue.close()
+
+    # stage 2: parse, stage 3: extract
+    def parse() -> None:
+        run_stage(parse_stage, parse_pool, raw_queue, html_queue)
+
+    def extract() -> None:
+        run_stage(extract_stage, extract_pool, html_queue, text_queue, extract_gate)
+
+    # stage 4: cache extracts
+    def write() -> None:
+        try:
+            while True:
+                item = text_queue.get()
+                if item is DONE:
+                    break
+                result, extracted_content, completed = _resolve(item)
+                if isinstance(extracted_content, tuple):
+                    extracted_content, seconds = extracted_content
+                    EXTRACT_SECONDS.observe(seconds)
+                try:
+                    out_queue.put(cache_extract(result, extracted_content, basepath, completed))
+                except Exception as e:
+                    print(f"Error processing {result}: {e}")
+        finally:
+            out_queue.put(DONE) # the consumer always gets the end of stream
+
+    # the process pool is forked before the stage threads are started, or was by the caller before any of its threads
+    pool = nullcontext(extract_pool) if extract_pool else make_process_pool(extract_workers)
+    with pool as extract_pool, futures.ThreadPoolExecutor(parse_workers) as parse_pool:
+        stages = [threading.Thread(target=stage, daemon=True) for stage in (download, parse, extract, write)]
+        for stage in stages:
+            stage.start()
+
+        while True:
+            result = out_queue.get()
+            if result is DONE:
+                break
+            yield result
+
+        for stage in stages:
+            stage.join()
+
+def get_multiple_extracts_pipelined(
+    items: list,
+    load: Callable,
+    basepath: str,
+    should_save: bool = False,
+    threads: int = None,
+    transport: Transport = None,
+    extract_workers: int = None,
+    queue_size: int = None,
+    max_bytes_in_flight: int = None,
+    parse_workers: int = None,
+    extract_gate: ConcurrencyGate = None,
+    extract_pool: futures.ProcessPoolExecutor = None,
+) -> ResultList:
+    """Downloads, parses, extracts and caches records in separate stages.
+
+    See `iter_extracts_pipelined` for the arguments.
+
+    Returns:
+        List of all processed results, input order might not be preserved.
+
+    """
+    return list(iter_extracts_pipelined(
+        items, load, basepath, should_save, threads, transport, extract_workers, queue_size, max_bytes_in_flight,
+        parse_workers, extract_gate, extract_pool,
+    ))
@@ -0,0 +1,105 @@
+"""Range Planner.
+
+This module contains helpers to coalesce record range reads that hit the same WARC file.
+
+"""
+
+from dataclasses import dataclass, field
+from .custom_types import Result, ResultList
+
+
+MAX_GAP = 16 * 1024 # bytes of unused data we are willing to download between two records
+MAX_SPAN_BYTES = 8 * 1024 * 1024 # upper bound on a single coalesced read
+MAX_RANGES = 16 # upper bound on ranges sent in one multi-range request
+
+@dataclass
+class Member:
+    """A record inside a span, located relative to the start of the span."""
+    result: Result
+    offset: int
+    length: int
+
+@dataclass
+class Span:
+    """A contiguous byte range of a WARC file covering one or more records."""
+    filename: str
+    start: int
+    end: int # inclusive
+    members: list = field(default_factory=list)
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+    def slices(self, buffer: bytes) -> list:
+        """Cuts the downloaded span into per-record gzip members without copying.
+
+        Returns:
+            List of (result, memoryview) pairs.
+
+        """
+        view = memoryview(buffer)
+        return [(m.result, view[m.offset:m.offset + m.length]) for m in self.members]
+
+def plan_spans(results: ResultList, max_gap: int = MAX_GAP, max_span_bytes: int = MAX_SPAN_BYTES) -> list:
+    """Groups results by WARC file and merges nearby records into single range reads.
+
+    Args:
+        results: list of Common Crawl search results
+        max_gap: maximum number of unused bytes between two records of one span
+        max_span_bytes: maximum size of one span, a single larger record still gets its own span
+
+    Returns:
+        List of spans, each to be downloaded with one GET.
+
+    """
+    # group by warc file
+    by_filename: dict = {}
+    for result in results:
+        by_filename.setdefault(result['filename'], []).append(result)
+
+    # merge ranges within each file
+    spans: list = []
+    for filename, file_results in by_filename.items():
+        file_results.sort(key=lambda r: int(r['offset']))
+        span = None
+        for result in file_results:
+            start = int(result['offset'])
+            end = start + int(result['length']) - 1
+            if span is not None and start - span.end - 1 <= max_gap and max(end, span.end) - span.start + 1 <= max_span_bytes:
+                span.end = max(end, span.end) # extend current span
+            else:
+                span = Span(filename, start, end) # start new span
+                spans.append(span)
+            span.members.append(Member(result, start - span.start, end - start + 1))
+
+    return spans
+
+def group_spans(spans: list, max_ranges: int = MAX_RANGES, max_group_bytes: int = MAX_SPAN_BYTES) -> list:
+    """Batches spans of the same WARC file that are too far apart to coalesce into multi-range requests.
+
+    Args:
+        spans: spans as planned by `plan_spans`
+        max_ranges: maximum number of spans per request
+        max_group_bytes: maximum number of bytes per request
+
+    Returns:
+        List of span lists, each to be downloaded with one multi-range GET.
+
+    """
+    groups: list = []
+    current: dict = {} # filename -> group being filled
+    for span in spans:
+        group = current.get(span.filename)
+        if group is None or len(group) >= max_ranges or sum(s.length for s in group) + span.length > max_group_bytes:
+            group = current[span.filename] = []
+            groups.append(group)
+        group.append(span)
+    return groups
+
+def summarize_spans(spans: list) -> dict:
+    """Request and byte counts of a plan, for logging."""
+    records = sum(len(span.members) for span in spans)
+    requested = sum(span.length for span in spans)
+    useful = sum(m.length for span in spans for m in span.members)
+    return {'records': records, 'requests': len(spans), 'bytes': requested, 'wasted_bytes': requested - useful}
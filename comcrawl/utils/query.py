@@ -0,0 +1,235 @@
+"""Query Helpers.
+
+This module contains queries over the extract caches of one or several indexes, filtered by domain,
+digest, url prefix and content length. Parquet row groups whose statistics rule out a match are
+skipped, and only the columns needed for the filters and the output are read.
+
+"""
+
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from .custom_types import Index,IndexList
+from .cache import (
+    flush_cache,list_parquet_files,indexdir_to_jsonl,iter_jsonl_batches,READ_BATCH_ROWS,
+    CACHE_SCHEMA,LEGACY_COLUMNS,DIGEST_SIZE,digest_key,is_legacy,upgrade_batch,
+)
+from .download import index_cache_path
+
+
+MAX_CHAR = '\U0010ffff' # sorts after every character, closes a prefix range
+
+@dataclass(frozen=True)
+class Condition:
+    """Values of `column` a row has to fall within, bounds included, None for unbounded."""
+    column: str
+    low: object = None
+    high: object = None
+
+@dataclass(frozen=True)
+class CacheQuery:
+    """Filters on cached extracts, None for no filter.
+
+    Attributes:
+        domain: SURT host the extract is cached under, e.g. 'com,hk01'.
+        digest: Content digest, e.g. 'SUCE2T6S4QQ2APMQ7EBM5ITYOWPV2UH3'.
+        url_prefix: Start of the url, only caches with a url column can match.
+        min_length: Least characters of content.
+        max_length: Most characters of content.
+
+    """
+    domain: str = None
+    digest: str = None
+    url_prefix: str = None
+    min_length: int = None
+    max_length: int = None
+
+    def plan(self, names: list, index: Index, sample_filepath: str = None) -> tuple:
+        """Filters on a file with columns `names`, as row group conditions and a row expression.
+
+        Args:
+            names: columns of the file, typed (see `CACHE_SCHEMA`) or legacy
+            index: index of the file, e.g. '2024-26'
+            sample_filepath: with legacy files, any filepath in the file, tells how paths were stored,
+                e.g. relative to a basepath
+
+        Returns:
+            Conditions, expression (None for every row) and the columns both need,
+            or None if the file cannot match, e.g. `url_prefix` on a file without urls.
+
+        """
+        conditions, expressions, needed = [], [], set()
+
+        # domain and digest
+        if 'digest' in names:
+            if self.domain is not None:
+                needed.add('domain')
+                conditions.append(Condition('domain', self.domain, self.domain))
+                expressions.append(pc.field('domain') == self.domain)
+            if self.digest is not None:
+                key = digest_key(self.digest)
+                needed.add('digest')
+                conditions.append(Condition('digest', key, key))
+                expressions.append(pc.field('digest') == pa.scalar(key, pa.binary(DIGEST_SIZE)))
+
+        # legacy files, out of the filepath: {basepath}/extracts/{index}/{domain}/{digest}.txt
+        elif self.domain is not None or self.digest is not None:
+            needed.add('filepath')
+            filepath = pc.field('filepath')
+            marker = f'extracts/{index}/'
+            position = (sample_filepath or '').find(marker)
+            if position >= 0 and self.domain is not None:
+                prefix = f'{sample_filepath[:position + len(marker)]}{self.domain}/'
+                if self.digest is not None:
+                    conditions.append(Condition('filepath', f'{prefix}{self.digest}.txt', f'{prefix}{self.digest}.txt'))
+                    expressions.append(filepath == f'{prefix}{self.digest}.txt')
+                else:
+                    conditions.append(Condition('filepath', prefix, prefix + MAX_CHAR))
+                    expressions.append(pc.starts_with(filepath, prefix))
+            else:
+                if self.domain is not None:
+                    expressions.append(pc.match_substring(filepath, f'/{self.domain}/'))
+                if self.digest is not None:
+                    expressions.append(pc.ends_with(filepath, f'/{self.digest}.txt'))
+
+        # url
+        if self.url_prefix is not None:
+            if 'url' not in names:
+                return None
+            needed.add('url')
+            conditions.append(Condition('url', self.url_prefix, self.url_prefix + MAX_CHAR))
+            expressions.append(pc.starts_with(pc.field('url'), self.url_prefix))
+
+        # content length
+        if self.min_length is not None or self.max_length is not None:
+            if 'length' in names:
+                needed.add('length')
+                length = pc.field('length')
+                conditions.append(Condition('length', self.min_length, self.max_length))
+            else:
+                needed.add('content')
+                length = pc.utf8_length(pc.field('content'))
+            if self.min_length is not None:
+                expressions.append(length >= self.min_length)
+            if self.max_length is not None:
+                expressions.append(length <= self.max_length)
+
+        # combine
+        expression = None
+        for e in expressions:
+            expression = e if expression is None else expression & e
+        return conditions, expression, needed
+
+def row_group_matches(row_group: pq.RowGroupMetaData, names: list, conditions: list) -> bool:
+    """Whether the statistics of a row group leave room for a row within `conditions`."""
+    for condition in conditions:
+        statistics = row_group.column(names.index(condition.column)).statistics
+        if statistics is None or not statistics.has_min_max:
+            continue
+        if condition.low is not None and statistics.max < condition.low:
+            return False
+        if condition.high is not None and statistics.min > condition.high:
+            return False
+    return True
+
+def filter_table(table: pa.Table, expression, columns: list, batch_size: int) -> Iterator[pa.RecordBatch]:
+    if expression is not None:
+        table = table.filter(expression)
+    yield from table.select(columns).to_batches(batch_size)
+
+def sample_filepath(pf: pq.ParquetFile) -> str:
+    # any filepath of a parquet file, out of its statistics if possible
+    if 'filepath' not in pf.schema_arrow.names or pf.metadata.num_row_groups == 0:
+        return None
+    statistics = pf.metadata.row_group(0).column(pf.schema_arrow.names.index('filepath')).statistics
+    if statistics is not None and statistics.has_min_max:
+        return statistics.min
+    column = pf.read_row_group(0, columns=['filepath']).column(0)
+    return column[0].as_py() if len(column) else None
+
+def query_parquet(fp: str, index: Index, query: CacheQuery, columns: list, batch_size: int) -> Iterator[pa.RecordBatch]:
+    pf = pq.ParquetFile(fp)
+    names = pf.schema_arrow.names
+    legacy = is_legacy(pf.schema_arrow)
+    plan = query.plan(names, index, sample_filepath(pf) if legacy and query.domain is not None else None)
+    if plan is None:
+        print(f'[query_cache] {fp} skipped, it cannot match')
+        return
+    conditions, expression, needed = plan
+    output = [column for column in (columns or CACHE_SCHEMA.names) if column in CACHE_SCHEMA.names]
+    read, total = 0, pf.metadata.num_row_groups
+    for i in range(total):
+        if not row_group_matches(pf.metadata.row_group(i), names, conditions):
+            continue
+        read += 1
+        if legacy: # filtered, then converted to the typed schema
+            table = pf.read_row_group(i, columns=LEGACY_COLUMNS)
+            table = table.filter(expression) if expression is not None else table
+            table = pa.Table.from_batches([upgrade_batch(batch) for batch in table.to_batches()], schema=CACHE_SCHEMA)
+            yield from filter_table(table, None, output, batch_size)
+        else:
+            table = pf.read_row_group(i, columns=sorted(needed | set(output), key=names.index))
+            yield from filter_table(table, expression, output, batch_size)
+    print(f'[query_cache][read parquet] {fp} row groups = {read} / {total}')
+
+def query_jsonl(
+    jsonl_fp: Path, index: Index, query: CacheQuery, columns: list, batch_size: int,
+) -> Iterator[pa.RecordBatch]:
+    plan = query.plan(CACHE_SCHEMA.names, index)
+    if plan is None:
+        return
+    _, expression, _ = plan
+    for batch in iter_jsonl_batches(jsonl_fp, batch_size=batch_size):
+        yield from filter_table(pa.Table.from_batches([batch]), expression, columns or CACHE_SCHEMA.names, batch_size)
+
+def query_cache(
+    basepath: str,
+    indexes: IndexList,
+    domain: str = None,
+    digest: str = None,
+    url_prefix: str = None,
+    min_length: int = None,
+    max_length: int = None,
+    columns: list = None,
+    batch_size: int = READ_BATCH_ROWS,
+    as_dicts: bool = False,
+) -> Iterator:
+    """Streams the cached extracts of `indexes` that match every filter given.
+
+    Args:
+        basepath: where the caches are, e.g. 'data/'
+        indexes: indexes to query, e.g. ['2024-22', '2024-26'], or a single one
+        domain: SURT host the extract is cached under, e.g. 'com,hk01'
+        digest: content digest
+        url_prefix: start of the url, only caches with a url column can match
+        min_length: least characters of content
+        max_length: most characters of content
+        columns: columns to return, all of them if None
+        batch_size: most records per batch
+        as_dicts: whether to yield lists of dictionaries instead of pyarrow record batches
+
+    Yields:
+        Matching records, parquet files first then the jsonl of every index, in the order of `indexes`.
+
+    """
+    query = CacheQuery(domain, digest, url_prefix, min_length, max_length)
+    indexes = [indexes] if isinstance(indexes, str) else indexes
+    for index in indexes:
+        indexdir = index_cache_path(index, basepath)
+        flush_cache(indexdir) # queued records
+        sources = [(fp, query_parquet) for fp in list_parquet_files(indexdir)]
+        jsonl_fp = indexdir_to_jsonl(indexdir, indexdir.name)
+        if os.path.exists(jsonl_fp):
+            sources.append((jsonl_fp, query_jsonl))
+        for fp, query_file in sources:
+            try:
+                for batch in query_file(fp, index, query, columns, batch_size):
+                    if batch.num_rows:
+                        yield batch.to_pylist() if as_dicts else batch
+
+            except Exception as e:
+                print(f'[query_cache] exception {e}')
@@ -0,0 +1,173 @@
+"""Rate Limiting Helpers.
+
+This module contains token buckets capping requests/s and bytes/s per host, optionally shared
+through a file so several jobs on one box stay under one global budget.
+
+"""
+
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlparse
+from .metrics import METRICS
+
+try:
+    import fcntl # posix only, needed for budgets shared across processes
+except ImportError:
+    fcntl = None
+
+
+DATA_HOST = 'data.commoncrawl.org'
+INDEX_HOST = 'index.commoncrawl.org'
+ANY_HOST = '*' # fallback for hosts without their own limit
+BURST_SECONDS = 1.0 # default bucket capacity, in seconds worth of rate
+STATE = struct.Struct('dd') # tokens, timestamp
+
+WAIT_SECONDS = METRICS.counter('comcrawl_rate_limit_wait_seconds_total', 'Seconds spent waiting for rate limit tokens.')
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `capacity` tokens.
+
+    Taking tokens may drive the bucket into debt, e.g. when the size of a response is only known
+    once it arrived. Whoever reserves next waits until the debt is paid back.
+
+    Attributes:
+        rate: Tokens added per second.
+        capacity: Maximum number of tokens, i.e. the largest burst.
+
+    """
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate * BURST_SECONDS
+        self._tokens = self.capacity
+        self._timestamp = time.time()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens: float, timestamp: float, amount: float) -> tuple:
+        """Refills, takes `amount` and returns the new state and how long the caller has to wait."""
+        now = time.time()
+        tokens = min(self.capacity, tokens + (now - timestamp) * self.rate) - amount
+        wait = max(0.0, -tokens / self.rate)
+        return tokens, now, wait
+
+    def reserve(self, amount: float = 1) -> float:
+        """Takes `amount` tokens and returns the number of seconds to wait before using them."""
+        with self._lock:
+            self._tokens, self._timestamp, wait = self._take(self._tokens, self._timestamp, amount)
+        return wait
+
+    def charge(self, amount: float) -> None:
+        """Takes `amount` tokens after the fact, without waiting."""
+        self.reserve(amount)
+
+    def acquire(self, amount: float = 1) -> float:
+        """Takes `amount` tokens, blocking until they are available. Returns the time waited."""
+        wait = self.reserve(amount)
+        if wait > 0:
+            WAIT_SECONDS.inc(wait)
+            time.sleep(wait)
+        return wait
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket whose state lives in a file, so every process using the same file shares one budget.
+
+    Every process should be configured with the same rate, the file only holds the tokens left
+    and when they were last counted.
+
+    """
+
+    def __init__(self, path: str, rate: float, capacity: float = None) -> None:
+        if fcntl is None:
+            raise RuntimeError('budgets shared across processes need fcntl, which is not available on this platform')
+        super().__init__(rate, capacity)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def reserve(self, amount: float = 1) -> float:
+        with self._lock, open(self.path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX) # released when the file is closed
+            f.seek(0)
+            data = f.read(STATE.size)
+            tokens, timestamp = STATE.unpack(data) if len(data) == STATE.size else (self.capacity, time.time())
+            tokens, timestamp, wait = self._take(tokens, timestamp, amount)
+            f.seek(0)
+            f.truncate()
+            f.write(STATE.pack(tokens, timestamp))
+            f.flush()
+        return wait
+
+@dataclass
+class HostLimit:
+    """Budget of one host, None meaning unlimited."""
+    requests_per_s: float = None
+    bytes_per_s: float = None
+
+class RateLimiter:
+    """Per-host request and bandwidth budgets.
+
+    Attributes:
+        limits: Mapping of host (e.g. 'data.commoncrawl.org', or '*' for every other host) to its `HostLimit`.
+        shared_dir: If set, budgets are kept in files in this directory and shared by every process using it.
+
+    """
+
+    def __init__(self, limits: dict = None, shared_dir: str = None) -> None:
+        self.limits = limits or {}
+        self.shared_dir = shared_dir
+        self._buckets: dict = {} # (host, kind) -> bucket
+        self._lock = threading.Lock()
+
+    def _bucket(self, host: str, kind: str) -> TokenBucket:
+        limit = self.limits.get(host) or self.limits.get(ANY_HOST)
+        rate = getattr(limit, f'{kind}_per_s', None) if limit else None
+        if not rate:
+            return None
+        with self._lock:
+            bucket = self._buckets.get((host, kind))
+            if bucket is None:
+                if self.shared_dir:
+                    bucket = SharedTokenBucket(os.path.join(self.shared_dir, f'{host}.{kind}.bucket'), rate)
+                else:
+                    bucket = TokenBucket(rate)
+                self._buckets[(host, kind)] = bucket
+            return bucket
+
+    def reserve(self, url: str, expected_bytes: int = 0) -> float:
+        """Takes one request and `expected_bytes` from the budget of the host of `url`.
+
+        Returns:
+            Number of seconds to wait before sending the request.
+
+        """
+        host = urlparse(url).netloc
+        wait = 0.0
+        requests_bucket = self._bucket(host, 'requests')
+        if requests_bucket:
+            wait = max(wait, requests_bucket.reserve(1))
+        bytes_bucket = self._bucket(host, 'bytes')
+        if bytes_bucket:
+            wait = max(wait, bytes_bucket.reserve(expected_bytes))
+        if wait > 0:
+            WAIT_SECONDS.inc(wait)
+        return wait
+
+    def acquire(self, url: str, expected_bytes: int = 0) -> None:
+        """Like `reserve`, but blocks for the wait."""
+        wait = self.reserve(url, expected_bytes)
+        if wait > 0:
+            time.sleep(wait)
+
+    def limits_bytes(self, url: str) -> bool:
+        """Whether the host of `url` has a bytes/s budget, i.e. whether received bytes need counting."""
+        limit = self.limits.get(urlparse(url).netloc) or self.limits.get(ANY_HOST)
+        return bool(limit and limit.bytes_per_s)
+
+    def charge(self, url: str, nbytes: int) -> None:
+        """Takes bytes received beyond what was expected, later requests to the host wait for them."""
+        bytes_bucket = self._bucket(urlparse(url).netloc, 'bytes')
+        if bytes_bucket and nbytes > 0:
+            bytes_bucket.charge(nbytes)
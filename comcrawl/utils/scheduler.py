@@ -0,0 +1,43 @@
+"""Scheduling Helpers.
+
+This module contains helpers to order downloads by their known size, so a cap on in-flight bytes
+keeps the link busy with a mix of large and small records instead of all large or all small ones.
+
+"""
+
+from itertools import islice
+from typing import Iterable,Iterator
+from .planner import Span
+
+
+MAX_BYTES_IN_FLIGHT = 64 * 1024 * 1024 # 64MB
+INTERLEAVE_WINDOW = 1024 # items sorted by size at a time
+
+def item_bytes(item) -> int:
+    """Number of bytes a unit of work downloads: a search result, a span or a group of spans."""
+    if isinstance(item, Span):
+        return item.length
+    if isinstance(item, list):
+        return sum(map(item_bytes, item))
+    return int(item['length'])
+
+def interleave_by_length(items: Iterable, window: int = INTERLEAVE_WINDOW) -> Iterator:
+    """Yields items alternating between the largest and the smallest ones left, `window` items at a time.
+
+    A cap on in-flight bytes then pairs every large record with small ones that fit next to it,
+    rather than e.g. launching every multi-MB record at once when results are sorted largest first.
+    Only `window` items are held at once, so a lazy stream of results stays lazy.
+
+    """
+    items = iter(items)
+    while True:
+        ordered = sorted(islice(items, window), key=item_bytes)
+        if not ordered:
+            return
+        small, large = 0, len(ordered) - 1
+        while small <= large:
+            yield ordered[large]
+            large -= 1
+            if small <= large:
+                yield ordered[small]
+                small += 1
@@ -8,15 +8,12 @@ This module contains helper functions for searching through Common Crawl Indexes
 
 import json
 from pathlib import Path
-import requests
 from requests.exceptions import ReadTimeout,RequestException
 from urllib.parse import quote
 from .custom_types import ResultList,IndexList
 from .cache import read_jsonl,write_jsonl
 from .multithreading import make_multithreaded
-
-from fake_useragent import UserAgent
-ua = UserAgent()
+from .transport import Transport,DEFAULT_TRANSPORT
 
 
 TIMEOUT_DURATION = 60
@@ -30,12 +27,13 @@ search_cache_path(url='*.hk01.com', index='2024-26').exists()
 '''
 
 # given index and url, request with cc index api
-def request_single_index(url: str, index: str) -> ResultList:
+def request_single_index(url: str, index: str, transport: Transport = None) -> ResultList:
     """Searches specific Common Crawl Index for given URL pattern.
 
     Args:
         index: Common Crawl Index to search.
         url: URL Pattern to search.
+        transport: pooled transport to request with (retries, rate limits), defaults to the shared transport.
 
     Returns:
         List of results dictionaries found in specified Index for the URL.
@@ -52,17 +50,17 @@ def request_single_index(url: str, index: str) -> ResultList:
     '''
     # do request
     results: ResultList = [] # default = no results
+    transport = transport or DEFAULT_TRANSPORT
     try:
         # build
         request_url = URL_TEMPLATE.format(index=index, url=url) # https://index.commoncrawl.org/CC-MAIN-2018-13-index?url=*.hk01.com/&output=json
 
         # do
         #print(f'[request_single_index] request_url = {request_url}')
-        response = requests.get(
+        response = transport.get(
             request_url,
             timeout=TIMEOUT_DURATION,
             headers={
-                "User-Agent": ua.random, # user_agent
                 #"Accept-Encoding": "*",
                 #"Connection": "keep-alive"
             }
@@ -87,20 +85,20 @@ request_single_index('*.hk.news.yahoo.com','2024-26')
 '''
 
 # given index and url, get index
-def get_single_index(url: str, index: str, basepath: str, should_save: bool = False) -> ResultList:
+def get_single_index(url: str, index: str, basepath: str, should_save: bool = False, transport: Transport = None) -> ResultList:
     cache_path = search_cache_path(url, index, basepath)
     if cache_path.exists():
         print(f'[get_single_index][cache] {cache_path}')
         results: ResultList = read_jsonl(cache_path)
     else:
-        results: ResultList = request_single_index(url, index)
+        results: ResultList = request_single_index(url, index, transport)
         if should_save:
             write_jsonl(results, cache_path)
 
     # return
     return results
 
-def get_multiple_indexes(url: str, indexes: IndexList, basepath: str, should_save: bool = False, threads: int = None) -> ResultList:
+def get_multiple_indexes(url: str, indexes: IndexList, basepath: str, should_save: bool = False, threads: int = None, transport: Transport = None) -> ResultList:
     """Searches multiple Common Crawl Indexes for URL pattern.
 
     Args:
@@ -108,6 +106,7 @@ def get_multiple_indexes(url: str, indexes: IndexList, basepath: str, should_sav
         indexes: list of Common Crawl indexes to search
         threads: number of threads to use
         basepath: where to cache results
+        transport: pooled transport to request with, its pool is sized to `threads`
 
     Returns:
         List of all results found throughout the specified Common Crawl indexes.
@@ -115,14 +114,16 @@ def get_multiple_indexes(url: str, indexes: IndexList, basepath: str, should_sav
     """
     # populate results
     out: ResultList = [] # default = no results
+    transport = transport or DEFAULT_TRANSPORT
     if threads:
         # multi-thread
-        multithreaded_search = make_multithreaded(get_single_index, threads)
-        out = multithreaded_search(indexes, url, basepath, should_save)
+        transport.resize(threads) # one keep-alive session per thread
+        multithreaded_search = make_multithreaded(lambda index, *args: get_single_index(url, index, *args), threads)
+        out = multithreaded_search(indexes, basepath, should_save, transport)
     else:
         # single-thread
         for index in indexes:
-            res:ResultList = get_single_index(index, url, basepath, should_save)
+            res:ResultList = get_single_index(url, index, basepath, should_save, transport)
             out.extend(res) # extend with multiple results
 
     # return
@@ -0,0 +1,122 @@
+"""Sharding Helpers.
+
+This module contains helpers to deterministically split one crawl across several machines,
+each writing its extracts into its own shard of the cache, and to merge the shards afterwards.
+
+"""
+
+import re
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from .custom_types import ResultList,Result
+from .cache import iter_cache,write_cache,flush_cache,indexdir_to_empties,cache_record
+
+
+SHARD_KEYS = ('digest', 'filename') # filename keeps every record of a WARC file on one machine, e.g. for coalescing
+SHARD_PATTERN = re.compile(r'^shard-(\d+)-of-(\d+)$')
+MERGED_SUFFIX = '.merged'
+
+@dataclass(frozen=True)
+class Shard:
+    """One of `count` deterministic partitions of the search results, numbered from 0.
+
+    Attributes:
+        index: Which partition, 0 <= index < count.
+        count: Number of partitions.
+        key: Search result field hashed to pick the partition, 'digest' or 'filename'.
+
+    """
+    index: int
+    count: int
+    key: str = 'digest'
+
+    def __post_init__(self) -> None:
+        if not 0 <= self.index < self.count:
+            raise ValueError(f'shard index {self.index} out of range for {self.count} shards')
+        if self.key not in SHARD_KEYS:
+            raise ValueError(f'unknown shard key {self.key}, expected one of {SHARD_KEYS}')
+
+    @classmethod
+    def parse(cls, spec: str, key: str = 'digest') -> 'Shard':
+        """Parses e.g. '3/8' into the fourth of eight shards."""
+        try:
+            index, count = map(int, spec.split('/'))
+        except ValueError as e:
+            raise ValueError(f'invalid shard {spec}, expected e.g. 3/8') from e
+        return cls(index, count, key)
+
+    @property
+    def dirname(self) -> str:
+        return f'shard-{self.index}-of-{self.count}'
+
+    def contains(self, result: Result) -> bool:
+        return shard_of(result, self.count, self.key) == self.index
+
+def shard_of(result: Result, count: int, key: str = 'digest') -> int:
+    """Partition of a search result, the same on every machine and python process (unlike `hash`)."""
+    return zlib.crc32(str(result[key]).encode('utf-8')) % count
+
+def select_shard(results: ResultList, shard: Shard) -> ResultList:
+    """Search results belonging to `shard`."""
+    return [result for result in results if shard.contains(result)]
+
+# shard each cache location (basepath) writes to, set by IndexClient
+SHARDS: dict = {}
+
+def register_shard(basepath: str, shard: Shard) -> None:
+    """Makes extracts cached under `basepath` go to the `shard` subdirectory of their index, None to undo."""
+    if shard is None:
+        SHARDS.pop(str(basepath), None)
+    else:
+        SHARDS[str(basepath)] = shard
+
+def shard_for(basepath: str) -> Shard:
+    return SHARDS.get(str(basepath))
+
+def shard_dirs(indexdir: str) -> list[Path]:
+    """Shard subdirectories of an index cache that were not merged yet."""
+    indexdir = Path(indexdir)
+    if not indexdir.exists():
+        return []
+    return sorted(path for path in indexdir.iterdir() if path.is_dir() and SHARD_PATTERN.match(path.name))
+
+def merge_shards(indexdir: str, max_json_lines: int = 10000) -> int:
+    """Merges the shard caches of an index into the index cache itself.
+
+    Every merged shard directory is renamed with a '.merged' suffix, so merging again only picks up
+    new shards, and can be deleted once the merged cache was checked.
+
+    Args:
+        indexdir: index cache, e.g. basepath/extracts/2024-26
+        max_json_lines: size of the jsonl before it is rolled over into a parquet file
+
+    Returns:
+        Number of records merged.
+
+    """
+    indexdir = Path(indexdir)
+    merged = 0
+    for shard_dir in shard_dirs(indexdir):
+        # records with content, streamed
+        records = 0
+        for listdict in iter_cache(shard_dir, as_dicts=True):
+            write_cache(listdict, indexdir, max_json_lines)
+            records += len(listdict)
+        merged += records
+
+        # records without content
+        empties_fp = indexdir_to_empties(shard_dir, shard_dir.name)
+        if empties_fp.exists():
+            empties = [
+                cache_record({'filepath': fp, 'content': ''})
+                for fp in empties_fp.read_text(encoding='utf-8').splitlines()
+            ]
+            write_cache(empties, indexdir, max_json_lines)
+
+        flush_cache(shard_dir, forget=True) # moved below
+        shard_dir.rename(shard_dir.with_name(shard_dir.name + MERGED_SUFFIX))
+        print(f'[merge_shards] {shard_dir} records = {records}')
+
+    # return
+    return merged
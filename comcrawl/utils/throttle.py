@@ -0,0 +1,144 @@
+"""Throttling Helpers.
+
+This module contains retry backoff and an adaptive (AIMD) limit on the number of in-flight requests,
+which backs off when Common Crawl answers 503 SlowDown / 429 or times out and recovers with latency.
+
+"""
+
+import asyncio
+import random
+import threading
+import time
+from .metrics import METRICS
+
+
+THROTTLE_STATUSES = (429, 503) # too many requests, slow down
+RETRY_STATUSES = THROTTLE_STATUSES + (500, 502, 504)
+RETRIES = 3
+BACKOFF_BASE = 0.5 # seconds
+BACKOFF_CAP = 30 # seconds
+
+CONCURRENCY = METRICS.gauge('comcrawl_concurrency_limit', 'Current limit on in-flight requests.')
+IN_FLIGHT = METRICS.gauge('comcrawl_requests_in_flight', 'Requests currently in flight.')
+RETRY_COUNT = METRICS.counter('comcrawl_retries_total', 'Requests retried after a throttle, error or timeout.')
+THROTTLE_COUNT = METRICS.counter('comcrawl_throttle_events_total', 'Responses with 429/503 or timeouts.')
+FAILURE_COUNT = METRICS.counter('comcrawl_failures_total', 'Requests that failed after all retries.')
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Exponential backoff with full jitter, i.e. uniform in [0, min(cap, base * 2 ** attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class AdaptiveLimiter:
+    """AIMD limit on in-flight requests, used as a context manager around each request.
+
+    The limit shrinks multiplicatively on throttle events (at most once per `cooldown`, so one burst
+    of 503s only counts once) and grows additively, by about one per `limit` successful requests,
+    as long as the smoothed latency stays within `latency_tolerance` of the best latency seen.
+
+    Attributes:
+        limit: Current number of requests allowed in flight.
+        min_limit: Lower bound of the limit.
+        max_limit: Upper bound of the limit, usually the number of worker threads.
+        cap: Further upper bound set from outside, e.g. by the autotuner, None for none.
+
+    """
+
+    def __init__(self,
+        max_limit: int,
+        min_limit: int = 1,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        cooldown: float = 1.0,
+    ) -> None:
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self._in_flight = 0
+        self._latency = None # smoothed latency
+        self._baseline = None # best smoothed latency seen
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+        self.cap: int = None
+        CONCURRENCY.set(self.allowed)
+
+    @property
+    def allowed(self) -> int:
+        """Number of requests currently allowed in flight."""
+        return max(self.min_limit, min(int(self.limit), self.cap or self.max_limit))
+
+    def set_cap(self, cap: int) -> None:
+        """Caps the limit without restarting the controller, None to lift the cap."""
+        with self._cond:
+            self.cap = cap
+            self._changed()
+
+    def resize(self, max_limit: int) -> None:
+        """Restarts the controller from a new upper bound, e.g. the number of threads of a new run."""
+        with self._cond:
+            self.max_limit = max_limit
+            self.limit = float(max_limit)
+            self._changed()
+
+    def on_success(self, latency: float) -> None:
+        """Additive increase while latency is healthy."""
+        with self._cond:
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            self._baseline = self._latency if self._baseline is None else min(self._baseline, self._latency)
+            if self.limit < self.max_limit and self._latency <= self._baseline * self.latency_tolerance:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._changed()
+
+    def on_throttle(self) -> None:
+        """Multiplicative decrease on 429/503/timeouts."""
+        THROTTLE_COUNT.inc()
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self._changed()
+
+    def _changed(self) -> None:
+        CONCURRENCY.set(self.allowed)
+        self._cond.notify_all()
+
+    def __enter__(self) -> 'AdaptiveLimiter':
+        with self._cond:
+            while self._in_flight >= self.allowed:
+                self._cond.wait()
+            self._in_flight += 1
+        IN_FLIGHT.inc()
+        return self
+
+    def __exit__(self, *args) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+        IN_FLIGHT.dec()
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """Same controller as `AdaptiveLimiter`, gating coroutines on one event loop instead of threads."""
+
+    def __init__(self, max_limit: int, **kwargs) -> None:
+        super().__init__(max_limit, **kwargs)
+        self._released = asyncio.Event()
+
+    def _changed(self) -> None:
+        super()._changed()
+        self._released.set()
+
+    async def __aenter__(self) -> 'AsyncAdaptiveLimiter':
+        while self._in_flight >= self.allowed:
+            self._released.clear()
+            await self._released.wait()
+        self._in_flight += 1
+        IN_FLIGHT.inc()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self._in_flight -= 1
+        self._released.set()
+        IN_FLIGHT.dec()
@@ -0,0 +1,193 @@
+"""Transport Helpers.
+
+This module contains the connection-pooled HTTP transport used to talk to Common Crawl.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import Timeout,ConnectionError as RequestsConnectionError
+from .throttle import (
+    AdaptiveLimiter,backoff_delay,
+    THROTTLE_STATUSES,RETRY_STATUSES,RETRIES,BACKOFF_BASE,BACKOFF_CAP,
+    RETRY_COUNT,FAILURE_COUNT,
+)
+from .ratelimit import RateLimiter
+from .byteranges import range_bytes
+from .lifecycle import LIFECYCLE
+
+from fake_useragent import UserAgent
+ua = UserAgent()
+
+
+TIMEOUT_DURATION = 5
+DATA_URL_TEMPLATE = "https://data.commoncrawl.org/{filename}"
+POOL_SIZE = 10
+
+class Transport:
+    """Connection-pooled HTTP transport.
+
+    Every worker thread gets its own keep-alive `requests.Session`, so consecutive range reads
+    from one thread reuse the same TCP+TLS connection instead of doing a new handshake per record.
+    The number of live sessions is capped by `pool_size`, which `get_multiple_extracts` ties to
+    its `threads` argument.
+
+    Requests answered with 429/5xx or failing with a timeout or connection error are retried with
+    exponential backoff and jitter, and an AIMD limiter shrinks the number of in-flight requests
+    while the server throttles us. An optional `RateLimiter` caps requests/s and bytes/s per host,
+    possibly shared with other processes, before requests are even sent. Nothing is retried once
+    a shutdown was requested, so draining the requests in flight stays within its deadline.
+
+    Attributes:
+        pool_size: Maximum number of pooled sessions (one per worker thread).
+        timeout: Timeout in seconds for every request.
+        data_url_template: Template used to build record urls, point it to a local server for tests.
+        retries: Number of retries after the first attempt.
+        backoff_base: Backoff of the first retry in seconds, doubled on every further retry.
+        backoff_cap: Upper bound on the backoff in seconds.
+        limiter: Adaptive limit on in-flight requests.
+        rate_limiter: Per-host budgets of requests/s and bytes/s, unlimited if None.
+
+    """
+
+    def __init__(self,
+        pool_size: int = POOL_SIZE,
+        timeout: float = TIMEOUT_DURATION,
+        data_url_template: str = DATA_URL_TEMPLATE,
+        retries: int = RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_cap: float = BACKOFF_CAP,
+        rate_limiter: RateLimiter = None,
+    ) -> None:
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.data_url_template = data_url_template
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.limiter = AdaptiveLimiter(pool_size)
+        self.rate_limiter = rate_limiter
+        self._local = threading.local()
+        self._sessions: OrderedDict = OrderedDict() # thread ident -> session, oldest first
+        self._lock = threading.Lock()
+        self._multirange: dict = {} # host -> whether it answers multi-range requests
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=1) # one thread only ever holds one connection per host
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session(self) -> requests.Session:
+        """Returns the keep-alive session of the calling thread, creating it on first use.
+
+        Sessions are only ever closed by the thread owning them: one evicted from the pool is closed
+        and replaced on the next call of its thread, never while another thread may be mid-request.
+
+        """
+        session = getattr(self._local, 'session', None)
+        ident = threading.get_ident()
+        if session is not None:
+            with self._lock:
+                evicted = self._sessions.get(ident) is not session
+            if not evicted:
+                return session
+            session.close() # evicted while this thread was away, its requests are done
+        session = self._new_session()
+        self._local.session = session
+        with self._lock:
+            self._sessions[ident] = session
+            self._evict()
+        return session
+
+    def _evict(self) -> None:
+        # drop the sessions of threads that are most likely gone (e.g. from a previous executor), oldest first,
+        # their connections are released with the thread or closed by the thread on its next request
+        while len(self._sessions) > self.pool_size:
+            self._sessions.popitem(last=False)
+
+    def resize(self, pool_size: int) -> None:
+        """Ties the number of pooled sessions to the number of worker threads."""
+        if pool_size and pool_size > 0:
+            with self._lock:
+                self.pool_size = pool_size
+                self._evict()
+            self.limiter.resize(pool_size)
+
+    def get(self, url: str, headers: dict = None, **kwargs) -> requests.Response:
+        """Performs a GET request over the pooled session of the calling thread.
+
+        Retries throttled, failed and timed out requests with backoff. After the last retry the final
+        response is returned as is (so callers can `raise_for_status`), or the last exception raised.
+
+        """
+        headers = {"User-Agent": ua.random, **(headers or {})}
+        kwargs.setdefault('timeout', self.timeout)
+        expected_bytes = range_bytes(headers.get('Range', ''))
+        for attempt in range(self.retries + 1):
+            error, response = None, None
+            if self.rate_limiter:
+                self.rate_limiter.acquire(url, expected_bytes) # wait for the budget before taking an in-flight slot
+            with self.limiter:
+                start_time = time.monotonic()
+                try:
+                    response = self.session().get(url, headers=headers, **kwargs)
+                except (Timeout, RequestsConnectionError) as e:
+                    error = e
+                latency = time.monotonic() - start_time
+
+            # done
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                self.limiter.on_success(latency)
+                if not kwargs.get('stream'): # streamed bodies are charged by the caller once read
+                    self.charge(url, response, expected_bytes) # e.g. index pages
+                return response
+
+            # throttled or failed
+            if error is not None or response.status_code in THROTTLE_STATUSES:
+                self.limiter.on_throttle()
+            if attempt == self.retries or LIFECYCLE.stopping: # no retries while shutting down
+                FAILURE_COUNT.inc()
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close() # hand the connection back before sleeping
+            RETRY_COUNT.inc()
+            time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+
+    def charge(self, url: str, response: requests.Response, expected_bytes: int = 0) -> None:
+        """Charges the bytes of a read body beyond `expected_bytes` to the host of `url`, if it has a bytes/s budget."""
+        if self.rate_limiter and self.rate_limiter.limits_bytes(url):
+            self.rate_limiter.charge(url, len(response.content) - expected_bytes)
+
+    def data_url(self, filename: str) -> str:
+        """Builds the url of a WARC file."""
+        return self.data_url_template.format(filename=filename)
+
+    def supports_multirange(self, url: str) -> bool:
+        """Whether the host of `url` is still believed to answer multi-range requests."""
+        return self._multirange.get(urlparse(url).netloc, True)
+
+    def disable_multirange(self, url: str) -> None:
+        """Remembers that the host of `url` only answers single ranges, e.g. S3."""
+        host = urlparse(url).netloc
+        if self._multirange.get(host, True):
+            print(f'[Transport] {host} does not answer multi-range requests, falling back to single ranges')
+        self._multirange[host] = False
+
+    def close(self) -> None:
+        """Closes all pooled sessions, once no request is in flight anymore."""
+        with self._lock:
+            while self._sessions:
+                _, session = self._sessions.popitem(last=False)
+                session.close()
+        self._local = threading.local()
+
+# shared transport for module level helpers called without an explicit transport
+DEFAULT_TRANSPORT = Transport()
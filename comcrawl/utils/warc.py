@@ -0,0 +1,152 @@
+"""WARC Helpers.
+
+This module contains a byte-level parser for WARC records and the HTTP responses they wrap.
+
+"""
+
+import codecs
+from dataclasses import dataclass, field
+from typing import Iterator
+from .cache import gunzip
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+CRLF = b'\r\n'
+HEADER_END = b'\r\n\r\n'
+
+# per-crawl format quirks
+# CC-MAIN-2018-34: extra \r\n between HTTP header and payload, and WARC Content-Length off by 2 bytes
+EXTRA_CRLF_CRAWLS = {'2018-34'}
+
+class WarcFormatError(ValueError):
+    """Raised when a record does not look like a WARC record."""
+
+@dataclass
+class WarcRecord:
+    """A parsed WARC record, header names are lower case and the payload points into the record buffer."""
+    warc_headers: dict = field(default_factory=dict)
+    http_status: int = None
+    http_headers: dict = field(default_factory=dict)
+    payload: memoryview = memoryview(b'')
+
+    @property
+    def warc_type(self) -> str:
+        return self.warc_headers.get('warc-type', '')
+
+    @property
+    def charset(self) -> str:
+        """Charset declared in the HTTP Content-Type, if it is one python knows."""
+        for param in self.http_headers.get('content-type', '').split(';')[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'charset':
+                try:
+                    return codecs.lookup(value.strip('"\' ')).name
+                except LookupError:
+                    return None
+        return None
+
+    def text(self, default_encoding: str = 'utf-8') -> str:
+        """Decodes the payload with its declared charset, straight from the view without copying to bytes first."""
+        return str(self.payload, self.charset or default_encoding, errors='ignore')
+
+def parse_headers(block: memoryview) -> tuple:
+    """Parses a header block into its first line and a dict of lower cased header names."""
+    lines = bytes(block).decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+def dechunk(payload: memoryview) -> memoryview:
+    """Undoes HTTP chunked transfer encoding, returns the payload untouched if it is not validly chunked."""
+    raw = bytes(payload) # chunk sizes have to be searched for, this is the rare path
+    chunks = []
+    position = 0
+    while True:
+        line_end = raw.find(CRLF, position)
+        if line_end == -1:
+            return payload
+        try:
+            size = int(raw[position:line_end].split(b';')[0], 16)
+        except ValueError:
+            return payload
+        if size == 0:
+            return memoryview(b''.join(chunks))
+        chunk_start = line_end + 2
+        chunks.append(raw[chunk_start:chunk_start + size])
+        position = chunk_start + size + 2
+
+def iter_warc_records(content: bytes, crawl: str = None) -> Iterator[WarcRecord]:
+    """Walks through uncompressed WARC records one by one, using Content-Length to jump between them.
+
+    Args:
+        content: uncompressed bytes holding one or more WARC records.
+        crawl: crawl the records come from, e.g. '2018-34', to apply its format quirks.
+
+    Yields:
+        Parsed records, their payloads are views into `content`.
+
+    """
+    view = memoryview(content)
+    position = 0
+    while position < len(content):
+        # skip record separators
+        while content.startswith(CRLF, position):
+            position += 2
+        if position >= len(content):
+            return
+        if not content.startswith(b'WARC/', position):
+            raise WarcFormatError(f'expected WARC version line at byte {position}')
+
+        # warc header
+        warc_header_end = content.find(HEADER_END, position)
+        if warc_header_end == -1:
+            raise WarcFormatError('truncated WARC header')
+        _, warc_headers = parse_headers(view[position:warc_header_end])
+        try:
+            content_length = int(warc_headers['content-length'])
+        except (KeyError, ValueError) as e:
+            raise WarcFormatError(f'invalid WARC Content-Length: {e}') from e
+        block_start = warc_header_end + 4
+        block_end = min(block_start + content_length, len(content)) # tolerate lengths that are off, e.g. 2018-34
+        record = WarcRecord(warc_headers=warc_headers, payload=view[block_start:block_end])
+
+        # http header
+        if record.warc_type in ('response', 'revisit') and content.startswith(b'HTTP/', block_start):
+            http_header_end = content.find(HEADER_END, block_start, block_end)
+            if http_header_end == -1:
+                raise WarcFormatError('truncated HTTP header')
+            status_line, record.http_headers = parse_headers(view[block_start:http_header_end])
+            try:
+                record.http_status = int(status_line.split(' ')[1])
+            except (IndexError, ValueError):
+                record.http_status = None
+
+            payload_start = http_header_end + 4
+            if crawl in EXTRA_CRLF_CRAWLS and content.startswith(CRLF, payload_start):
+                payload_start += 2
+                block_end = min(block_end + 2, len(content)) # Content-Length does not count the extra \r\n
+            record.payload = view[payload_start:block_end]
+            if 'chunked' in record.http_headers.get('transfer-encoding', '').lower():
+                record.payload = dechunk(record.payload)
+
+        yield record
+        position = block_end
+
+def parse_warc_record(data: bytes, crawl: str = None) -> WarcRecord:
+    """Parses a single, possibly gzipped, WARC record.
+
+    Args:
+        data: bytes or memoryview of one record, e.g. a range read from a WARC file.
+        crawl: crawl the record comes from, e.g. '2018-34', to apply its format quirks.
+
+    Returns:
+        The parsed record, its payload is a view into the uncompressed record.
+
+    """
+    content = gunzip(data) if bytes(data[:2]) == GZIP_MAGIC else bytes(data)
+    for record in iter_warc_records(content, crawl):
+        return record
+    raise WarcFormatError('no WARC record found')
@@ -1,6 +1,7 @@
 #%%
 import argparse
 from comcrawl.core import IndexClient
+from comcrawl.utils import Transport,RateLimiter,HostLimit,DATA_HOST,INDEX_HOST,LIFECYCLE
 import sys
 
 ################# SETTINGS
@@ -18,7 +19,31 @@ if not is_jupyter:
 	parser = argparse.ArgumentParser(description='cc-cached-downloader')
 	parser.add_argument('--outdir', help='where to save output', type=str, default='/home/alfred/nfs/cc')
 	parser.add_argument('--index', help='cc index identifier', type=str, default='2018-43')
-	parser.add_argument('--threads', help='number of threads', type=int, default=None)
+	parser.add_argument('--threads', help='number of threads (records in flight with --engine async)', type=int, default=None)
+	parser.add_argument('--engine', help='download engine', type=str, choices=['thread','async'], default='thread')
+	parser.add_argument('--coalesce', help='merge nearby records of a warc file into single range reads', action='store_true')
+	parser.add_argument('--max_gap', help='max unused bytes between coalesced records', type=int, default=16 * 1024)
+	parser.add_argument('--max_ranges', help='max ranges per multi-range request for sparse records', type=int, default=None)
+	parser.add_argument('--extract_workers', help='number of processes extracting content (threads with --engine async)', type=int, default=None)
+	parser.add_argument('--parse_workers', help='number of threads decoding records for the extract workers', type=int, default=None)
+	parser.add_argument('--max_bytes_in_flight', help='cap on bytes of records downloading at once, interleaves large and small records', type=int, default=None)
+	parser.add_argument('--autotune', help='tune download concurrency (from --threads) and extract workers in use while running', action='store_true')
+	parser.add_argument('--max_threads', help='with --autotune, max download concurrency', type=int, default=None)
+	parser.add_argument('--max_rss_mb', help='with --autotune, memory limit in MB', type=float, default=None)
+	parser.add_argument('--requests_per_s', help='max requests/s to data.commoncrawl.org', type=float, default=None)
+	parser.add_argument('--bytes_per_s', help='max bytes/s from data.commoncrawl.org', type=float, default=None)
+	parser.add_argument('--index_requests_per_s', help='max requests/s to index.commoncrawl.org', type=float, default=None)
+	parser.add_argument('--rate_limit_dir', help='share the above budgets with every job using the same directory', type=str, default=None)
+	parser.add_argument('--shard', help='only download this share of the results, e.g. 3/8 (numbered from 0)', type=str, default=None)
+	parser.add_argument('--shard_key', help='result field hashed to pick the shard', type=str, choices=['digest','filename'], default='digest')
+	parser.add_argument('--merge_shards', help='merge the extracts of every shard of --index and exit', action='store_true')
+	parser.add_argument('--migrate_cache', help='convert the cache of --index to the typed schema and exit', action='store_true')
+	parser.add_argument('--migrate_workers', help='processes converting parquet files, defaults to the number of cpus', type=int, default=None)
+	parser.add_argument('--shutdown_deadline', help='seconds downloads in flight get to finish after SIGTERM/SIGINT', type=float, default=30.0)
+	parser.add_argument('--metrics_dir', help='keep a prometheus textfile of metrics here, plus a json summary at the end', type=str, default=None)
+	parser.add_argument('--metrics_interval', help='seconds between prometheus textfile writes', type=float, default=15.0)
+	parser.add_argument('--dedup', help='skip results whose content digest another crawl under --outdir already extracted, ref also records a reference row', type=str, choices=['skip','ref'], default=None)
+	parser.add_argument('--no_resume', help='download results again even if the resume manifest lists them as completed', action='store_true')
 	parser.add_argument('--min_length', help='min record size', type=int, default=None)
 	parser.add_argument('--max_length', help='max record size', type=int, default=None)
 	args = parser.parse_args()
@@ -27,6 +52,30 @@ if not is_jupyter:
 	OUTPUT_DIR = args.outdir
 	INDEX = args.index
 	THREADS = args.threads
+	ENGINE = args.engine
+	COALESCE = args.coalesce
+	MAX_GAP = args.max_gap
+	MAX_RANGES = args.max_ranges
+	EXTRACT_WORKERS = args.extract_workers
+	PARSE_WORKERS = args.parse_workers
+	MAX_BYTES_IN_FLIGHT = args.max_bytes_in_flight
+	AUTOTUNE = args.autotune
+	MAX_THREADS = args.max_threads
+	MAX_RSS_MB = args.max_rss_mb
+	REQUESTS_PER_S = args.requests_per_s
+	BYTES_PER_S = args.bytes_per_s
+	INDEX_REQUESTS_PER_S = args.index_requests_per_s
+	RATE_LIMIT_DIR = args.rate_limit_dir
+	SHARD = args.shard
+	SHARD_KEY = args.shard_key
+	MERGE_SHARDS = args.merge_shards
+	MIGRATE_CACHE = args.migrate_cache
+	MIGRATE_WORKERS = args.migrate_workers
+	RESUME = not args.no_resume
+	DEDUP = args.dedup
+	SHUTDOWN_DEADLINE = args.shutdown_deadline
+	METRICS_DIR = args.metrics_dir
+	METRICS_INTERVAL = args.metrics_interval
 	MIN_LENGTH = args.min_length
 	MAX_LENGTH = args.max_length
 else:
@@ -34,12 +83,48 @@ else:
 	OUTPUT_DIR = '/home/alfred/nfs/cc_zho' #OUTPUT_DIR = '/home/alfred/nfs/cc_zho_hk'
 	INDEX = '2024-10' #INDEX = '2018-43'
 	THREADS = 50
+	ENGINE = 'thread'
+	COALESCE = False
+	MAX_GAP = 16 * 1024
+	MAX_RANGES = None
+	EXTRACT_WORKERS = None
+	PARSE_WORKERS = None
+	MAX_BYTES_IN_FLIGHT = None
+	AUTOTUNE = False
+	MAX_THREADS = None
+	MAX_RSS_MB = None
+	REQUESTS_PER_S = None
+	BYTES_PER_S = None
+	INDEX_REQUESTS_PER_S = None
+	RATE_LIMIT_DIR = None
+	SHARD = None
+	SHARD_KEY = 'digest'
+	MERGE_SHARDS = False
+	MIGRATE_CACHE = False
+	MIGRATE_WORKERS = None
+	RESUME = True
+	DEDUP = None
+	SHUTDOWN_DEADLINE = 30.0
+	METRICS_DIR = None
+	METRICS_INTERVAL = 15.0
 	MIN_LENGTH = None
 	MAX_LENGTH = None
 
 ################# POPULATE RESULTS WITH ATHENA CSVS
 print('[run] read athena csvs')
-ic = IndexClient(outdir = OUTPUT_DIR)
+rate_limiter = None # unlimited unless a limit is set
+if REQUESTS_PER_S or BYTES_PER_S or INDEX_REQUESTS_PER_S:
+	rate_limiter = RateLimiter({
+		DATA_HOST: HostLimit(requests_per_s=REQUESTS_PER_S, bytes_per_s=BYTES_PER_S),
+		INDEX_HOST: HostLimit(requests_per_s=INDEX_REQUESTS_PER_S),
+	}, shared_dir=RATE_LIMIT_DIR)
+ic = IndexClient(outdir = OUTPUT_DIR, transport = Transport(rate_limiter = rate_limiter), shard = SHARD, shard_key = SHARD_KEY, shutdown_deadline = SHUTDOWN_DEADLINE, metrics_dir = METRICS_DIR, metrics_interval = METRICS_INTERVAL)
+if MERGE_SHARDS:
+	print(f'[run] merged records = {ic.merge_shards(INDEX)}')
+	sys.exit(0)
+if MIGRATE_CACHE:
+	print(f'[run] migrated records = {ic.migrate_cache(INDEX, MIGRATE_WORKERS)}')
+	sys.exit(0)
 ic.init_results_with_athena_query_csvs(index=INDEX, min_length=MIN_LENGTH, max_length=MAX_LENGTH)
 #len(ic.results)
 
@@ -71,7 +156,9 @@ ic._save_single_record(ic.results[101])
 #%%
 ################# DOWNLOAD
 print('[run] populate results')
-ic.populate_results(threads=THREADS) # single or multithreaded
+ic.populate_results(threads=THREADS, engine=ENGINE, coalesce=COALESCE, max_gap=MAX_GAP, max_ranges=MAX_RANGES, extract_workers=EXTRACT_WORKERS, max_bytes_in_flight=MAX_BYTES_IN_FLIGHT, resume=RESUME, parse_workers=PARSE_WORKERS, autotune=AUTOTUNE, max_threads=MAX_THREADS, max_rss_mb=MAX_RSS_MB, dedup=DEDUP) # single or multithreaded, or asyncio
+if ic.stopped:
+	sys.exit(LIFECYCLE.exit_code) # preempted, rerun to resume
 '''
 # inspect results
 [x['content'] for x in ic.results]
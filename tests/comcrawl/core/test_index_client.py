@@ -1,4 +1,9 @@
+import os
+import signal
+import threading
 from comcrawl.core import IndexClient
+from comcrawl.utils import Transport,LIFECYCLE
+from benchmarks.standin import StandinServer,make_pages,make_warc_file
 
 
 def test_index_client():
@@ -10,3 +15,34 @@ def test_index_client():
 
     client = IndexClient()
     assert len(client.indexes) > 2
+
+
+def test_iter_extracts(standin, tmp_path):
+    client = IndexClient(outdir=tmp_path, transport=Transport(data_url_template=standin.url_template))
+    client.results = standin.results
+
+    stream = client.iter_extracts(threads=2, coalesce=True)
+
+    assert len(list(stream)) == len(standin.results)
+    assert client.results == standin.results # nothing collected
+
+
+def test_populate_results_stops_on_sigterm(tmp_path):
+    filename = 'crawl-data/CC-MAIN-2024-26/segments/1/warc/CC-MAIN-20240614075213-20240614105213-00661.warc.gz'
+    content, results = make_warc_file(filename, make_pages(10))
+    with StandinServer({filename: content}, latency=0.1) as server:
+        client = IndexClient(outdir=tmp_path, transport=Transport(data_url_template=server.url_template))
+        client.results = results
+        threading.Timer(0.25, os.kill, (os.getpid(), signal.SIGTERM)).start()
+        try:
+            client.populate_results()
+            assert client.stopped
+            assert 0 < len(client.results) < len(results)
+
+            client.results = results
+            client.populate_results() # resumes
+            assert not client.stopped
+            assert len(client.results) == len(results)
+            assert len(server.latencies) == len(results) # nothing downloaded twice
+        finally:
+            LIFECYCLE.reset()
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from comcrawl.core import IndexClient
+from comcrawl.utils.autotune import Autotuner,ConcurrencyGate,Knob
+from comcrawl.utils.transport import Transport
+
+
+def make_knob(value: int, high: int = 64) -> Knob:
+    state = {'value': value}
+    return Knob('threads', lambda: state['value'], lambda value: state.update(value=value), 1, high)
+
+
+def test_gate_can_be_resized_while_running():
+    gate = ConcurrencyGate(1, 4)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work():
+        with gate:
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.02)
+    gate.resize(3)
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 3
+    gate.resize(10)
+    assert gate.limit == 4 # capped by the pool behind it
+
+
+def test_hill_climbs_towards_peak_throughput():
+    knob = make_knob(4)
+    tuner = Autotuner([knob])
+    throughput = lambda value: 100 - (value - 20) ** 2 / 4 # best at 20
+
+    for _ in range(30):
+        tuner.step(throughput(knob.get()))
+
+    assert 15 <= tuner.best['threads'] <= 25
+    assert 10 <= knob.get() <= 30 # keeps probing around the peak, in case it moves
+
+
+def test_backs_off_over_error_rate():
+    knob = make_knob(40)
+    tuner = Autotuner([knob], max_error_rate=0.05)
+
+    tuner.step(100, error_rate=0.2)
+
+    assert knob.get() == 30
+
+
+def test_populate_results_autotunes(standin, tmp_path):
+    client = IndexClient(outdir=tmp_path, transport=Transport(data_url_template=standin.url_template))
+    client.results = standin.results
+
+    client.populate_results(threads=2, autotune=True, max_threads=4)
+
+    assert len(client.results) == len(standin.results)
+    logged = json.loads((tmp_path / 'autotune.jsonl').read_text().splitlines()[-1])
+    assert 1 <= logged['threads'] <= 4
+    assert client.transport.limiter.cap is None # untuned afterwards
+
+
+def test_populate_results_forks_before_autotuning(standin, tmp_path, monkeypatch):
+    from comcrawl.core import index_client
+    threads_at_fork = []
+    make_process_pool = index_client.make_process_pool
+    def recording_pool(workers):
+        pool = make_process_pool(workers)
+        threads_at_fork.extend(thread.name for thread in threading.enumerate()) # the autotuner is not running yet
+        return pool
+    monkeypatch.setattr(index_client, 'make_process_pool', recording_pool)
+    client = IndexClient(outdir=tmp_path, transport=Transport(data_url_template=standin.url_template))
+    client.results = standin.results[:5]
+    client.populate_results(threads=2, resume=False) # leaves a cache writer behind
+
+    client.results = standin.results
+    client.populate_results(threads=2, autotune=True, max_threads=4, extract_workers=1, resume=False)
+
+    assert threads_at_fork and 'Autotuner' not in threads_at_fork
+    assert not [name for name in threads_at_fork if name.startswith('CacheWriter')] # stopped before forking
+    assert len(client.results) == len(standin.results)
@@ -0,0 +1,79 @@
+import pytest
+from comcrawl.utils.byteranges import format_ranges, iter_byteranges, slice_parts
+from comcrawl.utils.transport import Transport
+from comcrawl.utils.download import request_range, request_ranges, get_multiple_extracts
+from comcrawl.utils.cache import read_cache
+
+CONTENT_TYPE = 'multipart/byteranges; boundary="THIS_STRING_SEPARATES"'
+BODY = (
+    b'\r\n--THIS_STRING_SEPARATES\r\n'
+    b'Content-Type: application/octet-stream\r\n'
+    b'Content-Range: bytes 0-9/100\r\n\r\n'
+    b'--THIS_STR' # payload containing the boundary prefix
+    b'\r\n--THIS_STRING_SEPARATES\r\n'
+    b'Content-Range: bytes 50-54/100\r\n\r\n'
+    b'abcde'
+    b'\r\n--THIS_STRING_SEPARATES--\r\n'
+)
+
+
+def test_format_ranges():
+    assert format_ranges([(0, 10), (50, 5)]) == 'bytes=0-9,50-54'
+
+
+def test_iter_byteranges():
+    parts = [(start, end, bytes(view)) for start, end, view in iter_byteranges(BODY, CONTENT_TYPE)]
+
+    assert parts == [(0, 9, b'--THIS_STR'), (50, 54, b'abcde')]
+
+
+def test_iter_byteranges_truncated():
+    with pytest.raises(ValueError):
+        list(iter_byteranges(BODY[:60], CONTENT_TYPE))
+
+
+def test_slice_parts():
+    parts = list(iter_byteranges(BODY, CONTENT_TYPE))
+
+    sliced = slice_parts(parts, [(51, 2), (2, 3), (20, 5)])
+
+    assert [None if view is None else bytes(view) for view in sliced] == [b'bc', b'THI', None]
+
+
+@pytest.mark.parametrize('range_mode', ['multi', 'single', 'none'])
+def test_request_ranges(standin, range_mode):
+    standin.range_mode = range_mode
+    transport = Transport(data_url_template=standin.url_template)
+    results = standin.results[::3]
+    content = standin.files[results[0]['filename']]
+    ranges = [(int(result['offset']), int(result['length'])) for result in results]
+
+    buffers = request_ranges(results[0]['filename'], ranges, transport)
+
+    if range_mode == 'none': # the whole file is too large to download for these ranges
+        assert buffers == [''] * len(ranges)
+        assert standin.requests == 1 # no range is requested again
+    else:
+        assert [bytes(buffer) for buffer in buffers] == [content[offset:offset + length] for offset, length in ranges]
+    assert transport.supports_multirange(standin.url_template) == (range_mode == 'multi')
+
+
+def test_request_range_ignored(standin):
+    standin.range_mode = 'none'
+    transport = Transport(data_url_template=standin.url_template)
+    filename = standin.results[0]['filename']
+    content = standin.files[filename]
+
+    assert request_range(filename, 0, 100, transport) == '' # not sliced out of the whole file
+    assert request_range(filename, 10, len(content) - 10, transport) == content[10:] # small enough to read
+
+
+def test_get_multiple_extracts_multirange(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+    sparse_results = standin.results[::2] # no two records adjacent
+
+    results = get_multiple_extracts(sparse_results, tmp_path, transport=transport, max_ranges=16)
+
+    assert len(results) == len(sparse_results)
+    assert standin.requests == 1
+    assert len(read_cache(tmp_path / 'extracts/2024-26')) == len(sparse_results)
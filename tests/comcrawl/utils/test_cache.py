@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+from comcrawl.utils import cache
+from comcrawl.utils.cache import (
+    CACHE_SCHEMA,CacheWriter,cache_record,read_cache,iter_cache,write_cache,flush_cache,
+    indexdir_to_jsonl,indexdir_to_empties,list_parquet_files,parquet_tmp_filepath,
+)
+
+
+def rows(start: int, count: int) -> list[dict]:
+    return [
+        {'index': '2024-26', 'domain': 'com,example', 'digest': f'{i:032d}', 'url': f'{i}.txt', 'timestamp': '20240614075213', 'content': f'text {i}'}
+        for i in range(start, start + count)
+    ]
+
+def test_write_cache_writes_in_background(tmp_path):
+    indexdir = tmp_path / '2024-26'
+    write_cache(rows(0, 3) + [{'digest': 'EMPTY', 'domain': 'com,example', 'content': ''}], indexdir, max_json_lines=100)
+    assert flush_cache(indexdir, timeout=5)
+
+    lines = indexdir_to_jsonl(indexdir, indexdir.name).read_text().splitlines()
+    assert [json.loads(line)['url'] for line in lines] == ['0.txt', '1.txt', '2.txt']
+    assert indexdir_to_empties(indexdir, indexdir.name).read_text() == f'{indexdir}/com,example/EMPTY.txt\n'
+    write_cache(rows(3, 1), indexdir, max_json_lines=100)
+    assert len(read_cache(indexdir)) == 4 # reading waits for queued records
+
+def test_write_cache_rolls_over_from_counter(tmp_path, monkeypatch):
+    indexdir = tmp_path / '2024-26'
+    write_cache(rows(0, 4), indexdir, max_json_lines=5)
+    flush_cache(indexdir)
+
+    # lines are counted once, later writes never read the jsonl again
+    def count_lines(fp):
+        raise AssertionError('jsonl counted again')
+    monkeypatch.setattr(cache, 'count_lines', count_lines)
+    write_cache(rows(4, 3), indexdir, max_json_lines=5)
+    flush_cache(indexdir)
+
+    assert len(list_parquet_files(indexdir)) == 1
+    assert indexdir_to_jsonl(indexdir, indexdir.name).read_text() == ''
+    assert cache.WRITERS[os.path.abspath(indexdir)].lines == 0
+    assert sorted(row['url'] for row in read_cache(indexdir)) == sorted(f'{i}.txt' for i in range(7))
+
+def test_write_cache_counts_existing_jsonl_once(tmp_path):
+    indexdir = tmp_path / '2024-26'
+    indexdir.mkdir()
+    with open(indexdir_to_jsonl(indexdir, indexdir.name), 'w') as f:
+        f.writelines(json.dumps(row) + '\n' for row in rows(0, 4))
+        f.write('{"url": "torn') # cut short by a killed process
+    write_cache(rows(4, 1), indexdir, max_json_lines=5)
+    flush_cache(indexdir)
+    assert len(list_parquet_files(indexdir)) == 1
+    assert len(read_cache(indexdir)) == 5
+
+def test_writers_do_not_wait_on_each_other(tmp_path, monkeypatch):
+    slow, fast = tmp_path / '2024-26', tmp_path / '2024-30'
+    unblock = threading.Event()
+    append = cache.CacheWriter._append
+    def blocked_append(self, listdict):
+        if self.indexdir.name == slow.name:
+            unblock.wait(5) # stuck on disk
+        append(self, listdict)
+    monkeypatch.setattr(cache.CacheWriter, '_append', blocked_append)
+
+    write_cache(rows(0, 2), slow)
+    write_cache(rows(0, 2), fast) # handing over does not wait either
+
+    assert flush_cache(fast, timeout=5)
+    assert not flush_cache(slow, timeout=0.2)
+    unblock.set()
+    assert flush_cache(slow, timeout=5)
+    assert len(read_cache(slow)) == 2
+
+def test_writer_appends_row_groups(tmp_path):
+    indexdir = tmp_path / '2024-26'
+    writer = CacheWriter(indexdir, max_json_lines=100, row_group_rows=10)
+    writer.write(rows(0, 25))
+    writer.flush()
+    assert parquet_tmp_filepath(indexdir / '2024-26_0.parquet').exists() # two row groups written, five records journaled
+    assert len(read_cache(indexdir)) == 25 # no record is read twice
+
+    writer.close()
+    assert list_parquet_files(indexdir) == [str(indexdir / '2024-26_0.parquet')]
+    assert pq.ParquetFile(indexdir / '2024-26_0.parquet').metadata.num_row_groups == 3
+    assert indexdir_to_jsonl(indexdir, indexdir.name).read_text() == ''
+
+def test_writer_recovers_from_journal(tmp_path):
+    indexdir = tmp_path / '2024-26'
+    indexdir.mkdir()
+    pq.write_table(pa.Table.from_pylist([cache_record(row) for row in rows(0, 2)], schema=CACHE_SCHEMA), indexdir / '2024-26_0.parquet')
+    (indexdir / '2024-26_1.parquet.tmp').write_bytes(b'PAR1 killed before its footer')
+    with open(indexdir_to_jsonl(indexdir, indexdir.name), 'w') as f:
+        f.writelines(json.dumps(row) + '\n' for row in rows(0, 4)) # killed after renaming 0..1, before truncating
+
+    writer = CacheWriter(indexdir)
+    writer.close()
+    assert list_parquet_files(indexdir) == [str(indexdir / '2024-26_0.parquet'), str(indexdir / '2024-26_1.parquet')]
+    assert sorted(row['url'] for row in read_cache(indexdir)) == [f'{i}.txt' for i in range(4)]
+
+def test_iter_cache_streams_batches(tmp_path):
+    indexdir = tmp_path / '2024-26'
+    writer = CacheWriter(indexdir, max_json_lines=10, row_group_rows=5)
+    writer.write(rows(0, 20)) # a parquet file of four row groups
+    writer.flush()
+    writer.write(rows(20, 3)) # journaled
+    writer.flush()
+
+    batches = list(iter_cache(indexdir, ['url'], batch_size=5))
+    assert [batch.num_rows for batch in batches] == [5, 5, 5, 5, 3]
+    assert all(batch.schema.names == ['url'] for batch in batches)
+    chunks = list(iter_cache(indexdir, as_dicts=True))
+    assert [row['content'] for chunk in chunks for row in chunk] == [f'text {i}' for i in range(23)]
+    assert read_cache(indexdir, 'url') == [f'{i}.txt' for i in range(23)]
+    writer.close()
+
+def test_cache_is_typed(tmp_path):
+    indexdir = tmp_path / '2024-26'
+    writer = CacheWriter(indexdir)
+    writer.write(rows(0, 3))
+    writer.flush()
+
+    batches = list(iter_cache(indexdir)) # journaled
+    assert all(batch.schema == CACHE_SCHEMA for batch in batches)
+    row = batches[0].to_pylist()[2]
+    assert row['digest'] == cache_record(rows(2, 1)[0])['digest'] and len(row['digest']) == 20
+    assert (row['length'], row['timestamp'].year) == (len('text 2'), 2024)
+    writer.close()
+    assert pq.ParquetFile(indexdir / '2024-26_0.parquet').schema_arrow == CACHE_SCHEMA
+    assert read_cache(indexdir)[2] == row
+
+def test_legacy_cache_is_read_typed(tmp_path):
+    indexdir = tmp_path / 'extracts' / '2024-26'
+    indexdir.mkdir(parents=True)
+    legacy = [{'filepath': str(indexdir / 'com,example' / f'{"A" * 32}.txt'), 'content': 'text'}]
+    pq.write_table(pa.Table.from_pylist(legacy), indexdir / '2024-26_0.parquet')
+
+    row = read_cache(indexdir)[0]
+    assert (row['index'], row['domain'], row['length']) == ('2024-26', 'com,example', 4)
+    assert row['digest'] == b'\x00' * 20 # 'AAAA...' in base32
@@ -0,0 +1,53 @@
+import json
+from comcrawl.core import IndexClient
+from comcrawl.utils.digests import DigestIndex,load_digest_index,filter_duplicates,REFS_SUFFIX
+from comcrawl.utils.manifest import Manifest,get_manifest
+from comcrawl.utils.transport import Transport
+
+
+def result(crawl: str, digest: str) -> dict:
+    return {
+        'urlkey': 'com,example)/', 'url': 'https://example.com/', 'digest': digest, 'offset': 0, 'length': 10,
+        'filename': f'crawl-data/CC-MAIN-{crawl}/segments/1/warc/CC-MAIN-1-00000.warc.gz',
+    }
+
+def mark_done(tmp_path, crawl: str, digests: list) -> None:
+    manifest = Manifest(tmp_path / 'extracts' / crawl)
+    for digest in digests:
+        manifest.add(digest)
+    manifest.flush()
+
+def test_digest_index_updates_incrementally(tmp_path):
+    mark_done(tmp_path, '2023-50', ['A' * 32, 'B' * 32])
+    index = load_digest_index(tmp_path)
+    assert len(index) == 2
+    assert index.lookup(['A' * 32, 'C' * 32]) == ['2023-50', None]
+
+    mark_done(tmp_path, '2024-10', ['B' * 32, 'C' * 32]) # B keeps the crawl indexed first
+    index = load_digest_index(tmp_path)
+    assert index.update() == 0 # saved up to date
+    assert index.lookup(['B' * 32, 'C' * 32]) == ['2023-50', '2024-10']
+    assert 'C' * 32 in DigestIndex.load(tmp_path / 'extracts')
+
+def test_filter_duplicates(tmp_path):
+    mark_done(tmp_path, '2023-50', ['A' * 32])
+    results = [result('2023-50', 'A' * 32), result('2024-10', 'A' * 32), result('2024-10', 'B' * 32), result('2024-26', 'B' * 32)]
+
+    duplicates, fresh = filter_duplicates(results, load_digest_index(tmp_path))
+
+    assert fresh == [results[0], results[2]] # own crawl left to the resume manifest, first of the run kept
+    assert [(d['digest'], d['duplicate_of']) for d in duplicates] == [('A' * 32, '2023-50'), ('B' * 32, '2024-10')]
+
+def test_populate_results_skips_duplicates(standin, tmp_path):
+    client = IndexClient(outdir=tmp_path, transport=Transport(data_url_template=standin.url_template, retries=0))
+    crawl = standin.results[0]['filename'].split('CC-MAIN-')[1][:7]
+    mark_done(tmp_path, '2019-04', [standin.results[0]['digest']])
+
+    client.results = list(standin.results)
+    client.populate_results(threads=2, dedup='ref')
+
+    assert len(client.results) == len(standin.results)
+    assert standin.requests == len(standin.results) - 1
+    refs_fp = tmp_path / 'extracts' / crawl / f'{crawl}{REFS_SUFFIX}'
+    assert json.loads(refs_fp.read_text())['duplicate_of'] == '2019-04'
+    assert standin.results[0]['digest'] in get_manifest(tmp_path / 'extracts' / crawl)
@@ -0,0 +1,37 @@
+import asyncio
+import aiohttp
+from comcrawl.utils.transport import Transport
+from comcrawl.utils.download_async import get_multiple_extracts_async,request_single_record_async
+from comcrawl.utils.cache import read_cache
+
+
+def test_get_multiple_extracts_async(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+
+    results = get_multiple_extracts_async(standin.results, tmp_path, concurrency=4, transport=transport)
+
+    assert sorted(result['digest'] for result in results) == sorted(result['digest'] for result in standin.results)
+    assert standin.requests == len(standin.results)
+    assert len(read_cache(tmp_path / 'extracts/2024-26')) == len(standin.results)
+
+
+def test_get_multiple_extracts_async_missing_record(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+    missing = {**standin.results[0], 'filename': 'crawl-data/CC-MAIN-2024-26/missing.warc.gz'}
+
+    results = get_multiple_extracts_async([missing], tmp_path, transport=transport)
+
+    assert results == [missing]
+
+
+def test_request_single_record_async_range_ignored(standin):
+    standin.range_mode = 'none' # whole file sent
+    transport = Transport(data_url_template=standin.url_template)
+    content = standin.files[standin.results[0]['filename']]
+    small = {**standin.results[0], 'offset': '10', 'length': str(len(content) - 10)}
+
+    async def request(results):
+        async with aiohttp.ClientSession() as session:
+            return [await request_single_record_async(session, result, transport) for result in results]
+
+    assert asyncio.run(request([standin.results[0], small])) == ['', content[10:]] # too large to read, small enough to slice
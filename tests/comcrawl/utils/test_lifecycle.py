@@ -0,0 +1,81 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from comcrawl.utils.lifecycle import Lifecycle,EXIT_CODE
+from comcrawl.utils.multithreading import imap_unordered
+from comcrawl.utils.cache import write_cache,read_cache,flush_cache
+from comcrawl.utils.manifest import DIGEST_SIZE
+
+
+def test_until_stopped_drains_work_in_flight():
+    lifecycle = Lifecycle()
+    started = []
+
+    def work(item):
+        started.append(item)
+        if item == 3:
+            lifecycle.stop()
+        return item
+
+    done = list(imap_unordered(work, lifecycle.until_stopped(range(100)), 2))
+
+    assert sorted(done) == sorted(started) # everything started was finished
+    assert len(started) < 100
+
+
+def test_handle_signals():
+    lifecycle = Lifecycle()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    with lifecycle.handle_signals(deadline=60):
+        os.kill(os.getpid(), signal.SIGTERM)
+        assert lifecycle.stopping
+
+    assert lifecycle.exit_code == EXIT_CODE + signal.SIGTERM
+    assert signal.getsignal(signal.SIGTERM) is previous
+
+
+def test_deadline_forces_exit_after_flushing(tmp_path):
+    script = f'''
+import os, signal, time
+from comcrawl.utils.lifecycle import LIFECYCLE
+from comcrawl.utils.manifest import get_manifest
+get_manifest({str(tmp_path)!r}).add('A' * 32) # buffered
+with LIFECYCLE.handle_signals(deadline=0.1):
+    os.kill(os.getpid(), signal.SIGTERM)
+    time.sleep(30) # work in flight never finishes
+'''
+    process = subprocess.run([sys.executable, '-c', script], timeout=20)
+
+    assert process.returncode == EXIT_CODE + signal.SIGTERM
+    assert (tmp_path / f'{tmp_path.name}.done').stat().st_size == DIGEST_SIZE
+
+
+def test_forced_exit_does_not_wait_for_stuck_writes(tmp_path):
+    script = f'''
+import os, signal, time
+from comcrawl.utils import cache
+from comcrawl.utils.lifecycle import LIFECYCLE
+cache.CacheWriter._append = lambda self, listdict: time.sleep(60) # disk hangs
+cache.write_cache([{{'digest': 'a', 'content': 'first'}}], {str(tmp_path)!r})
+with LIFECYCLE.handle_signals(deadline=0.5):
+    os.kill(os.getpid(), signal.SIGTERM)
+    time.sleep(60) # work in flight never finishes
+'''
+    start_time = time.monotonic()
+    process = subprocess.run([sys.executable, '-c', script], timeout=30)
+
+    assert process.returncode == EXIT_CODE + signal.SIGTERM
+    assert time.monotonic() - start_time < 10 # deadline plus a short flush, not another full deadline
+
+def test_write_cache_trims_torn_line(tmp_path):
+    write_cache([{'digest': 'a', 'url': 'a', 'content': 'first'}], tmp_path)
+    flush_cache(tmp_path) # on disk before the process is killed
+    with open(tmp_path / f'{tmp_path.name}.jsonl', 'a', encoding='utf-8') as f:
+        f.write('{"digest": "b", "url": "b", "cont') # killed halfway through a write
+
+    write_cache([{'digest': 'c', 'url': 'c', 'content': 'third'}], tmp_path)
+
+    assert read_cache(tmp_path, 'url') == ['a', 'c']
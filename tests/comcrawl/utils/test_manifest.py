@@ -0,0 +1,81 @@
+import threading
+from comcrawl.core import IndexClient
+from comcrawl.utils import manifest as manifest_module
+from comcrawl.utils.manifest import Manifest,digest_key,rebuild_manifest,DIGEST_SIZE
+from comcrawl.utils.cache import write_cache
+from comcrawl.utils.transport import Transport
+
+
+def test_digest_key():
+    assert len(digest_key('SUCE2T6S4QQ2APMQ7EBM5ITYOWPV2UH3')) == DIGEST_SIZE
+    assert digest_key('sha1:SUCE2T6S4QQ2APMQ7EBM5ITYOWPV2UH3') == digest_key('SUCE2T6S4QQ2APMQ7EBM5ITYOWPV2UH3')
+    assert len(digest_key('not-a-sha1')) == DIGEST_SIZE
+
+
+def test_manifest_writes_in_batches(tmp_path):
+    manifest = Manifest(tmp_path, batch_size=2)
+
+    manifest.add('A' * 32)
+    assert not manifest.path.exists()
+    manifest.add('B' * 32)
+    assert manifest.path.stat().st_size == 2 * DIGEST_SIZE
+    manifest.add('C' * 32)
+    manifest.flush()
+
+    assert len(Manifest(tmp_path)) == 3
+    assert 'C' * 32 in Manifest(tmp_path)
+
+
+def test_manifest_lookups_dont_wait_for_the_disk(tmp_path, monkeypatch):
+    writing, release = threading.Event(), threading.Event()
+    def slow_flush_cache():
+        writing.set()
+        release.wait(5)
+    monkeypatch.setattr(manifest_module, 'flush_cache', slow_flush_cache)
+    manifest = Manifest(tmp_path, batch_size=1)
+
+    adding = threading.Thread(target=manifest.add, args=('A' * 32,))
+    adding.start()
+    assert writing.wait(5)
+    found = []
+    lookup = threading.Thread(target=lambda: found.append('A' * 32 in manifest))
+    lookup.start()
+    lookup.join(2)
+    assert found == [True] # while the batch is being written
+    release.set()
+    adding.join()
+
+    assert len(Manifest(tmp_path)) == 1
+
+
+def test_manifest_ignores_torn_write(tmp_path):
+    manifest = Manifest(tmp_path, batch_size=1)
+    manifest.add('A' * 32)
+    with open(manifest.path, 'ab') as f:
+        f.write(digest_key('B' * 32)[:7]) # crash halfway through a write
+
+    assert len(Manifest(tmp_path)) == 1
+
+
+def test_rebuild_manifest(tmp_path):
+    write_cache([
+        {'filepath': str(tmp_path / 'com,example' / f'{"A" * 32}.txt'), 'content': 'text'},
+        {'filepath': str(tmp_path / 'com,example' / f'{"B" * 32}.txt'), 'content': ''},
+    ], tmp_path)
+
+    assert rebuild_manifest(tmp_path) == 1
+    assert 'A' * 32 in Manifest(tmp_path)
+
+
+def test_populate_results_resumes(standin, tmp_path):
+    client = IndexClient(outdir=tmp_path, transport=Transport(data_url_template=standin.url_template, retries=0))
+    missing = dict(standin.results[0], digest='M' * 32, filename=standin.results[0]['filename'].replace('00661', '00662'))
+    client.results = standin.results + [missing]
+    client.populate_results(threads=2)
+    requests = standin.requests
+
+    client.results = standin.results + [missing]
+    client.populate_results(threads=2)
+
+    assert len(client.results) == len(standin.results) + 1
+    assert standin.requests == requests + 1 # only the failed download is retried
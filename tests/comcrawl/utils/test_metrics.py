@@ -0,0 +1,78 @@
+import json
+import threading
+from comcrawl.core import IndexClient
+from comcrawl.core import index_client
+from comcrawl.utils.metrics import MetricsRegistry,MetricsExporter,METRICS
+from comcrawl.utils.transport import Transport
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('comcrawl_test_seconds', 'Test latencies.')
+    for value in (0.02, 0.02, 0.02, 0.4):
+        histogram.observe(value)
+
+    summary = registry.summary()['comcrawl_test_seconds']
+    assert summary['count'] == 4
+    assert summary['sum'] == 0.46
+    assert 0.01 < summary['p50'] <= 0.025
+    assert 0.25 < summary['p99'] <= 0.5
+
+
+def test_to_prometheus():
+    registry = MetricsRegistry()
+    registry.counter('comcrawl_test_total', 'Test counter.').inc(3)
+    registry.histogram('comcrawl_test_seconds').observe(0.003)
+
+    text = registry.to_prometheus()
+
+    assert '# TYPE comcrawl_test_total counter\ncomcrawl_test_total 3\n' in text
+    assert 'comcrawl_test_seconds_bucket{le="0.0025"} 0\n' in text
+    assert 'comcrawl_test_seconds_bucket{le="0.005"} 1\n' in text
+    assert 'comcrawl_test_seconds_bucket{le="+Inf"} 1\n' in text
+    assert 'comcrawl_test_seconds_count 1\n' in text
+
+
+def test_exporter_writes_textfile(tmp_path):
+    registry = MetricsRegistry()
+    counter = registry.counter('comcrawl_test_total')
+
+    with MetricsExporter(tmp_path / 'comcrawl.prom', interval=0.01, registry=registry):
+        counter.inc()
+
+    assert 'comcrawl_test_total 1' in (tmp_path / 'comcrawl.prom').read_text()
+    assert not list(tmp_path.glob('.*.tmp'))
+
+
+def test_populate_results_exports_metrics(standin, tmp_path):
+    client = IndexClient(outdir=tmp_path, transport=Transport(data_url_template=standin.url_template), metrics_dir=tmp_path / 'metrics')
+    records = METRICS.counter('comcrawl_records_total').value
+    misses = METRICS.counter('comcrawl_cache_misses_total').value
+
+    client.results = standin.results
+    client.populate_results(threads=2, resume=False)
+    client.results = standin.results
+    client.populate_results(threads=2, resume=False) # every extract is cached now
+
+    summary = json.loads((tmp_path / 'metrics/comcrawl.json').read_text())
+    assert summary['comcrawl_records_total'] - records == 2 * len(standin.results)
+    assert summary['comcrawl_cache_misses_total'] - misses == len(standin.results)
+    assert summary['comcrawl_fetch_seconds']['count'] >= 2 * len(standin.results)
+    assert 'comcrawl_cache_write_seconds_bucket' in (tmp_path / 'metrics/comcrawl.prom').read_text()
+
+
+def test_populate_results_forks_before_exporting(standin, tmp_path, monkeypatch):
+    threads_at_fork = []
+    make_process_pool = index_client.make_process_pool
+    def recording_pool(workers):
+        threads_at_fork.extend(threading.enumerate())
+        return make_process_pool(workers)
+    monkeypatch.setattr(index_client, 'make_process_pool', recording_pool)
+    client = IndexClient(outdir=tmp_path, transport=Transport(data_url_template=standin.url_template), metrics_dir=tmp_path / 'metrics')
+    before = set(threading.enumerate())
+
+    client.results = standin.results
+    client.populate_results(threads=2, extract_workers=1, resume=False)
+
+    assert threads_at_fork and set(threads_at_fork) <= before # the exporter thread starts after the fork
+    assert len(client.results) == len(standin.results)
@@ -0,0 +1,32 @@
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from comcrawl.utils.cache import CACHE_SCHEMA,read_cache,list_parquet_files,indexdir_to_jsonl
+from comcrawl.utils.migrate import migrate_cache
+from comcrawl.utils.query import query_cache
+
+
+def legacy_rows(indexdir, domain: str, start: int, count: int) -> list[dict]:
+    return [{'filepath': str(indexdir / domain / f'{chr(65 + i) * 32}.txt'), 'content': 'x' * (i + 1)} for i in range(start, start + count)]
+
+def write_legacy_cache(indexdir) -> None:
+    indexdir.mkdir(parents=True)
+    pq.write_table(pa.Table.from_pylist(legacy_rows(indexdir, 'com,a', 0, 3)), indexdir / f'{indexdir.name}_0.parquet')
+    pq.write_table(pa.Table.from_pylist(legacy_rows(indexdir, 'com,b', 3, 3)), indexdir / f'{indexdir.name}_1.parquet')
+    with open(indexdir_to_jsonl(indexdir, indexdir.name), 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(row) + '\n' for row in legacy_rows(indexdir, 'com,b', 6, 2))
+
+def test_migrate_cache(tmp_path):
+    indexdir = tmp_path / 'extracts' / '2024-26'
+    write_legacy_cache(indexdir)
+    before = read_cache(indexdir)
+    legacy_query = [row for chunk in query_cache(tmp_path, '2024-26', domain='com,b', as_dicts=True) for row in chunk]
+
+    assert migrate_cache(indexdir, workers=2) == 8
+    assert len(list_parquet_files(indexdir)) == 3 # the journal rolled over
+    assert all(pq.ParquetFile(fp).schema_arrow == CACHE_SCHEMA for fp in list_parquet_files(indexdir))
+    assert indexdir_to_jsonl(indexdir, indexdir.name).read_text() == ''
+    assert read_cache(indexdir) == before
+    assert [row['domain'] for row in before] == ['com,a'] * 3 + ['com,b'] * 5
+    assert [row for chunk in query_cache(tmp_path, '2024-26', domain='com,b', as_dicts=True) for row in chunk] == legacy_query
+    assert migrate_cache(indexdir, workers=2) == 0 # nothing left to convert
@@ -1,5 +1,6 @@
 import threading
-from comcrawl.utils.multithreading import make_multithreaded
+import time
+from comcrawl.utils.multithreading import make_multithreaded,imap,imap_unordered
 
 
 def test_make_multithreaded():
@@ -18,3 +19,72 @@ def test_make_multithreaded():
 
     # -1 because ignoring the main thread
     assert max(list(thread_history.values())) - 1 == threads_to_use
+
+
+def test_make_multithreaded_refills_slots_while_one_task_is_slow():
+    last_started = threading.Event()
+
+    def initial_function(num):
+        if num == 0:
+            # only finishes once items beyond the first `threads` were started
+            assert last_started.wait(timeout=5)
+        if num == 19:
+            last_started.set()
+        return num
+
+    multithreaded_function = make_multithreaded(initial_function, threads=4)
+    results = multithreaded_function(iter(range(20)))
+
+    assert sorted(results) == list(range(20))
+
+
+def test_make_multithreaded_flattens_and_drops_failures():
+    def initial_function(num):
+        if num == 3:
+            raise ValueError('failed')
+        return [num, num] if num % 2 else num
+
+    multithreaded_function = make_multithreaded(initial_function, threads=2)
+
+    assert sorted(multithreaded_function([1, 2, 3, 4])) == [1, 1, 2, 4]
+
+
+def test_imap_yields_in_input_order_with_bounded_buffer():
+    started = []
+
+    def initial_function(num):
+        started.append(num)
+        if num % 5 == 0:
+            time.sleep(0.05) # later tasks finish first
+        return num
+
+    for i, result in enumerate(imap(initial_function, iter(range(20)), threads=4, buffer_size=4)):
+        assert result == i
+        assert len(started) <= i + 4 # never more than buffer_size ahead of the consumer
+
+
+def test_imap_unordered_streams_results():
+    stream = imap_unordered(lambda num: [num, num], iter(range(5)), threads=2)
+
+    assert next(stream) in range(5)
+    assert len(list(stream)) == 9
+
+
+def test_imap_unordered_caps_weight_in_flight():
+    lock = threading.Lock()
+    in_flight = []
+    peaks = []
+
+    def initial_function(num):
+        with lock:
+            in_flight.append(num)
+            peaks.append(list(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.remove(num)
+        return num
+
+    results = list(imap_unordered(initial_function, [5, 1, 4, 2, 3, 12], threads=4, weight=lambda num: num, max_weight=6))
+
+    assert sorted(results) == [1, 2, 3, 4, 5, 12]
+    assert all(sum(peak) <= 6 or peak == [12] for peak in peaks) # heavier than the cap, so it ran alone
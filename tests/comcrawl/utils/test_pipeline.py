@@ -0,0 +1,106 @@
+import os
+import signal
+import threading
+from comcrawl.utils.transport import Transport
+from comcrawl.utils.download import get_multiple_extracts,load_single_records
+from comcrawl.utils import pipeline
+from comcrawl.utils.pipeline import get_multiple_extracts_pipelined,StageQueue,make_process_pool
+from comcrawl.utils.cache import read_cache,write_cache
+
+
+def test_pipeline_extracts_every_record(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+
+    results = get_multiple_extracts_pipelined(
+        standin.results, load_single_records, tmp_path, threads=3, transport=transport, extract_workers=2, queue_size=1,
+    )
+
+    assert len(results) == len(standin.results)
+    cache = read_cache(tmp_path / 'extracts/2024-26')
+    assert sorted(row['content'][:21] for row in cache) == sorted(f'Example page number {i}' for i in range(10))
+
+
+def test_pipeline_with_coalescing(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+
+    results = get_multiple_extracts(standin.results, tmp_path, threads=2, transport=transport, coalesce=True, extract_workers=2)
+
+    assert len(results) == len(standin.results)
+    assert standin.requests == 1
+    assert len(read_cache(tmp_path / 'extracts/2024-26')) == len(standin.results)
+
+
+def test_pipeline_skips_empty_records(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template, retries=0)
+    missing = dict(standin.results[0], filename=standin.results[0]['filename'].replace('00661', '00662'))
+
+    results = get_multiple_extracts_pipelined([missing], load_single_records, tmp_path, transport=transport, extract_workers=1)
+
+    assert results == [missing]
+    assert len(read_cache(tmp_path / 'extracts/2024-26')) == 0
+    assert (tmp_path / 'extracts/2024-26/2024-26.txt').read_text().strip().endswith(f"{missing['digest']}.txt") # listed as empty
+
+
+def test_stage_queue_holds_back_producer():
+    stage_queue = StageQueue(2)
+    stage_queue.reserve()
+    stage_queue.reserve()
+    blocked = threading.Thread(target=stage_queue.reserve, daemon=True)
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive() # full until the consumer takes a record
+
+    stage_queue.put(('result', b'payload', True))
+    assert stage_queue.get() == ('result', b'payload', True)
+    blocked.join(1)
+    assert not blocked.is_alive()
+
+
+def test_pipeline_with_parse_workers(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+
+    results = get_multiple_extracts_pipelined(
+        standin.results, load_single_records, tmp_path, threads=4, transport=transport, extract_workers=1, parse_workers=3,
+    )
+
+    assert len(results) == len(standin.results)
+    assert len(read_cache(tmp_path / 'extracts/2024-26')) == len(standin.results)
+
+
+def test_make_process_pool_stops_cache_writers_first(tmp_path):
+    write_cache([{'digest': 'a', 'content': 'text'}], tmp_path / '2024-26') # leaves a writer thread behind
+
+    with make_process_pool(1) as pool:
+        assert not [thread for thread in threading.enumerate() if thread.name.startswith('CacheWriter')] # none forked mid-write
+        assert pool.submit(len, 'abc').result() == 3
+    assert len(read_cache(tmp_path / '2024-26')) == 1
+
+
+def test_pipeline_with_broken_pool(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+    pool = make_process_pool(1)
+    for process in list(pool._processes.values()):
+        os.kill(process.pid, signal.SIGKILL) # e.g. the OOM killer
+        process.join()
+
+    results = get_multiple_extracts_pipelined(
+        standin.results, load_single_records, tmp_path, threads=2, transport=transport, extract_pool=pool,
+    )
+
+    assert len(results) == len(standin.results) # returned as failed instead of hanging
+    assert len(read_cache(tmp_path / 'extracts/2024-26')) == 0
+    pool.shutdown()
+
+
+def killing_stage(result, html):
+    os.kill(os.getpid(), signal.SIGKILL) # the worker dies mid-extract, e.g. segfault
+
+
+def test_pipeline_returns_when_a_worker_dies(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'extract_stage', killing_stage)
+    transport = Transport(data_url_template=standin.url_template)
+
+    results = get_multiple_extracts(standin.results, tmp_path, threads=2, transport=transport, extract_workers=2)
+
+    assert len(results) == len(standin.results)
+    assert len(read_cache(tmp_path / 'extracts/2024-26')) == 0 # failed, so retried on the next run
@@ -0,0 +1,59 @@
+import gzip
+from comcrawl.utils.planner import plan_spans, summarize_spans
+from comcrawl.utils.transport import Transport
+from comcrawl.utils.download import get_multiple_extracts
+from comcrawl.utils.cache import read_cache
+
+
+def make_result(filename, offset, length):
+    return {'filename': filename, 'offset': str(offset), 'length': str(length)}
+
+
+def test_plan_spans_merges_nearby_records():
+    results = [
+        make_result('a', 300, 100),
+        make_result('a', 0, 100),
+        make_result('a', 110, 100), # 10 byte gap
+        make_result('a', 10000, 100), # too far away
+        make_result('b', 0, 100), # other file
+    ]
+
+    spans = plan_spans(results, max_gap=50, max_span_bytes=1000)
+
+    assert [(span.filename, span.start, span.end, len(span.members)) for span in spans] == [
+        ('a', 0, 209, 2),
+        ('a', 300, 399, 1),
+        ('a', 10000, 10099, 1),
+        ('b', 0, 99, 1),
+    ]
+    assert [(m.offset, m.length) for m in spans[0].members] == [(0, 100), (110, 100)]
+    assert summarize_spans(spans) == {'records': 5, 'requests': 4, 'bytes': 510, 'wasted_bytes': 10}
+
+
+def test_plan_spans_respects_byte_budget():
+    results = [make_result('a', i * 100, 100) for i in range(10)]
+
+    spans = plan_spans(results, max_gap=0, max_span_bytes=300)
+
+    assert [len(span.members) for span in spans] == [3, 3, 3, 1]
+
+
+def test_span_slices_are_views(standin):
+    spans = plan_spans(standin.results)
+    content = standin.files[spans[0].filename]
+
+    slices = spans[0].slices(content)
+
+    assert len(spans) == 1
+    assert all(isinstance(zipped, memoryview) for _, zipped in slices)
+    assert all(gzip.decompress(zipped).startswith(b'WARC/1.0') for _, zipped in slices)
+
+
+def test_get_multiple_extracts_coalesced(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+
+    results = get_multiple_extracts(standin.results, tmp_path, threads=2, transport=transport, coalesce=True)
+
+    assert len(results) == len(standin.results)
+    assert standin.requests == 1
+    assert len(read_cache(tmp_path / 'extracts/2024-26')) == len(standin.results)
@@ -0,0 +1,44 @@
+import base64
+from comcrawl.utils.cache import CacheWriter,write_cache,flush_cache
+from comcrawl.utils.query import query_cache
+
+
+def digest(i: int) -> str:
+    return base64.b32encode(i.to_bytes(20, 'big')).decode('ascii')
+
+def cache_rows(basepath, index: str, domain: str, start: int, count: int) -> list[dict]:
+    return [
+        {'index': index, 'domain': domain, 'digest': digest(i), 'url': f'https://{domain}/{i}', 'content': 'x' * i}
+        for i in range(start, start + count)
+    ]
+
+def write_index(basepath, index: str) -> None:
+    writer = CacheWriter(basepath / f'extracts/{index}', max_json_lines=100, row_group_rows=10)
+    writer.write(cache_rows(basepath, index, 'com,a', 1, 10)) # row group 0
+    writer.write(cache_rows(basepath, index, 'com,b', 11, 10)) # row group 1
+    writer.close()
+
+def test_query_cache_skips_row_groups(tmp_path, capsys):
+    write_index(tmp_path, '2024-22')
+
+    batches = list(query_cache(tmp_path, '2024-22', domain='com,b', columns=['url']))
+
+    assert sum(batch.num_rows for batch in batches) == 10
+    assert all(batch.schema.names == ['url'] for batch in batches)
+    assert 'row groups = 1 / 2' in capsys.readouterr().out
+    list(query_cache(tmp_path, '2024-22', digest=digest(5)))
+    assert 'row groups = 1 / 2' in capsys.readouterr().out
+    list(query_cache(tmp_path, '2024-22', min_length=21))
+    assert 'row groups = 0 / 2' in capsys.readouterr().out
+
+def test_query_cache_across_indexes(tmp_path):
+    write_index(tmp_path, '2024-22')
+    write_index(tmp_path, '2024-26')
+    write_cache(cache_rows(tmp_path, '2024-26', 'com,b', 30, 2), tmp_path / 'extracts/2024-26') # jsonl tail
+    flush_cache(tmp_path / 'extracts/2024-26')
+
+    rows = [row for chunk in query_cache(tmp_path, ['2024-22', '2024-26'], domain='com,b', min_length=15, as_dicts=True) for row in chunk]
+
+    assert [len(row['content']) for row in rows] == list(range(15, 21)) * 2 + [30, 31]
+    assert list(query_cache(tmp_path, ['2024-22'], digest=digest(5), as_dicts=True))[0][0]['content'] == 'x' * 5
+    assert sum(batch.num_rows for batch in query_cache(tmp_path, ['2024-22'], url_prefix='https://com,a/1')) == 2 # 1 and 10
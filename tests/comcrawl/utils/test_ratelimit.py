@@ -0,0 +1,65 @@
+import time
+import pytest
+from comcrawl.utils.ratelimit import TokenBucket,SharedTokenBucket,RateLimiter,HostLimit
+from comcrawl.utils.transport import Transport
+from comcrawl.utils.download import request_single_record
+
+
+def test_token_bucket_waits_once_burst_is_spent():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+
+
+def test_token_bucket_debt_delays_next_reservation():
+    bucket = TokenBucket(rate=1000, capacity=1000)
+
+    bucket.charge(3000) # bytes only known after the response arrived
+
+    assert bucket.reserve(0) == pytest.approx(2, abs=0.05)
+
+
+def test_shared_token_bucket_shares_budget(tmp_path):
+    first = SharedTokenBucket(tmp_path / 'host.requests.bucket', rate=10, capacity=1)
+    second = SharedTokenBucket(tmp_path / 'host.requests.bucket', rate=10, capacity=1) # e.g. another job
+
+    assert first.reserve() == 0
+    assert second.reserve() == pytest.approx(0.1, abs=0.02)
+
+
+def test_rate_limiter_budgets_per_host():
+    rate_limiter = RateLimiter({
+        'data.commoncrawl.org': HostLimit(requests_per_s=1),
+        'index.commoncrawl.org': HostLimit(bytes_per_s=100),
+    })
+
+    assert rate_limiter.reserve('https://data.commoncrawl.org/a') == 0
+    assert rate_limiter.reserve('https://data.commoncrawl.org/b') > 0.9
+    assert rate_limiter.reserve('https://index.commoncrawl.org/c', expected_bytes=150) == pytest.approx(0.5, abs=0.05)
+    assert rate_limiter.reserve('https://example.com/d') == 0 # no limit
+
+
+def test_transport_respects_requests_per_s(standin):
+    rate_limiter = RateLimiter({'*': HostLimit(requests_per_s=10)})
+    transport = Transport(data_url_template=standin.url_template, rate_limiter=rate_limiter)
+
+    start_time = time.monotonic()
+    for result in standin.results + standin.results:
+        request_single_record(result, transport)
+
+    assert time.monotonic() - start_time >= 0.9 # 10 requests burst, 10 more at 10/s
+
+
+def test_transport_leaves_streamed_bodies_unread(standin):
+    rate_limiter = RateLimiter({'*': HostLimit(requests_per_s=100, bytes_per_s=10 ** 9)})
+    transport = Transport(data_url_template=standin.url_template, rate_limiter=rate_limiter)
+    standin.range_mode = 'none' # whole file sent
+
+    response = transport.get(transport.data_url(standin.results[0]['filename']), headers={'Range': 'bytes=0-9'}, stream=True)
+
+    assert not response._content_consumed # charged by the caller once read, if ever
+    response.close()
+    assert rate_limiter.limits_bytes('https://data.commoncrawl.org/a')
+    assert not RateLimiter({'*': HostLimit(requests_per_s=10)}).limits_bytes('https://data.commoncrawl.org/a')
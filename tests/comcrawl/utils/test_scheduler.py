@@ -0,0 +1,43 @@
+from itertools import islice
+from comcrawl.utils.planner import plan_spans
+from comcrawl.utils.scheduler import item_bytes,interleave_by_length
+from comcrawl.utils.transport import Transport
+from comcrawl.utils.download import get_multiple_extracts
+
+
+def make_result(length: int, offset: int = 0) -> dict:
+    return {'filename': 'a.warc.gz', 'offset': str(offset), 'length': str(length)}
+
+
+def test_item_bytes():
+    results = [make_result(100, 0), make_result(50, 100)]
+    spans = plan_spans(results)
+
+    assert item_bytes(results[0]) == 100
+    assert item_bytes(spans[0]) == 150
+    assert item_bytes(spans * 2) == 300
+
+
+def test_interleave_by_length():
+    results = [make_result(length) for length in (5, 1, 4, 2, 3)]
+
+    assert [item_bytes(result) for result in interleave_by_length(results)] == [5, 1, 4, 2, 3]
+    assert list(interleave_by_length([])) == []
+
+
+def test_interleave_by_length_window():
+    results = (make_result(length) for length in (5, 1, 4, 2, 3, 9, 7, 8))
+    interleaved = interleave_by_length(results, window=3)
+
+    assert [item_bytes(result) for result in islice(interleaved, 3)] == [5, 1, 4]
+    assert next(results)['length'] == '2' # the rest is not read ahead
+    assert [item_bytes(result) for result in interleaved] == [9, 3, 7, 8]
+
+
+def test_get_multiple_extracts_caps_bytes_in_flight(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+    largest = max(item_bytes(result) for result in standin.results)
+
+    results = get_multiple_extracts(standin.results, tmp_path, threads=5, transport=transport, max_bytes_in_flight=largest)
+
+    assert len(results) == len(standin.results)
@@ -0,0 +1,59 @@
+import pytest
+from comcrawl.core import IndexClient
+from comcrawl.utils.cache import read_cache,write_cache,flush_cache,indexdir_to_empties
+from comcrawl.utils.sharding import Shard,shard_of,select_shard,shard_dirs,merge_shards,register_shard
+from comcrawl.utils.transport import Transport
+
+
+def test_shard_parse():
+    assert Shard.parse('3/8') == Shard(3, 8)
+    assert Shard.parse('0/2', 'filename').key == 'filename'
+    assert Shard(3, 8).dirname == 'shard-3-of-8'
+    with pytest.raises(ValueError):
+        Shard.parse('8/8')
+    with pytest.raises(ValueError):
+        Shard.parse('three')
+
+
+def test_shards_partition_results(standin):
+    shards = [Shard(i, 3) for i in range(3)]
+    selected = [select_shard(standin.results, shard) for shard in shards]
+
+    assert sum(map(len, selected)) == len(standin.results)
+    assert all(shard_of(result, 3) == i for i, results in enumerate(selected) for result in results)
+    assert shard_of(standin.results[0], 3) == shard_of(dict(standin.results[0]), 3) # deterministic
+
+
+def test_sharded_clients_write_their_own_shard_and_merge(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+    indexdir = tmp_path / 'extracts/2024-26'
+
+    try:
+        for spec in ('0/2', '1/2'):
+            client = IndexClient(outdir=tmp_path, transport=transport, shard=spec)
+            client.results = standin.results
+            client.populate_results(threads=2)
+    finally:
+        register_shard(tmp_path, None)
+
+    assert [path.name for path in shard_dirs(indexdir)] == ['shard-0-of-2', 'shard-1-of-2']
+    assert read_cache(indexdir) == []
+
+    assert merge_shards(indexdir) == len(standin.results)
+    assert len(read_cache(indexdir)) == len(standin.results)
+    assert shard_dirs(indexdir) == [] # merged shards are not merged again
+    assert merge_shards(indexdir) == 0
+
+
+def test_merge_shards_keeps_empties(tmp_path):
+    indexdir = tmp_path / 'extracts/2024-26'
+    shard_dir = indexdir / Shard(0, 2).dirname
+    digest = 'SUCE2T6S4QQ2APMQ7EBM5ITYOWPV2UH3'
+    write_cache([{'index': '2024-26', 'domain': 'com,a', 'digest': digest, 'content': ''}], shard_dir)
+    flush_cache(shard_dir, forget=True)
+
+    assert merge_shards(indexdir) == 0
+    flush_cache(indexdir, forget=True)
+    assert indexdir_to_empties(indexdir, indexdir.name).read_text().splitlines() == [
+        str(indexdir / 'com,a' / f'{digest}.txt'), # where the merged extract would have been
+    ]
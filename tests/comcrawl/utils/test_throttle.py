@@ -0,0 +1,68 @@
+from comcrawl.utils.throttle import AdaptiveLimiter, backoff_delay
+from comcrawl.utils.transport import Transport
+from comcrawl.utils.download import request_single_record
+from comcrawl.utils.download_async import get_multiple_extracts_async
+from comcrawl.utils.metrics import METRICS
+
+
+def test_backoff_delay_is_bounded():
+    delays = [backoff_delay(attempt, base=1, cap=5) for attempt in range(10) for _ in range(20)]
+
+    assert all(0 <= delay <= 5 for delay in delays)
+    assert max(backoff_delay(0, base=1, cap=5) for _ in range(50)) <= 1
+
+
+def test_adaptive_limiter_decreases_and_recovers():
+    limiter = AdaptiveLimiter(16, cooldown=60)
+
+    limiter.on_throttle()
+    limiter.on_throttle() # same burst, within cooldown
+    assert limiter.limit == 8
+
+    for _ in range(1000):
+        limiter.on_success(0.1)
+    assert limiter.limit == 16
+
+
+def test_adaptive_limiter_holds_while_latency_is_high():
+    limiter = AdaptiveLimiter(16, cooldown=0)
+    limiter.on_success(0.1) # baseline
+    limiter.on_throttle()
+
+    for _ in range(100):
+        limiter.on_success(10)
+    assert limiter.limit == 8
+
+
+def test_transport_retries_throttled_requests(standin):
+    standin.throttle_first = 2
+    transport = Transport(data_url_template=standin.url_template, backoff_base=0.01)
+    retries = METRICS.counter('comcrawl_retries_total').value
+    throttles = METRICS.counter('comcrawl_throttle_events_total').value
+
+    raw_content = request_single_record(standin.results[0], transport)
+
+    assert len(raw_content) == int(standin.results[0]['length'])
+    assert standin.requests == 3
+    assert METRICS.counter('comcrawl_retries_total').value - retries == 2
+    assert METRICS.counter('comcrawl_throttle_events_total').value - throttles == 2
+
+
+def test_transport_gives_up_after_retries(standin):
+    standin.throttle_first = 100
+    transport = Transport(data_url_template=standin.url_template, retries=1, backoff_base=0.01)
+
+    raw_content = request_single_record(standin.results[0], transport)
+
+    assert raw_content == ""
+    assert standin.requests == 2
+
+
+def test_async_engine_retries_throttled_requests(standin, tmp_path):
+    standin.throttle_first = 3
+    transport = Transport(data_url_template=standin.url_template, backoff_base=0.01)
+
+    results = get_multiple_extracts_async(standin.results, tmp_path, concurrency=2, transport=transport)
+
+    assert len(results) == len(standin.results)
+    assert standin.requests == len(standin.results) + 3
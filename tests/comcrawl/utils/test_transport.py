@@ -0,0 +1,72 @@
+import gzip
+import threading
+from concurrent import futures
+from comcrawl.utils.transport import Transport
+from comcrawl.utils.download import request_single_record,get_multiple_extracts,iter_multiple_extracts
+from comcrawl.utils.cache import read_cache
+
+
+def test_request_single_record_reuses_connection(standin):
+    transport = Transport(data_url_template=standin.url_template)
+
+    for result in standin.results:
+        raw_content = request_single_record(result, transport)
+        assert gzip.decompress(raw_content).startswith(b'WARC/1.0')
+
+    assert standin.requests == len(standin.results)
+    assert len(standin.connections) == 1
+
+
+def test_transport_one_session_per_thread(standin):
+    threads = 3
+    transport = Transport(data_url_template=standin.url_template)
+    transport.resize(threads)
+
+    with futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        raw_contents = list(executor.map(lambda result: request_single_record(result, transport), standin.results * 3))
+
+    assert all(len(raw_content) > 0 for raw_content in raw_contents)
+    assert len(standin.connections) <= threads
+
+
+def test_transport_evicts_without_closing_sessions_in_use():
+    transport = Transport(pool_size=1)
+    ready, done = threading.Event(), threading.Event()
+    held = {}
+    def worker():
+        held['session'] = transport.session()
+        ready.set()
+        done.wait(5) # mid-request
+    thread = threading.Thread(target=worker)
+    thread.start()
+    ready.wait(5)
+
+    closed = []
+    held['session'].close = lambda: closed.append(True)
+    mine = transport.session() # evicts the worker's session
+    transport.resize(1)
+    assert not closed
+    done.set()
+    thread.join()
+
+    assert transport.session() is mine
+
+
+def test_get_multiple_extracts_with_transport(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+
+    results = get_multiple_extracts(standin.results, tmp_path, threads=2, transport=transport)
+
+    assert len(results) == len(standin.results)
+    assert len(standin.connections) <= 2
+    cache = read_cache(tmp_path / 'extracts/2024-26')
+    assert len(cache) == len(standin.results)
+    assert all(row['content'].startswith('Example page number') for row in cache)
+
+
+def test_iter_multiple_extracts_ordered(standin, tmp_path):
+    transport = Transport(data_url_template=standin.url_template)
+
+    results = iter_multiple_extracts(standin.results, tmp_path, threads=3, transport=transport, ordered=True, buffer_size=3)
+
+    assert [result['url'] for result in results] == [result['url'] for result in standin.results]
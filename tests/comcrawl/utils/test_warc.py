@@ -0,0 +1,71 @@
+import gzip
+import pytest
+from comcrawl.utils.warc import parse_warc_record, iter_warc_records, WarcFormatError
+from benchmarks.standin import make_warc_record
+
+
+def make_record(http_block: bytes, content_length: int = None, warc_type: bytes = b'response') -> bytes:
+    length = len(http_block) if content_length is None else content_length
+    return (
+        b'WARC/1.0\r\n'
+        b'WARC-Type: ' + warc_type + b'\r\n'
+        b'Content-Length: ' + str(length).encode() + b'\r\n'
+        b'\r\n' + http_block + b'\r\n\r\n'
+    )
+
+
+def test_parse_warc_record_gzipped():
+    record = parse_warc_record(make_warc_record('https://www.example.com/', '<html>你好</html>'))
+
+    assert record.warc_type == 'response'
+    assert record.warc_headers['warc-target-uri'] == 'https://www.example.com/'
+    assert record.http_status == 200
+    assert isinstance(record.payload, memoryview)
+    assert record.text() == '<html>你好</html>'
+
+
+def test_parse_warc_record_declared_charset():
+    body = '<html>香港</html>'.encode('big5')
+    http_block = b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset="big5"\r\n\r\n' + body
+
+    record = parse_warc_record(make_record(http_block))
+
+    assert record.charset == 'big5'
+    assert record.text() == '<html>香港</html>'
+
+
+def test_parse_warc_record_chunked():
+    http_block = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\n<html\r\n2;ext=1\r\n/>\r\n0\r\n\r\n'
+
+    record = parse_warc_record(make_record(http_block))
+
+    assert bytes(record.payload) == b'<html/>'
+
+
+def test_parse_warc_record_extra_crlf_quirk():
+    http_block = b'HTTP/1.1 200 OK\r\n\r\n\r\n<html/>'
+    data = make_record(http_block, content_length=len(http_block) - 2) # off by 2, like CC-MAIN-2018-34
+
+    assert bytes(parse_warc_record(data, '2018-34').payload) == b'<html/>'
+    assert bytes(parse_warc_record(data).payload) == b'\r\n<html'
+
+
+def test_parse_warc_record_without_http():
+    record = parse_warc_record(make_record(b'software: test', warc_type=b'warcinfo'))
+
+    assert record.warc_type == 'warcinfo'
+    assert record.http_status is None
+    assert bytes(record.payload) == b'software: test'
+
+
+def test_iter_warc_records():
+    data = gzip.decompress(make_warc_record('https://a/', 'a') + make_warc_record('https://b/', 'b'))
+
+    records = list(iter_warc_records(data))
+
+    assert [record.text() for record in records] == ['a', 'b']
+
+
+def test_parse_warc_record_invalid():
+    with pytest.raises(WarcFormatError):
+        parse_warc_record(b'HTTP/1.1 200 OK\r\n\r\n<html/>')
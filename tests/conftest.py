@@ -0,0 +1,27 @@
+import threading
+import pytest
+from comcrawl.utils.cache import flush_cache
+from benchmarks.standin import StandinServer, make_warc_file
+
+FILENAME = 'crawl-data/CC-MAIN-2024-26/segments/1/warc/CC-MAIN-20240614075213-20240614105213-00661.warc.gz'
+PAGES = [
+    (f'https://www.example.com/page-{i}', f'<html><body><article><p>Example page number {i}. ' * 5 + '</p></article></body></html>')
+    for i in range(10)
+]
+
+
+@pytest.fixture
+def standin():
+    """Local Common Crawl stand-in serving one synthetic WARC file, with its index results attached."""
+    content, results = make_warc_file(FILENAME, PAGES)
+    with StandinServer({FILENAME: content}) as server:
+        server.results = results
+        yield server
+
+
+@pytest.fixture(autouse=True)
+def stop_cache_writers():
+    """Stops the cache writer threads a test started, so none outlive it (e.g. across forks in later tests)."""
+    yield
+    flush_cache(forget=True)
+    assert not [thread.name for thread in threading.enumerate() if thread.name.startswith('CacheWriter')]
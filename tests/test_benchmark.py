@@ -0,0 +1,25 @@
+from benchmarks.throughput import run_benchmark, percentile
+
+
+def test_percentile():
+    assert percentile([], 50) == 0
+    assert percentile(list(range(1, 101)), 50) == 50
+    assert percentile(list(range(1, 101)), 99) == 99
+
+
+def test_run_benchmark_reports_throughput():
+    report = run_benchmark(records=30, files=3, page_size=512, threads=4, coalesce=True)
+
+    assert report['records'] == 30
+    assert report['requests'] == 3 # one coalesced read per file
+    assert report['records_per_s'] > 0
+    assert report['latency_p99_ms'] >= report['latency_p50_ms']
+    assert report['peak_rss_mb'] > 0
+
+
+def test_run_benchmark_through_client_with_errors():
+    report = run_benchmark(records=20, files=2, page_size=512, latency=0.01, error_rate=0.5, threads=4, client=True)
+
+    assert report['records'] == 20
+    assert report['requests'] > 20 # throttled requests are retried
+    assert report['latency_p50_ms'] >= 10